@@ -0,0 +1,568 @@
+# Benchmarks for the hot paths of ff_locust, without a real target or table server.
+#
+# python benchmarks/bench_ff_locust.py [--quick | --full] [--only request_events,tables,...]
+#                                      [--output results.json] [--baseline baseline.json] [--save-baseline baseline.json]
+#
+# Results are printed as JSON: {"meta": {...}, "results": {"<benchmark>.<case>.<metric>": value}, "comparison": {...}}.
+# Metrics ending in _per_s are better when higher, every other metric (ms, us, bytes) when lower.
+# With --baseline every metric is compared to the stored run and the exit status is 1 when one got
+# worse by more than --threshold (default 0.2 = 20%). --save-baseline stores this run as the baseline.
+# Baselines are only comparable on the same machine and the same versions, see "meta".
+#
+# Benchmarks:
+#   startup        - import time of locust and ff_locust, FF_Locust() construction (fresh interpreter)
+#   request_events - request_success/request_failure listeners: max events/s, CPU per event at a fixed rate,
+#                    with raw, aggregated and binary (FF_METRIC_TRANSPORT) url metrics
+#   encoder        - ff_metric, encode_url and binary frame encode/decode ns per metric
+#   tables         - generated tsv tables (1k, 100k, 1M rows, 5M with --full) loaded as tsv, streamed and compiled:
+#                    load time, memory, get_data_next/get_data_random rows/s per policy and mode
+#   table_server   - get_data_next/get_data_random against a local fake table server, with and without prefetch
+#   stats          - print_stats/print_percentiles over many stats entries
+#   open_loop      - arrival schedule precomputation
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+# FF_LOG lines are not part of what is measured, but still formatted and buffered like in a real run
+os.environ.setdefault('FF_LOG_SINK', 'file:' + os.devnull)
+
+
+##############################################################################
+# Fake table server, run in its own process (--serve-table) so its cost doesn't count against the client.
+# Serves /list/get/<table>/metadata, /next, /random and /batch?count=<n> over rows {"name": "user<i>"},
+# every response delayed by delay_s (--serve-delay-ms) to stand in for a slow server.
+def serve_table(row_count, delay_s = 0.0):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    state = {"index": 0, "loop_count": 0}
+    lock = threading.Lock()
+
+    def next_row(table):
+        with lock:
+            index = state['index']
+            row = {"__list": table, "__index": index, "loop_count": state['loop_count'], "__list_count": row_count, "name": "user{}".format(index)}
+            state['index'] += 1
+            if state['index'] == row_count:
+                state['index'] = 0
+                state['loop_count'] += 1
+        return row
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if delay_s:
+                time.sleep(delay_s)
+            path, _, query = self.path.partition('?')
+            parts = path.strip('/').split('/')
+            table = parts[2] if len(parts) > 3 else ''
+            if parts[-1] == 'metadata':
+                body = {"__list": table, "loop_count": state['loop_count'], "__list_count": row_count}
+            elif parts[-1] == 'next':
+                body = next_row(table)
+            elif parts[-1] == 'random':
+                index = random.randrange(row_count)
+                body = {"__list": table, "__index": index, "__list_count": row_count, "name": "user{}".format(index)}
+            elif parts[-1] == 'batch':
+                count = int(query.partition('count=')[2] or 1)
+                body = [next_row(table) for _ in range(count)]
+            else:
+                body = {"ok": True}
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 1024 # the default backlog of 5 drops concurrent connects, which then wait for a SYN retry
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+##############################################################################
+# Helpers
+
+# resident set size in bytes, 0 where /proc is not available
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+# calls per second of function, called in batches until min_time_s passed
+def rate(function, min_time_s, batch = 100):
+    import gevent
+    function() # first call builds caches, cursors and samplers
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            function()
+        count += batch
+        gevent.sleep(0) # let the log buffer flush like it would between tasks
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time_s:
+            return count / elapsed
+
+
+# FF_Locust built with env set, detached from locust's events when done so instances don't add up.
+# Some settings are read on first use, so env stays set until the instance is done.
+@contextlib.contextmanager
+def ff_instance(**env):
+    import ff_locust
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update({name: str(value) for name, value in env.items()})
+    try:
+        ff = ff_locust.FF_Locust()
+        try:
+            yield ff
+        finally:
+            close_instance(ff)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def close_instance(ff):
+    from locust import events
+    for name in ('request_success', 'request_failure', 'spawning_complete', 'test_stop', 'test_start', 'user_error',
+            'init', 'quitting', 'worker_report', 'report_to_master'):
+        hook = getattr(events, name)
+        for listener in list(hook._handlers):
+            if getattr(listener, '__self__', None) is ff or getattr(listener, '__name__', None) == 'timed':
+                hook.remove_listener(listener)
+    if ff.stats_exporter is not None:
+        ff.stats_exporter.stop()
+    if ff.url_aggregator is not None:
+        ff.url_aggregator.close()
+    if ff.table_client is not None:
+        ff.table_client.close()
+    for prefetch in ff.table_prefetch.values():
+        prefetch.stop()
+    ff.log_buffer.flush()
+
+
+# locust environment with a local runner, as hook_init gets it
+# built once: each local runner adds its own stats listeners to the global events, so later benches would pay for earlier ones
+_environment = None
+
+
+def locust_environment():
+    global _environment
+    if _environment is None:
+        from locust import events
+        from locust.env import Environment
+        _environment = Environment(events=events, host='http://localhost')
+        _environment.create_local_runner()
+    return _environment
+
+
+# tsv of row_count rows with text, int and float columns, reused when it already exists
+def generate_table(data_dir, row_count):
+    path = Path(data_dir) / 'bench_{}.tsv'.format(row_count)
+    if path.exists():
+        return path
+    rng = random.Random(row_count)
+    cities = ['Toronto', 'Ottawa', 'Montreal', 'Vancouver', 'Calgary', 'Halifax', 'Winnipeg', 'Regina']
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'w') as file:
+        file.write('id\tfirst_name\tlast_name\tcity\tage\tscore\n')
+        for start in range(0, row_count, 100000):
+            file.write(''.join('{}\tfirst{}\tlast{}\t{}\t{}\t{:.3f}\n'.format(i, i, i % 9973, cities[i % len(cities)], rng.randrange(18, 90), rng.random() * 100)
+                for i in range(start, min(row_count, start + 100000))))
+    os.replace(temp_path, path)
+    return path
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+##############################################################################
+# Benchmarks, each returns {"<case>.<metric>": value}
+
+def bench_startup(options):
+    code = ('import json, time; t0 = time.perf_counter(); import locust; t1 = time.perf_counter(); import ff_locust; '
+        't2 = time.perf_counter(); ff_locust.FF_Locust(); t3 = time.perf_counter(); '
+        'print(json.dumps({"import_locust_ms": (t1 - t0) * 1000, "import_ff_locust_ms": (t2 - t1) * 1000, "construct_ms": (t3 - t2) * 1000}))')
+    runs = []
+    for _ in range(3 if options.quick else 5):
+        output = subprocess.run([sys.executable, '-c', code], cwd=str(REPO), capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    # best of the runs, the others mostly measure disk cache noise
+    return {'cold.' + name: round(min(run[name] for run in runs), 3) for name in runs[0]}
+
+
+def bench_request_events(options):
+    from locust import events
+    import gevent
+    results = {}
+    # binary: url metrics go to FF_METRIC_TRANSPORT, a udp socket nobody reads (the kernel drops what doesn't fit)
+    collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    collector.bind(('127.0.0.1', 0))
+    transport = 'udp:127.0.0.1:{}'.format(collector.getsockname()[1])
+    for mode, env in (
+            ('raw', {'FF_URL_METRIC_MODE': 'raw'}),
+            ('aggregate', {'FF_URL_METRIC_MODE': 'aggregate'}),
+            ('binary', {'FF_URL_METRIC_MODE': 'raw', 'FF_METRIC_TRANSPORT': transport})):
+        with ff_instance(**env) as ff:
+            ff.hook_init(locust_environment())
+            success = lambda: events.request_success.fire(request_type='GET', name='/api/item', response_time=12.3, response_length=512)
+            failure = lambda: events.request_failure.fire(request_type='POST', name='/api/order', response_time=250.0, response_length=0, exception=ValueError('HTTP 500'))
+            results[mode + '.success_events_per_s'] = round(rate(success, options.min_time_s, 1000))
+            results[mode + '.failure_events_per_s'] = round(rate(failure, options.min_time_s, 1000))
+            # fixed rate: CPU time per event and share of one core at options.event_rate events/s
+            interval_s = 0.01
+            per_tick = max(1, int(options.event_rate * interval_s))
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            fired = 0
+            while time.perf_counter() - start < options.min_time_s:
+                for _ in range(per_tick):
+                    success()
+                fired += per_tick
+                gevent.sleep(max(0.0, start + fired / options.event_rate - time.perf_counter()))
+            cpu_s = time.process_time() - cpu_start
+            elapsed = time.perf_counter() - start
+            results[mode + '.fixed_rate_cpu_us_per_event'] = round(cpu_s * 1e6 / fired, 3)
+            results[mode + '.fixed_rate_cpu_share'] = round(cpu_s / elapsed, 4)
+            if ff.metric_transport is not None:
+                ff.metric_transport.close()
+    collector.close()
+    return results
+
+
+def bench_encoder(options):
+    results = {}
+    with ff_instance() as ff:
+        encoder = ff.metric_encoder
+        fields = {"request_count": 10, "total_time_ms": 13, "content_length_bytes": 512}
+        tags = {"operation": "/api/item", "method": "GET", "is_success": True}
+        count = 20000
+        for name, function in (
+                ('ff_metric', lambda: ff.ff_metric("url", fields, tags)),
+                ('encode_url', lambda: encoder.encode_url(12.3, 512, "/api/item", "GET", True))):
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                for _ in range(count):
+                    function()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name + '.ns_per_metric'] = round(best * 1e9 / count, 1)
+    # binary frames of FF_METRIC_TRANSPORT, encoded and decoded per batch
+    import ff_locust
+    records = [(1613070277418, 13, 512, "/api/item/{}".format(i % 50), "GET", True) for i in range(count)]
+    records += [(1613070277418, "operation", fields, {"operation": "/api/item/{}".format(i % 50), "method": "GET"}) for i in range(count)]
+    frame_encoder = ff_locust.FF_Frame_Encoder()
+    start = time.perf_counter()
+    batches = frame_encoder.encode_batches(records)
+    results['frame_encode.ns_per_metric'] = round((time.perf_counter() - start) * 1e9 / len(records), 1)
+    results['frame_encode.bytes_per_metric'] = round(sum(len(batch) for batch in batches) / len(records), 2)
+    start = time.perf_counter()
+    for batch in batches:
+        ff_locust.FF_Frame_Decoder().decode(batch)
+    results['frame_decode.ns_per_metric'] = round((time.perf_counter() - start) * 1e9 / len(records), 1)
+    return results
+
+
+def bench_tables(options):
+    import ff_locust
+    results = {}
+    data_dir = options.data_dir
+    sizes = [1000, 100000] if options.quick else [1000, 100000, 1000000]
+    if options.full:
+        sizes.append(5000000)
+    try:
+        ff_locust.import_pandas()
+        has_pandas = True
+    except ImportError:
+        has_pandas = False
+    for row_count in sizes:
+        started = time.perf_counter()
+        path = generate_table(data_dir, row_count)
+        results['generate.{}.ms'.format(row_count)] = round((time.perf_counter() - started) * 1000, 1)
+        compiled_path = ff_locust.FF_Table_Cache.compiled_path(path)
+        index_path = Path(str(path) + '.idx')
+        remove(compiled_path)
+        remove(index_path)
+        kinds = (['tsv'] if has_pandas else []) + ['stream'] + (['compiled'] if has_pandas else [])
+        for kind in kinds:
+            case = '{}.{}'.format(kind, row_count)
+            if kind == 'compiled':
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(sys.stderr):
+                    ff_locust.main(['compile', str(path)])
+                results[case + '.compile_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            env = {'FF_TABLE_STREAM_MIN_BYTES': 0} if kind == 'stream' else {}
+            with ff_instance(**env) as ff:
+                table = str(path) # absolute, get_table_path leaves it as is
+                rss_before = rss_bytes()
+                started = time.perf_counter()
+                if ff.reload_table(table) is False:
+                    raise RuntimeError('Failed to load {}'.format(table))
+                results[case + '.load_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                results[case + '.rss_bytes'] = max(0, rss_bytes() - rss_before)
+                results[case + '.next_rows_per_s'] = round(rate(lambda: ff.get_data_next(table), options.min_time_s))
+                results[case + '.next_shuffle_rows_per_s'] = round(rate(lambda: ff.get_data_next(table, policy='shuffle'), options.min_time_s))
+                results[case + '.next_weighted_rows_per_s'] = round(rate(lambda: ff.get_data_next(table, policy='weighted', weight_column='age'), options.min_time_s))
+                results[case + '.random_rows_per_s'] = round(rate(lambda: ff.get_data_random(table), options.min_time_s))
+                results[case + '.random_without_replacement_rows_per_s'] = round(rate(lambda: ff.get_data_random(table, mode='without_replacement') or ff.reload_table(table), options.min_time_s))
+                results[case + '.random_many_rows_per_s'] = round(100 * rate(lambda: ff.get_data_random_many(table, 100), options.min_time_s, 10))
+                if kind == 'stream':
+                    started = time.perf_counter()
+                    ff.get_data_random_many(table, 100, mode='reservoir')
+                    results['reservoir.{}.sample_100_ms'.format(row_count)] = round((time.perf_counter() - started) * 1000, 1)
+                ff.table_cache.evict(path)
+        if not options.keep_data:
+            remove(compiled_path)
+            remove(index_path)
+    if not has_pandas:
+        results['tsv.skipped_without_pandas'] = 1
+    return results
+
+
+def bench_table_server(options):
+    import gevent
+    import gevent.pool
+    results = {}
+    server = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), '--serve-table', '100000'], stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline())
+        url = 'http://127.0.0.1:{}/'.format(port)
+        concurrency = options.concurrency
+        for case, env in (
+                ('direct', {}),
+                ('prefetch', {'FF_TABLE_PREFETCH_BATCH': 100}),
+                ('prefetch_batch', {'FF_TABLE_PREFETCH_BATCH': 100, 'FF_TABLE_SERVER_BATCH_PATH': 'batch?count={count}'})):
+            with ff_instance(FF_TABLE_SERVER_URL=url, FF_TABLE_SERVER_POOL_SIZE=concurrency, **env) as ff:
+                ff.table_probe.join()
+                for name, function in (
+                        ('next', lambda: ff.get_data_next('users')),
+                        ('random', lambda: ff.get_data_random('users'))):
+                    if case != 'direct' and name == 'random':
+                        continue # prefetching only applies to /next
+                    function() # metadata and first prefetch batch
+                    done = []
+                    deadline = time.perf_counter() + options.min_time_s
+
+                    def user():
+                        count = 0
+                        while time.perf_counter() < deadline:
+                            function()
+                            count += 1
+                        done.append(count)
+                    start = time.perf_counter()
+                    pool = gevent.pool.Pool(concurrency)
+                    for _ in range(concurrency):
+                        pool.spawn(user)
+                    pool.join()
+                    results['{}.{}_rows_per_s'.format(case, name)] = round(sum(done) / (time.perf_counter() - start))
+                if case == 'direct':
+                    results['direct.random_many_rows_per_s'] = round(100 * rate(lambda: ff.get_data_random_many('users', 100), options.min_time_s, 1))
+    finally:
+        server.kill()
+        server.wait()
+    return results
+
+
+def bench_stats(options):
+    from locust.stats import RequestStats
+    results = {}
+    rng = random.Random(1)
+    for entry_count in ([100, 1000] if options.quick else [100, 1000, 10000]):
+        stats = RequestStats()
+        with ff_instance() as ff:
+            ff.hook_init(locust_environment())
+            for i in range(entry_count):
+                name = '/api/item/{}'.format(i)
+                for _ in range(50):
+                    response_time = rng.lognormvariate(4, 1)
+                    stats.log_request('GET', name, response_time, 512)
+                    ff.stats_exporter.record(name, 'GET', response_time)
+            case = 'entries_{}'.format(entry_count)
+            for name, function in (
+                    ('print_stats', lambda: ff.print_stats(stats)),
+                    ('print_percentiles', lambda: ff.print_percentiles(stats))):
+                calls = max(1, int(20000 / entry_count))
+                start = time.perf_counter()
+                for _ in range(calls):
+                    function()
+                ff.log_buffer.flush()
+                results['{}.{}_ms'.format(case, name)] = round((time.perf_counter() - start) * 1000 / calls, 3)
+            # whole test percentiles only, the fields locust's own bins give below
+            ff.stats_exporter.window_sketches.clear()
+            start = time.perf_counter()
+            for _ in range(calls):
+                ff.print_percentiles(stats)
+            ff.log_buffer.flush()
+            results[case + '.print_percentiles_no_window_ms'] = round((time.perf_counter() - start) * 1000 / calls, 3)
+            # locust's own response time bins, without sketches
+            ff.stats_exporter.sketches.clear()
+            ff.stats_exporter.window_sketches.clear()
+            start = time.perf_counter()
+            ff.print_percentiles(stats)
+            ff.log_buffer.flush()
+            results[case + '.print_percentiles_unsketched_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    return results
+
+
+def bench_open_loop(options):
+    import ff_locust
+    results = {}
+    count = 1000000
+    for name, build in (
+            ('constant', lambda: ff_locust.FF_Arrival_Schedule.constant(1000, count / 1000)),
+            ('ramp', lambda: ff_locust.FF_Arrival_Schedule.ramp(0, 2000, count / 1000)),
+            ('poisson', lambda: ff_locust.FF_Arrival_Schedule.poisson(1000, count / 1000, random.Random(1)))):
+        start = time.perf_counter()
+        schedule = build()
+        elapsed = time.perf_counter() - start
+        results[name + '.arrivals_per_s'] = round(len(schedule) / elapsed)
+    return results
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'request_events': bench_request_events,
+    'encoder': bench_encoder,
+    'tables': bench_tables,
+    'table_server': bench_table_server,
+    'stats': bench_stats,
+    'open_loop': bench_open_loop,
+}
+
+
+##############################################################################
+# Baseline comparison
+
+def is_higher_better(metric):
+    return metric.endswith('_per_s')
+
+
+# {metric: {"baseline", "current", "change"}} for metrics in both runs, change > 0 is an improvement
+def compare(results, baseline, threshold):
+    comparison = {}
+    regressions = []
+    for metric, current in sorted(results.items()):
+        previous = baseline.get(metric)
+        if not isinstance(previous, (int, float)) or not previous:
+            continue
+        change = (current - previous) / previous
+        if not is_higher_better(metric):
+            change = -change
+        comparison[metric] = {"baseline": previous, "current": current, "change": round(change, 4)}
+        if change < -threshold:
+            regressions.append(metric)
+    return comparison, regressions
+
+
+def versions():
+    result = {"python": platform.python_version()}
+    for name in ('locust', 'gevent', 'pandas', 'requests'):
+        try:
+            result[name] = __import__(name).__version__
+        except ImportError:
+            result[name] = None
+    return result
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='ff_locust benchmarks')
+    parser.add_argument('--quick', action='store_true', help='shorter runs and smaller tables')
+    parser.add_argument('--full', action='store_true', help='also run the 5M row table')
+    parser.add_argument('--only', help='comma separated benchmarks: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--baseline', help='compare against this results file, exit 1 on a regression')
+    parser.add_argument('--save-baseline', help='write the results to this file as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change that counts as a regression (default 0.2)')
+    parser.add_argument('--data-dir', help='directory for generated tables, kept between runs (default a temporary directory)')
+    parser.add_argument('--event-rate', type=float, default=10000, help='events/s of the fixed rate request event run (default 10000)')
+    parser.add_argument('--concurrency', type=int, default=32, help='greenlets calling the fake table server (default 32)')
+    parser.add_argument('--serve-table', type=int, metavar='ROWS', help=argparse.SUPPRESS)
+    parser.add_argument('--serve-delay-ms', type=float, default=0, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.serve_table is not None:
+        serve_table(options.serve_table, options.serve_delay_ms / 1000)
+        return 0
+
+    names = options.only.split(',') if options.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark {}'.format(', '.join(unknown)))
+    options.min_time_s = 0.3 if options.quick else 1.0
+    options.keep_data = options.data_dir is not None
+    temp_dir = None
+    if options.data_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='ff_locust_bench_')
+        options.data_dir = temp_dir.name
+
+    sys.path.insert(0, str(REPO))
+    import locust # monkey patches like a locustfile would, before ff_locust is imported
+    results = {}
+    # FF_Locust prints to stdout, keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in names:
+            started = time.perf_counter()
+            for metric, value in BENCHMARKS[name](options).items():
+                results[name + '.' + metric] = value
+            sys.stderr.write('{} done in {:.1f} s\n'.format(name, time.perf_counter() - started))
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+    report = {
+        "meta": dict(versions(), platform=platform.platform(), timestamp_epoch_ms=round(time.time() * 1000), quick=options.quick, full=options.full),
+        "results": results,
+    }
+    status = 0
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        comparison, regressions = compare(results, baseline.get('results', {}), options.threshold)
+        report['comparison'] = comparison
+        report['regressions'] = regressions
+        if regressions:
+            status = 1
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    for path in (options.output, options.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                file.write(output + '\n')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,26 +8,2385 @@ import time
 import traceback
 # To request table server API
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 # For environment variables
 import os
 # To manage file paths
 from pathlib import Path
 # To get a random line from file
 import random
-# Pandas - a greate data management tool
-# Used to read tsv
-import pandas as pd
 # math to compute ceil of floating point ms measurements
 import math
 # run aggregate metrics on interval
 import gevent
+import gevent.lock
+import gevent.monkey
+import gevent.pool
+import gevent.event
+# Buffer prefetched table server rows
+from collections import deque
 # Time code execution
 import time
+# Compact typed storage for table columns
+from array import array
+from itertools import accumulate, count, islice
+# Quantile lookups in FF_Quantile_Sketch
+from bisect import bisect_right
+# Stream very large tables straight from disk
+import mmap
+import struct
+# Command line entry point (python -m ff_locust compile users.tsv)
+import argparse
+import sys
+# Buffered FF_LOG output
+import atexit
+import socket
+from abc import ABC, abstractmethod
+
+# Pandas - a greate data management tool
+# Used to read tsv. Imported on first use so workers that only load compiled tables (.fft) never pay for it
+pd = None
+def import_pandas():
+    global pd
+    if pd is None:
+        import pandas
+        pd = pandas
+    return pd
+
+
+##############################################################################
+# Column oriented, compact in-memory copy of a tsv table.
+# Instead of one python dict per row, each column is stored as one block:
+#   int   columns -> array('q')
+#   float columns -> array('d')
+#   bool  columns -> array('b')
+#   low cardinality text -> array('q') of codes into a list of unique strings (-1 is missing)
+#   other text -> one utf-8 bytes block plus array('Q') of offsets (missing values in a set)
+#   mixed columns (values that aren't all text, e.g. bools with a missing cell) -> list of the values as pandas read them
+# Row dicts are only built when a row is handed out by row().
+#
+# A table can be compiled to a binary file (.fft) with save() and mapped back with
+# open_compiled() without pandas or any parsing. Layout, little endian:
+#   header: magic 'FFTBL001', u64 column count, u64 row count
+#   schema: per column 1 byte kind, u32 name length, utf-8 name
+#   blocks: per column its blocks in order, each u64 byte length + data, padded to 8 bytes
+#     q/d/b -> values
+#     c     -> codes, unique string offsets, unique string utf-8 block
+#     s     -> offsets, utf-8 block, sorted indexes of missing values
+#     o     -> offsets, utf-8 block of the JSON text of each value
+class FF_Table():
+    COMPILED_MAGIC = b'FFTBL001'
+    COMPILED_HEADER = struct.Struct('<8sQQ')
+    COMPILED_COLUMN = struct.Struct('<cI')
+    COMPILED_BLOCK = struct.Struct('<Q')
+
+    def __init__(self, columns, count, mm = None):
+        self.columns = columns # list of (name, kind, data)
+        self.count = count
+        self.mm = mm # mapping backing a compiled table
+        # row i is row row_start + i * row_step of the tsv, set for tables of a shard's rows (FF_Table_Cache.parse_tsv)
+        self.row_start = 0
+        self.row_step = 1
+
+    # Build from a pandas DataFrame
+    @staticmethod
+    def from_dataframe(df):
+        columns = []
+        for name in df.columns:
+            series = df[name]
+            kind = series.dtype.kind
+            if kind in ('i', 'u'):
+                columns.append((name, 'q', array('q', series.to_numpy(dtype='int64').tobytes())))
+            elif kind == 'f':
+                columns.append((name, 'd', array('d', series.to_numpy(dtype='float64').tobytes())))
+            elif kind == 'b':
+                columns.append((name, 'b', array('b', series.to_numpy(dtype='int8').tobytes())))
+            else:
+                columns.append(FF_Table.text_column(name, series))
+        return FF_Table(columns, len(df))
+
+    # Encode a text (object/string dtype) column, dictionary encoded when values repeat enough to be worth it.
+    # Columns with values other than text and missing ones keep every value as it is.
+    @staticmethod
+    def text_column(name, series):
+        values = series.tolist()
+        if any(not isinstance(value, str) and value is not None and value == value for value in values): # None/NaN are missing
+            return (name, 'o', values)
+        codes, uniques = series.factorize()
+        if len(uniques) * 2 <= len(series):
+            return (name, 'c', (array('q', codes.astype('int64').tobytes()), list(uniques)))
+        missing = set()
+        encoded = []
+        for index, value in enumerate(values):
+            if not isinstance(value, str): # None/NaN
+                missing.add(index)
+                encoded.append(b'')
+                continue
+            encoded.append(value.encode('utf-8'))
+        offsets = array('Q', accumulate(map(len, encoded), initial=0))
+        return (name, 's', (b''.join(encoded), offsets, missing))
+
+    def __len__(self):
+        return self.count
+
+    # row of the whole table that row index is, what __index reports
+    def table_index(self, index):
+        return self.row_start + index * self.row_step
+
+    # fresh dict for row at index, safe for the caller to modify
+    def row(self, index):
+        if self.columns is None:
+            raise ValueError('row of a closed FF table')
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('table row index out of range')
+        result = {}
+        for name, kind, data in self.columns:
+            if kind == 's':
+                blob, offsets, missing = data
+                if index in missing:
+                    result[name] = math.nan
+                else:
+                    result[name] = str(blob[offsets[index]:offsets[index + 1]], 'utf-8')
+            elif kind == 'c':
+                codes, uniques = data
+                code = codes[index]
+                result[name] = uniques[code] if code >= 0 else math.nan
+            elif kind == 'b':
+                result[name] = bool(data[index])
+            else: # q, d, o
+                result[name] = data[index]
+        return result
+
+    __getitem__ = row
+
+    # write the compiled binary format to file_path (via a temporary file, so readers never see a partial table)
+    def save(self, file_path):
+        path = Path(file_path)
+        temp_path = path.with_name(path.name + '.{}.tmp'.format(os.getpid()))
+        with open(temp_path, 'wb') as out:
+            out.write(FF_Table.COMPILED_HEADER.pack(FF_Table.COMPILED_MAGIC, len(self.columns), self.count))
+            for name, kind, data in self.columns:
+                encoded = name.encode('utf-8')
+                out.write(FF_Table.COMPILED_COLUMN.pack(kind.encode('ascii'), len(encoded)))
+                out.write(encoded)
+            FF_Table.write_padding(out)
+            for name, kind, data in self.columns:
+                if kind == 'c':
+                    codes, uniques = data
+                    encoded = [value.encode('utf-8') for value in uniques]
+                    blocks = (codes, array('Q', accumulate(map(len, encoded), initial=0)), b''.join(encoded))
+                elif kind == 's':
+                    blob, offsets, missing = data
+                    blocks = (offsets, blob, array('Q', sorted(missing)))
+                elif kind == 'o':
+                    encoded = [json.dumps(value, default=str).encode('utf-8') for value in data]
+                    blocks = (array('Q', accumulate(map(len, encoded), initial=0)), b''.join(encoded))
+                else:
+                    blocks = (data,)
+                for block in blocks:
+                    block = memoryview(block)
+                    out.write(FF_Table.COMPILED_BLOCK.pack(block.nbytes))
+                    out.write(block)
+                    FF_Table.write_padding(out)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def write_padding(out):
+        out.write(b'\0' * (-out.tell() % 8))
+
+    # memory map a file written by save(). Column data are views into the mapping, nothing is copied
+    # except the small per column lists (dictionary strings and missing value indexes) and mixed columns.
+    @staticmethod
+    def open_compiled(file_path):
+        with open(file_path, 'rb') as compiled_file:
+            mm = mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        magic, column_count, count = FF_Table.COMPILED_HEADER.unpack_from(mm, 0)
+        if magic != FF_Table.COMPILED_MAGIC:
+            raise ValueError('{} is not a compiled FF table'.format(file_path))
+        position = FF_Table.COMPILED_HEADER.size
+        schema = []
+        for _ in range(column_count):
+            kind, name_length = FF_Table.COMPILED_COLUMN.unpack_from(mm, position)
+            position += FF_Table.COMPILED_COLUMN.size
+            schema.append((str(view[position:position + name_length], 'utf-8'), kind.decode('ascii')))
+            position += name_length
+        position += -position % 8
+
+        def read_block():
+            nonlocal position
+            length, = FF_Table.COMPILED_BLOCK.unpack_from(mm, position)
+            start = position + FF_Table.COMPILED_BLOCK.size
+            position = start + length + (-length % 8)
+            return view[start:start + length]
+
+        columns = []
+        for name, kind in schema:
+            if kind == 'c':
+                codes = read_block().cast('q')
+                unique_offsets = read_block().cast('Q')
+                unique_blob = read_block()
+                uniques = [str(unique_blob[unique_offsets[i]:unique_offsets[i + 1]], 'utf-8') for i in range(len(unique_offsets) - 1)]
+                columns.append((name, kind, (codes, uniques)))
+            elif kind == 's':
+                offsets = read_block().cast('Q')
+                blob = read_block()
+                missing = set(read_block().cast('Q'))
+                columns.append((name, kind, (blob, offsets, missing)))
+            elif kind == 'o':
+                offsets = read_block().cast('Q')
+                blob = read_block()
+                columns.append((name, kind, [json.loads(str(blob[offsets[i]:offsets[i + 1]], 'utf-8')) for i in range(len(offsets) - 1)]))
+            elif kind in ('q', 'd', 'b'):
+                columns.append((name, kind, read_block().cast(kind)))
+            else:
+                raise ValueError('Unknown column type {} in compiled FF table {}'.format(kind, file_path))
+        return FF_Table(columns, count, mm)
+
+    # row() raises ValueError afterwards, the mapping of a compiled table is closed
+    def close(self):
+        self.columns = None # also drops the views into the mapping before closing it
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass # a caller still holds a view, the mapping is closed when it is garbage collected
+            self.mm = None
+
+
+##############################################################################
+# Read-only view of a tsv table that is too large to load into memory.
+# The file is memory mapped and rows are sliced out of the mapping by line offset,
+# so memory use stays flat regardless of file size. Offsets come from a sidecar
+# index file (<table>.tsv.idx) that is built with one linear scan and reused
+# as long as the tsv size and mtime match the ones recorded in its header.
+# Values are typed per field: empty -> NaN, True/False -> bool, then int, then float, else str.
+# Quoted fields are not interpreted, use the pandas loader for those tables.
+class FF_Stream_Table():
+    INDEX_MAGIC = b'FFIDX001'
+    INDEX_HEADER = struct.Struct('<8sQQQ') # magic, tsv size, tsv mtime_ns, row count
+    INDEX_CHUNK_ROWS = 65536 # offsets buffered per write while building the index
+
+    def __init__(self, file_path, stat = None):
+        self.path = Path(file_path)
+        if stat is None:
+            stat = self.path.stat()
+        self.file = open(self.path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.mm.find(b'\n')
+        if header_end < 0:
+            header_end = len(self.mm)
+        self.names = self.mm[:header_end].rstrip(b'\r').decode('utf-8').split('\t')
+        self.index_file = None
+        self.index_mm = None
+        self.offsets = self.open_index(stat, header_end + 1)
+        self.count = len(self.offsets) - 1
+
+    # path of the sidecar offset index
+    def index_path(self):
+        return self.path.with_name(self.path.name + '.idx')
+
+    # return a sequence of row start offsets (plus end offset), from a fresh sidecar or by scanning the tsv
+    def open_index(self, stat, first_row):
+        index_path = self.index_path()
+        try:
+            offsets = self.map_index(index_path, stat)
+            if offsets is not None:
+                return offsets
+        except (OSError, ValueError):
+            pass
+        try:
+            self.write_index(index_path, stat, first_row)
+            offsets = self.map_index(index_path, stat)
+            if offsets is not None:
+                return offsets
+        except OSError:
+            pass
+        # read-only directory: keep the index in memory instead
+        return array('Q', self.scan(first_row))
+
+    # memory map the sidecar if it exists and matches the tsv, else None
+    def map_index(self, index_path, stat):
+        if not index_path.exists():
+            return None
+        with open(index_path, 'rb') as header_file:
+            header = header_file.read(self.INDEX_HEADER.size)
+        if len(header) != self.INDEX_HEADER.size:
+            return None
+        magic, size, mtime_ns, count = self.INDEX_HEADER.unpack(header)
+        expected_length = self.INDEX_HEADER.size + (count + 1) * 8
+        if magic != self.INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns or index_path.stat().st_size != expected_length:
+            return None
+        index_file = open(index_path, 'rb')
+        index_mm = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_file = index_file
+        self.index_mm = index_mm
+        return memoryview(index_mm)[self.INDEX_HEADER.size:].cast('Q')
+
+    # yield the start offset of every non blank data row, then the end of file offset
+    def scan(self, first_row):
+        mm = self.mm
+        end = len(mm)
+        position = first_row
+        while position < end:
+            line_end = mm.find(b'\n', position)
+            if line_end < 0:
+                line_end = end
+            # skip blank lines like pandas does
+            if line_end > position and not (line_end == position + 1 and mm[position] == 13):
+                yield position
+            position = line_end + 1
+        yield end
+
+    # one linear scan of the tsv, written to a temporary file and atomically moved into place
+    def write_index(self, index_path, stat, first_row):
+        temp_path = index_path.with_name(index_path.name + '.{}.tmp'.format(os.getpid()))
+        count = -1 # the end offset is not a row
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, 0, 0, 0))
+            chunk = array('Q')
+            for offset in self.scan(first_row):
+                chunk.append(offset)
+                if len(chunk) >= self.INDEX_CHUNK_ROWS:
+                    count += len(chunk)
+                    chunk.tofile(index_file)
+                    chunk = array('Q')
+            count += len(chunk)
+            chunk.tofile(index_file)
+            index_file.seek(0)
+            index_file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, count))
+        os.replace(temp_path, index_path)
+
+    def __len__(self):
+        return self.count
+
+    def table_index(self, index):
+        return index
+
+    # fresh dict for row at index
+    def row(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('table row index out of range')
+        return FF_Stream_Table.parse_row(self.names, self.mm[self.offsets[index]:self.offsets[index + 1]])
+
+    __getitem__ = row
+
+    # dict of one raw tsv line (bytes, line ending optional) under column names
+    @staticmethod
+    def parse_row(names, line):
+        values = line.rstrip(b'\r\n').decode('utf-8').split('\t')
+        result = {}
+        for position, name in enumerate(names):
+            result[name] = FF_Stream_Table.parse_value(values[position]) if position < len(values) else math.nan
+        return result
+
+    @staticmethod
+    def parse_value(value):
+        if value == '':
+            return math.nan
+        if value == 'True' or value == 'False':
+            return value == 'True'
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    def close(self):
+        if self.index_mm is not None:
+            self.offsets.release()
+            self.index_mm.close()
+            self.index_file.close()
+            self.index_mm = None
+        self.mm.close()
+        self.file.close()
+
+
+##############################################################################
+# One worker's share of a table, for partitioned distributed runs.
+# Worker `index` of `count` gets rows index, index + count, ... (strided) or one
+# contiguous block of about len(table) / count rows (contiguous). Row i of the shard
+# is row start + i * step of the underlying table.
+class FF_Table_Shard():
+    def __init__(self, table, index, count, mode = 'strided'):
+        self.table = table
+        self.start, self.step, self.count = FF_Table_Shard.bounds(len(table), index, count, mode)
+
+    # (start, step, row count) of shard index/count of a table of row_count rows
+    @staticmethod
+    def bounds(row_count, index, count, mode):
+        if mode == 'contiguous':
+            start = row_count * index // count
+            return start, 1, row_count * (index + 1) // count - start
+        if mode == 'strided':
+            return index, count, len(range(index, row_count, count))
+        raise ValueError('Unknown table partition mode {}, expected strided or contiguous'.format(mode))
+
+    def __len__(self):
+        return self.count
+
+    def table_index(self, index):
+        return self.table.table_index(self.start + index * self.step)
+
+    def row(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('table row index out of range')
+        return self.table.row(self.start + index * self.step)
+
+    __getitem__ = row
+
+    def close(self):
+        if hasattr(self.table, 'close'):
+            self.table.close()
+
+
+##############################################################################
+# Uniformly random permutation of range(count), generated one element at a time
+# (Fisher-Yates). Swaps are kept in a dict while few elements were drawn, so sampling a
+# few rows of a huge table costs memory in proportion to the draws, and move to a full
+# array once the dict would be bigger than the array.
+class FF_Lazy_Permutation():
+    def __init__(self, count, rng = random):
+        self.count = count
+        self.rng = rng
+        self.position = 0
+        self.swaps = {} # position -> value, for positions whose value moved
+        self.values = None # array('q') once materialized
+
+    # next element of the permutation, None once all count elements were drawn
+    def next(self):
+        i = self.position
+        if i >= self.count:
+            return None
+        j = self.rng.randrange(i, self.count)
+        self.position = i + 1
+        values = self.values
+        if values is not None:
+            values[i], values[j] = values[j], values[i]
+            return values[i]
+        swaps = self.swaps
+        value_i = swaps.pop(i, i)
+        if j == i:
+            return value_i
+        value_j = swaps.get(j, j)
+        swaps[j] = value_i
+        if len(swaps) > self.count // 8 + 1024:
+            self.materialize()
+        return value_j
+
+    def materialize(self):
+        values = array('q', range(self.count))
+        for position, value in self.swaps.items():
+            values[position] = value
+        self.values = values
+        self.swaps = {}
+
+    def remaining(self):
+        return self.count - self.position
+
+
+##############################################################################
+# Walker/Vose alias table: O(1) draws of an index with probability proportional to its weight.
+# Missing, NaN and negative weights count as 0.
+class FF_Alias_Table():
+    def __init__(self, weights):
+        count = len(weights)
+        clean = [weight if weight == weight and weight > 0 else 0.0 for weight in weights] # NaN != NaN
+        total = sum(clean)
+        if count == 0 or total <= 0:
+            raise ValueError('Weighted sampling needs at least one positive weight')
+        scaled = [weight * count / total for weight in clean]
+        self.count = count
+        self.probability = array('d', bytes(8 * count))
+        self.alias = array('q', bytes(8 * count))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    # weights of a table column, numeric columns of an FF_Table are used without building rows
+    @staticmethod
+    def from_table(table, column):
+        if isinstance(table, FF_Table):
+            for name, kind, data in table.columns:
+                if name == column and kind in ('q', 'd', 'b'):
+                    return FF_Alias_Table(data)
+        elif len(table) and column not in table.row(0):
+            raise KeyError(column)
+        return FF_Alias_Table([FF_Alias_Table.number(table.row(i)[column]) for i in range(len(table))])
+
+    @staticmethod
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def draw(self, rng = random):
+        i = int(rng.random() * self.count)
+        if rng.random() < self.probability[i]:
+            return i
+        return self.alias[i]
+
+
+##############################################################################
+# Position in a local table for get_data_next, handing out one row index per call in O(1).
+# Policies:
+#   sequential - file order, wrapping around when looping
+#   shuffle    - every row once per pass in a random order (FF_Lazy_Permutation), a new order every pass
+#   weighted   - random rows with replacement, probability proportional to weight_column (FF_Alias_Table)
+# next() has no gevent yield point, so greenlets sharing a cursor always get distinct handouts.
+class FF_Table_Cursor():
+    POLICIES = ('sequential', 'shuffle', 'weighted')
+
+    def __init__(self, name, table, policy = 'sequential', weight_column = None, position = 0, rng = random):
+        if policy not in FF_Table_Cursor.POLICIES:
+            raise ValueError('Unknown policy {}, expected one of {}'.format(policy, ', '.join(FF_Table_Cursor.POLICIES)))
+        self.name = name
+        self.table = table
+        self.count = len(table)
+        self.policy = policy
+        self.weight_column = weight_column
+        self.rng = rng
+        self.position = position # rows handed out in this pass
+        self.loop_count = 0 # completed passes
+        self.permutation = None
+        self.alias = None
+        if policy == 'shuffle':
+            self.permutation = FF_Lazy_Permutation(self.count, rng)
+            for _ in range(position):
+                self.permutation.next()
+        elif policy == 'weighted':
+            if weight_column is None:
+                raise ValueError('The weighted policy needs a weight_column')
+            self.alias = FF_Alias_Table.from_table(table, weight_column)
+
+    # (row index, remaining count, wrapped around) or None at the end of a pass when not looping
+    def next(self, looping = True):
+        if self.alias is not None:
+            return self.alias.draw(self.rng), self.count, False
+        is_wrapped = False
+        if self.position >= self.count:
+            if not looping or self.count == 0:
+                return None
+            self.position = 0
+            self.loop_count += 1
+            is_wrapped = True
+            if self.permutation is not None:
+                self.permutation = FF_Lazy_Permutation(self.count, self.rng)
+        self.position += 1
+        if self.permutation is not None:
+            return self.permutation.next(), self.count - self.position, is_wrapped
+        return self.position - 1, self.count - self.position, is_wrapped
+
+
+##############################################################################
+# Random row indexes of a local table for get_data_random / get_data_random_many.
+# Modes:
+#   uniform             - with replacement
+#   without_replacement - every row at most once (FF_Lazy_Permutation), None once every row was drawn
+#   weighted            - with replacement, probability proportional to weight_column (FF_Alias_Table)
+# Every draw is O(1). rng is a random.Random, a seeded one makes the draws reproducible.
+class FF_Table_Sampler():
+    MODES = ('uniform', 'without_replacement', 'weighted')
+
+    def __init__(self, table, mode = 'uniform', weight_column = None, rng = random):
+        if mode not in FF_Table_Sampler.MODES:
+            raise ValueError('Unknown sampling mode {}, expected one of {}'.format(mode, ', '.join(FF_Table_Sampler.MODES + ('reservoir',))))
+        self.table = table
+        self.count = len(table)
+        self.mode = mode
+        self.weight_column = weight_column
+        self.rng = rng
+        self.permutation = None
+        self.alias = None
+        if mode == 'without_replacement':
+            self.permutation = FF_Lazy_Permutation(self.count, rng)
+        elif mode == 'weighted':
+            if weight_column is None:
+                raise ValueError('The weighted mode needs a weight_column')
+            self.alias = FF_Alias_Table.from_table(table, weight_column)
+        elif self.count == 0:
+            raise ValueError('Can not sample from an empty table')
+
+    # row index, None when sampling without replacement and every row was drawn
+    def draw(self):
+        if self.permutation is not None:
+            return self.permutation.next()
+        if self.alias is not None:
+            return self.alias.draw(self.rng)
+        return int(self.rng.random() * self.count)
+
+    # rows left to draw, count for the modes with replacement
+    def remaining(self):
+        if self.permutation is not None:
+            return self.permutation.remaining()
+        return self.count
+
+
+##############################################################################
+# Uniform sample of k rows of a tsv file without replacement, in one sequential pass and
+# without loading or indexing the file, for tables too large to load (or to index) at all.
+# Li's Algorithm L draws how many rows to skip before the next replacement, so only the
+# sampled rows are parsed. Values are typed like FF_Stream_Table rows.
+# Returns (rows in random order, [row index of each row], rows in the file).
+class FF_Reservoir_Sample():
+    @staticmethod
+    def sample(file_path, k, rng = random):
+        with open(file_path, 'rb') as file:
+            names = file.readline().rstrip(b'\r\n').decode('utf-8').split('\t')
+            counter = count()
+            # (row index, line), skipping blank lines like pandas does
+            rows = zip(counter, (line for line in file if line.rstrip(b'\r\n')))
+            reservoir = list(islice(rows, k))
+            row_count = len(reservoir)
+            if k > 0 and row_count == k:
+                weight = math.exp(math.log(FF_Reservoir_Sample.uniform(rng)) / k)
+                while True:
+                    skip = int(math.log(FF_Reservoir_Sample.uniform(rng)) / math.log1p(-weight))
+                    row = next(islice(rows, skip, None), None)
+                    if row is None:
+                        # zip pulled one number past the last row
+                        row_count = next(counter) - 1
+                        break
+                    reservoir[int(rng.random() * k)] = row
+                    weight *= math.exp(math.log(FF_Reservoir_Sample.uniform(rng)) / k)
+        rng.shuffle(reservoir)
+        return [FF_Stream_Table.parse_row(names, line) for _, line in reservoir], [index for index, _ in reservoir], row_count
+
+    # uniform in (0, 1), log of it is finite
+    @staticmethod
+    def uniform(rng):
+        value = rng.random()
+        while value == 0.0 or value >= 1.0:
+            value = rng.random()
+        return value
+
+
+##############################################################################
+# Cache of parsed local tsv tables (FF_Table), keyed by resolved file path.
+# A table is parsed once and reused until its mtime or size changes on disk,
+# so get_data_next/get_data_random don't re-read the whole file on every call.
+# Files of stream_min_bytes or more are not parsed, they are opened as FF_Stream_Table.
+# A compiled table next to the tsv (users.tsv -> users.fft) is used instead of the tsv
+# when it exists and is not older than the tsv, or when there is no tsv at all.
+# With a shard (worker index, worker count, mode) only that worker's rows are kept: parsed
+# tables keep only the shard's rows, streamed and compiled tables are wrapped in FF_Table_Shard.
+class FF_Table_Cache():
+    def __init__(self, stream_min_bytes = None, shard = None, check_interval_s = 1.0):
+        self.entries = {} # resolved tsv path -> {"table", "source", "mtime_ns", "size", "load_time_ms"}
+        self.stream_min_bytes = stream_min_bytes
+        self.shard = shard
+        self.check_interval_s = check_interval_s
+        self.checked = {} # file_path as passed to get() -> (resolved tsv path, time.monotonic() of the next check)
+
+    # return FF_Table for file_path, (re)loading it if it is new or has changed on disk.
+    # The path is resolved and the files are checked at most every check_interval_s per file_path,
+    # calls in between only look the table up.
+    def get(self, file_path):
+        checked = self.checked.get(file_path)
+        if checked is not None and time.monotonic() < checked[1]:
+            entry = self.entries.get(checked[0])
+            if entry is not None and entry['shard'] == self.shard:
+                return entry['table']
+        path = Path(file_path).resolve()
+        source, stat = FF_Table_Cache.find_source(path)
+        entry = self.entries.get(path)
+        if entry is None or entry['source'] != source or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size or entry['shard'] != self.shard:
+            entry = self.load(path, source, stat)
+        self.checked[file_path] = (path, time.monotonic() + self.check_interval_s)
+        return entry['table']
+
+    # compiled path for a tsv path
+    @staticmethod
+    def compiled_path(file_path):
+        return Path(file_path).with_suffix('.fft')
+
+    # (path, stat) of the file a table is read from, compiled table preferred over the tsv
+    @staticmethod
+    def find_source(path):
+        compiled_path = FF_Table_Cache.compiled_path(path)
+        if not os.path.exists(compiled_path):
+            return path, os.stat(path)
+        compiled_stat = os.stat(compiled_path)
+        if not os.path.exists(path):
+            return compiled_path, compiled_stat
+        stat = os.stat(path)
+        if compiled_stat.st_mtime_ns >= stat.st_mtime_ns:
+            return compiled_path, compiled_stat
+        return path, stat
+
+    # parse file_path unconditionally and store it in the cache
+    def load(self, file_path, source = None, stat = None):
+        path = Path(file_path).resolve()
+        if source is None:
+            source, stat = FF_Table_Cache.find_source(path)
+        t0 = time.time()
+        if source == path and (self.stream_min_bytes is None or stat.st_size < self.stream_min_bytes):
+            table = FF_Table_Cache.parse_tsv(path, self.shard) # only the shard's rows are kept
+        else:
+            # mapped tables: only the shard's pages are ever read
+            if source != path:
+                table = FF_Table.open_compiled(source)
+            else:
+                table = FF_Stream_Table(path, stat)
+            if self.shard is not None:
+                table = FF_Table_Shard(table, *self.shard)
+        self.evict(path)
+        entry = {
+            "table": table,
+            "source": source,
+            "shard": self.shard,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "load_time_ms": math.ceil((time.time() - t0) * 1000),
+        }
+        self.entries[path] = entry
+        return entry
+
+    # read a tsv with pandas into a compact FF_Table, of only the shard's rows when a shard is given
+    @staticmethod
+    def parse_tsv(file_path, shard = None):
+        if shard is None:
+            df = import_pandas().read_csv(file_path, sep='\t', header=0)
+            start, step = 0, 1
+        else:
+            df, start, step = FF_Table_Cache.read_shard(file_path, *shard)
+        table = FF_Table.from_dataframe(df)
+        del df # only the compact copy is kept
+        table.row_start, table.row_step = start, step
+        return table
+
+    # (DataFrame, start, step) of the rows of shard index/count of a tsv, its row i is row start + i * step
+    # of the tsv. The tsv is read SHARD_CHUNK_ROWS rows at a time and only the shard's rows are kept,
+    # so a worker never holds the whole table. A contiguous shard's bounds need the row count first,
+    # taken from a pass that only converts the first column. Column types are inferred from the shard's rows.
+    SHARD_CHUNK_ROWS = 100000
+
+    @staticmethod
+    def read_shard(file_path, index, count, mode):
+        pd = import_pandas()
+        if mode == 'contiguous':
+            with pd.read_csv(file_path, sep='\t', header=0, usecols=[0], chunksize=FF_Table_Cache.SHARD_CHUNK_ROWS) as reader:
+                row_count = sum(len(chunk) for chunk in reader)
+            start, step, shard_count = FF_Table_Shard.bounds(row_count, index, count, mode)
+            stop = start + shard_count
+        else:
+            start, step, _ = FF_Table_Shard.bounds(0, index, count, mode) # strided: every step-th row from start
+            stop = None
+        parts = []
+        first = 0 # table row of the chunk's first row
+        with pd.read_csv(file_path, sep='\t', header=0, chunksize=FF_Table_Cache.SHARD_CHUNK_ROWS) as reader:
+            for chunk in reader:
+                if stop is not None and first >= stop:
+                    break
+                offset = start - first if start >= first else (start - first) % step
+                end = len(chunk) if stop is None else min(len(chunk), stop - first)
+                if offset < end:
+                    parts.append(chunk.iloc[offset:end:step].copy()) # a copy, a view would keep the whole chunk
+                first += len(chunk)
+        if not parts: # empty shard, only the columns
+            return pd.read_csv(file_path, sep='\t', header=0, nrows=0), start, step
+        return (pd.concat(parts) if len(parts) > 1 else parts[0]), start, step
+
+    # drop file_path from the cache, next get() will parse it again
+    def evict(self, file_path):
+        entry = self.entries.pop(Path(file_path).resolve(), None)
+        if entry is not None and hasattr(entry['table'], 'close'):
+            entry['table'].close()
+
+
+##############################################################################
+# HTTP client for the RedWolf table server.
+# One keep-alive session is shared by every simulated user, with a connection pool
+# sized to the user count (resize()), so rows don't pay for a new TCP/TLS connection each.
+# Only connection failures and gateway errors are retried: a read that timed out may
+# already have advanced the table's /next cursor on the server.
+#
+# Locust monkey patches the socket module, so the session's sockets yield to other
+# greenlets while waiting and a slow table server only delays the users waiting on it.
+# At most max_concurrency calls are in flight at once, and every call, including the
+# wait for a free slot and any retries, is bounded by deadline_s.
+class FF_Table_Client():
+    def __init__(self, url, pool_size = 10, timeout_s = 10.0, connect_timeout_s = 3.0, retries = 2, backoff_s = 0.1, max_concurrency = 64, deadline_s = 15.0):
+        self.url = url
+        self.timeout = (connect_timeout_s, timeout_s)
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.deadline_s = deadline_s
+        self.slots = gevent.lock.BoundedSemaphore(max(1, max_concurrency))
+        self.pool_size = None
+        self.adapter = None
+        self.session = requests.Session()
+        self.counters = {
+            "request_count": 0, # requests sent by callers
+            "error_count": 0, # requests that raised (after retries)
+            "deadline_count": 0, # requests abandoned at deadline_s
+            "wait_count": 0, # requests that had to wait for a free concurrency slot
+            "closed_connection_count": 0, # connections opened by pools that were since resized away
+        }
+        self.resize(pool_size)
+
+    # True when sockets are gevent cooperative, i.e. a waiting call doesn't block the worker
+    @staticmethod
+    def is_cooperative():
+        return gevent.monkey.is_module_patched('socket')
+
+    # (re)mount the session adapter with a pool of pool_size keep-alive connections per host
+    def resize(self, pool_size):
+        pool_size = max(1, int(pool_size))
+        if pool_size == self.pool_size:
+            return
+        retry = Retry(total=self.retries, connect=self.retries, read=0, status=self.retries,
+            status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET']),
+            backoff_factor=self.backoff_s, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        old_adapter = self.adapter
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.adapter = adapter
+        self.pool_size = pool_size
+        if old_adapter is not None:
+            self.counters['closed_connection_count'] += self.pool_counts(old_adapter)['connection_count']
+            old_adapter.close()
+
+    # GET url + path, raises requests exceptions like requests.get
+    # (requests.exceptions.Timeout when the deadline is reached)
+    def get(self, path):
+        self.counters['request_count'] += 1
+        deadline = gevent.Timeout(self.deadline_s)
+        deadline.start()
+        try:
+            if self.slots.locked():
+                self.counters['wait_count'] += 1
+            with self.slots:
+                return self.session.get(self.url + path, timeout=self.timeout)
+        except gevent.Timeout as timeout:
+            if timeout is not deadline:
+                raise
+            self.counters['deadline_count'] += 1
+            self.counters['error_count'] += 1
+            raise requests.exceptions.Timeout('Table server call exceeded deadline of {} s: {}'.format(self.deadline_s, path))
+        except Exception:
+            self.counters['error_count'] += 1
+            raise
+        finally:
+            deadline.close()
+
+    # connections opened and requests sent by the adapter's urllib3 pools
+    @staticmethod
+    def pool_counts(adapter):
+        counts = {"connection_count": 0, "pool_request_count": 0}
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                counts['connection_count'] += pool.num_connections
+                counts['pool_request_count'] += pool.num_requests
+        return counts
+
+    # counters as FF metric fields. connection_reuse_ratio is the share of requests that reused a connection
+    def get_counters(self):
+        counts = FF_Table_Client.pool_counts(self.adapter)
+        connection_count = counts['connection_count'] + self.counters['closed_connection_count']
+        fields = {
+            "request_count": self.counters['request_count'],
+            "error_count": self.counters['error_count'],
+            "deadline_count": self.counters['deadline_count'],
+            "wait_count": self.counters['wait_count'],
+            "connection_count": connection_count,
+            "pool_size": self.pool_size,
+        }
+        if self.counters['request_count'] > 0:
+            fields['connection_reuse_ratio'] = max(0.0, 1 - connection_count / self.counters['request_count'])
+        return fields
+
+    def close(self):
+        self.session.close()
+
+
+##############################################################################
+# Client side buffer of rows pulled ahead from a table server's /next endpoint.
+# When the buffer drops to low_water a background greenlet refills it to high_water,
+# batch_size rows per round trip. Rows come from batch_path (a path relative to the
+# table, with {count} replaced by the batch size, answering a JSON list of rows) when
+# the server has a batch endpoint, else from up to `concurrency` parallel /next calls.
+# Rows are kept in (loop_count, __index) order so get_data_next(looping = False)
+# still sees the end of the list at the right row.
+class FF_Table_Prefetch():
+    def __init__(self, client, table, on_error, batch_size = 100, low_water = 50, high_water = 200, concurrency = 8, batch_path = None):
+        self.client = client
+        self.table = table
+        self.on_error = on_error
+        self.batch_size = max(1, batch_size)
+        self.low_water = max(0, low_water)
+        self.high_water = max(self.batch_size, high_water)
+        self.concurrency = max(1, concurrency)
+        self.batch_path = batch_path
+        self.rows = deque()
+        self.refill_greenlet = None
+        self.ready = gevent.event.Event() # set when rows were added or a refill ended
+        self.is_stopped = False
+        self.counters = {"batch_count": 0, "row_count": 0, "empty_count": 0}
+
+    # next buffered row, waiting for the first batch of an in flight refill if the buffer is empty.
+    # None when no row could be prefetched, the caller then falls back to a direct /next call.
+    def next(self):
+        if self.is_stopped:
+            return None
+        if len(self.rows) <= self.low_water:
+            self.start_refill()
+        if not self.rows and self.refill_greenlet is not None:
+            self.ready.clear()
+            self.ready.wait(timeout=sum(self.client.timeout))
+        if not self.rows:
+            self.counters['empty_count'] += 1
+            return None
+        return self.rows.popleft()
+
+    def start_refill(self):
+        if self.refill_greenlet is None and not self.is_stopped:
+            self.refill_greenlet = gevent.spawn(self.refill)
+
+    def refill(self):
+        try:
+            while not self.is_stopped and len(self.rows) < self.high_water:
+                batch = self.fetch_batch(min(self.batch_size, self.high_water - len(self.rows)))
+                if not batch:
+                    break
+                if self.is_stopped:
+                    break
+                self.rows.extend(batch)
+                self.ready.set()
+                self.counters['batch_count'] += 1
+                self.counters['row_count'] += len(batch)
+        except Exception as error:
+            self.on_error({"description": "Failed to prefetch rows from ff table service for table {}.".format(self.table), "message": error})
+        finally:
+            self.refill_greenlet = None
+            self.ready.set()
+
+    # list of up to count rows, ordered by loop and index
+    def fetch_batch(self, count):
+        if self.batch_path is not None:
+            request = self.client.get('list/get/' + self.table + '/' + self.batch_path.format(count=count))
+            if request.status_code != 200:
+                self.on_error({"description": "Failed to access ff table service batch endpoint.", "status_code": request.status_code})
+                return []
+            rows = request.json()
+            if isinstance(rows, dict):
+                self.on_error({"description": "Table service reported an error on batch endpoint.", "message": rows.get('short_description')})
+                return []
+        else:
+            pool = gevent.pool.Pool(min(self.concurrency, count))
+            rows = [row for row in pool.imap_unordered(self.fetch_one, range(count)) if row is not None]
+        rows.sort(key=lambda row: (row.get('loop_count', 0), row.get('__index', 0)))
+        return rows
+
+    def fetch_one(self, _):
+        request = self.client.get('list/get/' + self.table + '/next')
+        if request.status_code != 200:
+            self.on_error({"description": "Failed to access ff table service /next endpoint.", "status_code": request.status_code})
+            return None
+        row = request.json()
+        if 'is_error' in row:
+            self.on_error({"description": "Table service reported an error on /next endpoint.", "message": row.get('short_description')})
+            return None
+        return row
+
+    # stop refilling and drop buffered rows
+    def stop(self):
+        self.is_stopped = True
+        self.rows.clear()
+        if self.refill_greenlet is not None:
+            self.refill_greenlet.kill(block=False)
+            self.refill_greenlet = None
+
+
+##############################################################################
+# Destinations for FF_LOG lines. write() takes a block of complete lines (newline terminated).
+# FF_Log_Sink.from_spec() builds a sink from FF_LOG_SINK:
+#   stdout (default) | file:/path/to/file | udp:host:port | unix:/path/to/socket
+class FF_Log_Sink(ABC):
+    @abstractmethod
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def from_spec(spec):
+        if spec is None or spec == '' or spec == 'stdout':
+            return FF_Stdout_Sink()
+        kind, _, target = spec.partition(':')
+        if kind == 'file':
+            return FF_File_Sink(target)
+        if kind == 'udp':
+            host, _, port = target.rpartition(':')
+            return FF_Socket_Sink(socket.AF_INET, socket.SOCK_DGRAM, (host, int(port)))
+        if kind == 'unix':
+            return FF_Socket_Sink(socket.AF_UNIX, socket.SOCK_STREAM, target)
+        raise ValueError('Unknown FF_LOG_SINK {}, expected stdout, file:<path>, udp:<host>:<port> or unix:<path>'.format(spec))
+
+
+class FF_Stdout_Sink(FF_Log_Sink):
+    def write(self, data):
+        # looked up on every write so redirections of sys.stdout are honoured
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+
+class FF_File_Sink(FF_Log_Sink):
+    def __init__(self, path):
+        self.file = open(path, 'a', buffering=1024 * 1024)
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# UDP datagrams are split on line boundaries to stay under max_datagram bytes.
+# Stream sockets (unix) reconnect on the next write after a failure.
+class FF_Socket_Sink(FF_Log_Sink):
+    def __init__(self, family, kind, address, max_datagram = 60000):
+        self.family = family
+        self.kind = kind
+        self.address = address
+        self.max_datagram = max_datagram
+        self.socket = None
+
+    def connect(self):
+        if self.socket is None:
+            sock = socket.socket(self.family, self.kind)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+            self.socket = sock
+        return self.socket
+
+    def write(self, data):
+        payload = data.encode('utf-8')
+        try:
+            sock = self.connect()
+            if self.kind == socket.SOCK_DGRAM:
+                for datagram in FF_Socket_Sink.split(payload, self.max_datagram):
+                    sock.send(datagram)
+            else:
+                sock.sendall(payload)
+        except OSError:
+            self.close()
+            raise
+
+    # binary payloads (FF_Metric_Transport batches), one datagram each or back to back on a stream
+    def write_payloads(self, payloads):
+        try:
+            sock = self.connect()
+            if self.kind == socket.SOCK_DGRAM:
+                for payload in payloads:
+                    sock.send(payload)
+            else:
+                sock.sendall(b''.join(payloads))
+        except OSError:
+            self.close()
+            raise
+
+    # chunks of at most size bytes cut after a newline (a single longer line is sent on its own)
+    @staticmethod
+    def split(payload, size):
+        start = 0
+        while start < len(payload):
+            end = start + size
+            if end < len(payload):
+                cut = payload.rfind(b'\n', start, end)
+                end = cut + 1 if cut >= start else payload.find(b'\n', end) + 1 or len(payload)
+            yield payload[start:end]
+            start = end
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+##############################################################################
+# Bounded buffer between ff_log and a sink.
+# Lines are appended in memory and written in one block by a background greenlet every
+# flush_interval_s, or sooner once half of max_lines are waiting. When the buffer is full
+# (the sink can't keep up) new lines are dropped and counted; the drop and write error
+# counts are reported as a log_buffer metric with the next flush.
+# max_lines = 0 writes every line straight to the sink.
+class FF_Log_Buffer():
+    def __init__(self, sink, metric, max_lines = 100000, flush_interval_s = 0.2):
+        self.sink = sink
+        self.metric = metric # FF_Locust.ff_metric, to report drops
+        self.max_lines = max_lines
+        self.flush_interval_s = flush_interval_s
+        self.lines = []
+        self.dropped_count = 0
+        self.write_error_count = 0
+        self.wake = gevent.event.Event()
+        self.flusher = None
+        if self.max_lines > 0:
+            self.flusher = gevent.spawn(self.flush_loop)
+
+    def write(self, line):
+        if self.max_lines <= 0:
+            self.write_block([line])
+            return
+        lines = self.lines
+        if len(lines) >= self.max_lines:
+            self.dropped_count += 1
+            return
+        lines.append(line)
+        if len(lines) == self.max_lines // 2:
+            self.wake.set()
+
+    def flush_loop(self):
+        while True:
+            self.wake.wait(self.flush_interval_s)
+            self.wake.clear()
+            self.flush()
+
+    # write all buffered lines to the sink
+    def flush(self):
+        lines = self.lines
+        self.lines = []
+        if self.dropped_count or self.write_error_count:
+            metric = self.metric("log_buffer", {"dropped_count": self.dropped_count, "write_error_count": self.write_error_count, "max_lines": self.max_lines})
+            # an FF_LOG line with FF_METRIC_TRANSPORT too, it is about this output
+            lines.append("FF_LOG {}".format(metric))
+            self.dropped_count = 0
+            self.write_error_count = 0
+        if lines:
+            self.write_block(lines)
+
+    def write_block(self, lines):
+        try:
+            self.sink.write('\n'.join(lines) + '\n')
+        except Exception:
+            self.write_error_count += 1
+
+    def close(self):
+        if self.flusher is not None:
+            self.flusher.kill(block=False)
+            self.flusher = None
+        self.flush()
+        self.sink.close()
+
+
+##############################################################################
+# Mergeable streaming quantile sketch for response times (DDSketch style).
+# Values are counted in logarithmic buckets whose width is a fixed fraction of the value,
+# so any quantile is answered within relative_accuracy (1% by default) using a few
+# hundred buckets between 1 ms and an hour, whatever the number of requests.
+# Sketches with the same accuracy merge by adding bucket counts, e.g. across workers.
+class FF_Quantile_Sketch():
+    MIN_VALUE = 0.001 # values below this (ms) are counted as zero
+
+    def __init__(self, relative_accuracy = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {} # bucket index -> count
+        self.sorted_indexes = None # sorted bucket indexes, None after a bucket was added or removed
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value > FF_Quantile_Sketch.MIN_VALUE:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            buckets = self.buckets
+            count = buckets.get(index)
+            if count is None:
+                buckets[index] = 1
+                self.sorted_indexes = None
+            else:
+                buckets[index] = count + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged')
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            current = buckets.get(index)
+            if current is None:
+                buckets[index] = count
+                self.sorted_indexes = None
+            else:
+                buckets[index] = current + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    # take out the values of a sketch that was merged in before. min and max are not updated.
+    def subtract(self, other):
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            remaining = buckets[index] - count
+            if remaining:
+                buckets[index] = remaining
+            else:
+                del buckets[index]
+                self.sorted_indexes = None
+        self.zero_count -= other.zero_count
+        self.count -= other.count
+        return self
+
+    # value at quantile q (0 - 1), None when empty
+    def quantile(self, q):
+        return self.quantiles((q,))[0]
+
+    # values at each of the quantiles qs: one cumulative sum over the buckets (sorted order is
+    # kept between calls), then a binary search per quantile
+    def quantiles(self, qs):
+        if self.count == 0:
+            return [None] * len(qs)
+        indexes = self.sorted_indexes
+        if indexes is None:
+            indexes = self.sorted_indexes = sorted(self.buckets)
+        # cumulative[i] values are at most bucket indexes[i - 1], cumulative[0] is the zero bucket
+        cumulative = list(accumulate(map(self.buckets.__getitem__, indexes), initial=self.zero_count))
+        scale = self.count - 1
+        gamma = self.gamma
+        low = self.min
+        high = self.max
+        results = []
+        for q in qs:
+            position = bisect_right(cumulative, q * scale)
+            if position == 0:
+                value = low if low > 0 else 0
+            elif position > len(indexes):
+                value = high
+            else:
+                value = 2 * gamma ** indexes[position - 1] / (gamma + 1)
+                if value < low:
+                    value = low
+                elif value > high:
+                    value = high
+            results.append(value)
+        return results
+
+    # plain lists and numbers, e.g. for report_to_master (msgpack)
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": [[index, count] for index, count in self.buckets.items()],
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        sketch = FF_Quantile_Sketch(data['relative_accuracy'])
+        sketch.buckets = {index: count for index, count in data['buckets']}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        if sketch.count:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+
+##############################################################################
+# Quantile sketch over the last window_s seconds: one FF_Quantile_Sketch per second, and
+# a running total of them that expired seconds are subtracted from, so a query doesn't
+# merge the window again.
+class FF_Windowed_Sketch():
+    def __init__(self, window_s = 10, relative_accuracy = 0.01):
+        self.window_s = window_s
+        self.relative_accuracy = relative_accuracy
+        self.slots = deque() # (second, FF_Quantile_Sketch)
+        self.total = FF_Quantile_Sketch(relative_accuracy) # sum of the slots
+
+    def add(self, value):
+        second = int(time.monotonic())
+        slots = self.slots
+        if not slots or slots[-1][0] != second:
+            self.prune(second)
+            slots.append((second, FF_Quantile_Sketch(self.relative_accuracy)))
+        slots[-1][1].add(value)
+        self.total.add(value)
+
+    # count a sketch of values as added now
+    def merge(self, other):
+        second = int(time.monotonic())
+        slots = self.slots
+        if not slots or slots[-1][0] != second:
+            self.prune(second)
+            slots.append((second, FF_Quantile_Sketch(self.relative_accuracy)))
+        slots[-1][1].merge(other)
+        self.total.merge(other)
+
+    def prune(self, second):
+        slots = self.slots
+        if not slots or slots[0][0] > second - self.window_s:
+            return
+        while slots and slots[0][0] <= second - self.window_s:
+            self.total.subtract(slots.popleft()[1])
+        # min and max can't be subtracted, they are taken from the remaining seconds
+        self.total.min = min((slot.min for _, slot in slots), default=math.inf)
+        self.total.max = max((slot.max for _, slot in slots), default=-math.inf)
+
+    # FF_Quantile_Sketch of the values added in the last window_s seconds.
+    # The sketch is kept up to date by add() and merge(), callers must not modify it.
+    def merged(self):
+        self.prune(int(time.monotonic()))
+        return self.total
+
+
+##############################################################################
+# In-process aggregation of per request "url" metrics.
+# Requests are accumulated per (operation, method, success) and every interval_s one
+# "url_agg" metric per key is emitted with the same tags as the per request "url" metric, and
+# fields summarising the interval:
+#   request_count, total_time_ms (sum), mean_time_ms, total_time_ms_min/_max, total_time_ms_p50/_p90/_p95/_p99,
+#   content_length_bytes (sum), mean_content_length_bytes
+# Its own measurement keeps these sums apart from per request latencies when both are emitted.
+# Latencies are kept in an FF_Quantile_Sketch.
+class FF_Url_Aggregator():
+    PERCENTILES = ((0.5, "total_time_ms_p50"), (0.9, "total_time_ms_p90"), (0.95, "total_time_ms_p95"), (0.99, "total_time_ms_p99"))
+
+    def __init__(self, emit, interval_s = 1.0):
+        self.emit = emit # called with (fields, tags) per key
+        self.interval_s = interval_s
+        self.entries = {} # (operation, method, is_success) -> [count, time sum, time min, time max, bytes sum, FF_Quantile_Sketch]
+        self.flusher = gevent.spawn(self.flush_loop)
+
+    def add(self, operation, method, is_success, response_time, response_length):
+        key = (operation, method, is_success)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0.0, response_time, response_time, 0, FF_Quantile_Sketch()]
+        entry[0] += 1
+        entry[1] += response_time
+        if response_time < entry[2]:
+            entry[2] = response_time
+        if response_time > entry[3]:
+            entry[3] = response_time
+        entry[4] += response_length or 0
+        entry[5].add(response_time)
+
+    def flush_loop(self):
+        while True:
+            gevent.sleep(self.interval_s)
+            self.flush()
+
+    # emit one metric per key accumulated since the last flush
+    def flush(self):
+        entries = self.entries
+        self.entries = {}
+        for (operation, method, is_success), (count, time_sum, time_min, time_max, bytes_sum, sketch) in entries.items():
+            fields = {
+                "request_count": count,
+                "total_time_ms": math.ceil(time_sum),
+                "mean_time_ms": math.ceil(time_sum / count),
+                "total_time_ms_min": math.ceil(time_min),
+                "total_time_ms_max": math.ceil(time_max),
+                "content_length_bytes": bytes_sum,
+                "mean_content_length_bytes": math.ceil(bytes_sum / count),
+            }
+            values = sketch.quantiles([percent for percent, _ in FF_Url_Aggregator.PERCENTILES])
+            for (_, field), value in zip(FF_Url_Aggregator.PERCENTILES, values):
+                fields[field] = math.ceil(value)
+            tags = {"operation": operation, "method": method}
+            tags["is_success" if is_success else "is_error"] = True
+            self.emit(fields, tags)
+
+    def close(self):
+        self.flusher.kill(block=False)
+        self.flush()
+
+
+##############################################################################
+# Serializer for the fixed timeseries/metric envelope produced by ff_metric.
+# Output is byte for byte what json.dumps of the envelope dict gives:
+#   {"mime_type": "timeseries/metric", "measurement": ..., "timestamp_epoch_ms": ..., "fields": {...}, "tags": {...}}
+# The envelope prefix is pre-encoded per measurement and encoded tag sets are cached
+# (up to max_cached_tags, then the cache starts over), so a repeated metric only encodes
+# its fields. encode_url() is the request hook path and skips building the tags dict.
+# json_backend 'orjson' encodes fields with orjson when it is installed; its output is
+# compact JSON (no spaces), equal after parsing but not byte for byte.
+class FF_Metric_Encoder():
+    def __init__(self, json_backend = 'json', max_cached_tags = 10000):
+        self.max_cached_tags = max_cached_tags
+        self.prefixes = {} # measurement -> encoded '{... "timestamp_epoch_ms": '
+        self.tags = {} # ((name, type, value), ...) -> encoded ', "tags": {...}}'
+        self.url_tags = {} # (operation, method, is_success) -> encoded ', "tags": {...}}'
+        self.dumps = json.dumps
+        if json_backend == 'orjson':
+            try:
+                import orjson
+                self.dumps = FF_Metric_Encoder.orjson_dumps(orjson)
+            except ImportError:
+                pass
+
+    # orjson returns bytes and rejects some types json accepts (e.g. numpy scalars), fall back to json for those
+    @staticmethod
+    def orjson_dumps(orjson):
+        def dumps(value):
+            try:
+                return orjson.dumps(value).decode('utf-8')
+            except TypeError:
+                return json.dumps(value)
+        return dumps
+
+    def prefix(self, measurement):
+        prefix = self.prefixes.get(measurement)
+        if prefix is None:
+            prefix = '{"mime_type": "timeseries/metric", "measurement": ' + json.dumps(measurement) + ', "timestamp_epoch_ms": '
+            if isinstance(measurement, str):
+                self.prefixes[measurement] = prefix
+        return prefix
+
+    def encode(self, measurement, fields, tags = None, timestamp_epoch_ms = None):
+        if tags is None:
+            suffix = '}'
+        else:
+            try:
+                # the value's type is part of the key: True, 1 and 1.0 are equal keys but encode differently
+                key = tuple([(name, type(value), value) for name, value in tags.items()])
+                suffix = self.tags.get(key)
+            except TypeError: # unhashable tag value
+                key = None
+                suffix = None
+            if suffix is None:
+                suffix = ', "tags": ' + json.dumps(tags) + '}'
+                if key is not None:
+                    if len(self.tags) >= self.max_cached_tags:
+                        self.tags.clear()
+                    self.tags[key] = suffix
+        if timestamp_epoch_ms is None:
+            timestamp_epoch_ms = round(time.time() * 1000)
+        return self.prefix(measurement) + str(timestamp_epoch_ms) + ', "fields": ' + self.dumps(fields) + suffix
+
+    # "url" metric of one request, tags {"operation", "method", "is_success": True} or {..., "is_error": True}
+    def encode_url(self, total_time_ms, content_length_bytes, operation, method, is_success, timestamp_epoch_ms = None):
+        key = (operation, method, is_success)
+        suffix = self.url_tags.get(key)
+        if suffix is None:
+            tags = {"operation": operation, "method": method}
+            tags["is_success" if is_success else "is_error"] = True
+            suffix = ', "tags": ' + json.dumps(tags) + '}'
+            if len(self.url_tags) >= self.max_cached_tags:
+                self.url_tags.clear()
+            self.url_tags[key] = suffix
+        if type(total_time_ms) is int and type(content_length_bytes) is int:
+            fields = '{"total_time_ms": ' + str(total_time_ms) + ', "content_length_bytes": ' + str(content_length_bytes) + '}'
+        else:
+            fields = self.dumps({"total_time_ms": total_time_ms, "content_length_bytes": content_length_bytes})
+        if timestamp_epoch_ms is None:
+            timestamp_epoch_ms = round(time.time() * 1000)
+        return self.prefix("url") + str(timestamp_epoch_ms) + ', "fields": ' + fields + suffix
+
+
+##############################################################################
+# Binary encoding of metrics for FF_Metric_Transport, instead of "FF_LOG {json}" text lines.
+# A batch is a sequence of frames: u32 length of the rest of the frame, u8 frame type, body (little endian).
+#   STRING (1): u32 id, utf-8 text - defines an entry of the string table
+#   URL    (2): i64 timestamp_epoch_ms, u32 operation id, u32 method id, u8 is_success,
+#               u32 total_time_ms, u64 content_length_bytes - the per request url metric
+#   METRIC (3): i64 timestamp_epoch_ms, u32 measurement id, u16 field count, u16 tag count (0xffff: no tags),
+#               then every field and tag as u32 key id, u8 value kind, value - any other metric
+# Value kinds: 0 i64, 1 f64, 2 true, 3 false, 4 string (u32 id), 5 null, 6 other (u32 length, JSON text).
+# Strings (measurements, field and tag names, operation/method tags, string values) are sent as ids.
+# An id is defined by a STRING frame right before its first use in each batch (datagram), so every
+# batch decodes on its own and a collector can start or restart at any time. Ids are stable between
+# batches until max_strings were assigned, then the table starts over. See FF_Frame_Decoder.
+class FF_Frame_Encoder():
+    STRING = 1
+    URL = 2
+    METRIC = 3
+    HEADER = struct.Struct('<IB')
+    STRING_ID = struct.Struct('<I')
+    URL_BODY = struct.Struct('<qIIBIQ')
+    URL_FRAME = struct.Struct('<IBqIIBIQ') # HEADER + URL_BODY in one pack
+    METRIC_HEAD = struct.Struct('<qIHH')
+    KEY_KIND = struct.Struct('<IB')
+    INT = struct.Struct('<q')
+    FLOAT = struct.Struct('<d')
+    KIND_INT, KIND_FLOAT, KIND_TRUE, KIND_FALSE, KIND_STRING, KIND_NULL, KIND_JSON = range(7)
+    NO_TAGS = 0xffff
+
+    def __init__(self, max_strings = 100000):
+        self.max_strings = max_strings
+        self.ids = {} # string -> id
+
+    # list of batches of at most max_bytes (unless a single metric is larger) from records:
+    # (timestamp_epoch_ms, total_time_ms, content_length_bytes, operation, method, is_success) url metrics and
+    # (timestamp_epoch_ms, measurement, fields, tags) other metrics.
+    # Records that can't be encoded (e.g. a timestamp out of i64 range, a string with a lone surrogate) raise,
+    # or are appended to failed when it is a list and left out of the batches.
+    def encode_batches(self, records, max_bytes = 60000, failed = None):
+        if len(self.ids) >= self.max_strings:
+            self.ids = {}
+        batches = []
+        batch = bytearray()
+        defined = set()
+        # (operation, method) -> their ids, once both are defined in this batch: such url metrics are one pack
+        url_ids = {}
+        pack_url = FF_Frame_Encoder.URL_FRAME.pack
+        url_length = FF_Frame_Encoder.URL_BODY.size + 1
+        url_size = FF_Frame_Encoder.URL_FRAME.size
+        for record in records:
+            try:
+                if len(record) == 6:
+                    ids = url_ids.get((record[3], record[4]))
+                    if ids is not None and len(batch) + url_size <= max_bytes:
+                        timestamp_epoch_ms, total_time_ms, content_length_bytes, _, _, is_success = record
+                        if type(total_time_ms) is int and type(content_length_bytes) is int and 0 <= total_time_ms <= 0xffffffff and 0 <= content_length_bytes <= 0xffffffffffffffff:
+                            batch += pack_url(url_length, FF_Frame_Encoder.URL, timestamp_epoch_ms, ids[0], ids[1], 1 if is_success else 0, total_time_ms, content_length_bytes)
+                            continue
+                frame = self.encode_record(record, defined)
+                if batch and len(batch) + len(frame) > max_bytes:
+                    batches.append(bytes(batch))
+                    batch = bytearray()
+                    defined = set()
+                    url_ids = {}
+                    frame = self.encode_record(record, defined)
+                batch += frame
+                if len(record) == 6:
+                    url_ids[(record[3], record[4])] = (self.ids[record[3]], self.ids[record[4]])
+            except Exception:
+                if failed is None:
+                    raise
+                failed.append(record)
+                # strings of the failed record may be marked defined without their STRING frame in the batch
+                if batch:
+                    batches.append(bytes(batch))
+                    batch = bytearray()
+                defined = set()
+                url_ids = {}
+        if batch:
+            batches.append(bytes(batch))
+        return batches
+
+    # frames of one record, preceded by STRING frames of ids not yet defined in this batch
+    def encode_record(self, record, defined):
+        out = bytearray()
+        if len(record) == 6:
+            timestamp_epoch_ms, total_time_ms, content_length_bytes, operation, method, is_success = record
+            if type(total_time_ms) is int and type(content_length_bytes) is int and 0 <= total_time_ms <= 0xffffffff and 0 <= content_length_bytes <= 0xffffffffffffffff:
+                body = FF_Frame_Encoder.URL_BODY.pack(timestamp_epoch_ms, self.string_id(operation, defined, out),
+                    self.string_id(method, defined, out), 1 if is_success else 0, total_time_ms, content_length_bytes)
+                out += FF_Frame_Encoder.HEADER.pack(len(body) + 1, FF_Frame_Encoder.URL)
+                out += body
+                return out
+            # values the fixed layout can't hold go as a generic metric
+            tags = {"operation": operation, "method": method}
+            tags["is_success" if is_success else "is_error"] = True
+            record = (timestamp_epoch_ms, "url", {"total_time_ms": total_time_ms, "content_length_bytes": content_length_bytes}, tags)
+        timestamp_epoch_ms, measurement, fields, tags = record
+        body = bytearray(FF_Frame_Encoder.METRIC_HEAD.pack(timestamp_epoch_ms, self.string_id(measurement, defined, out),
+            len(fields), FF_Frame_Encoder.NO_TAGS if tags is None else len(tags)))
+        for items in (fields, tags or {}):
+            for key, value in items.items():
+                self.encode_value(body, self.string_id(str(key), defined, out), value, defined, out)
+        out += FF_Frame_Encoder.HEADER.pack(len(body) + 1, FF_Frame_Encoder.METRIC)
+        out += body
+        return out
+
+    def encode_value(self, body, key_id, value, defined, out):
+        kind = type(value)
+        if kind is bool:
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_TRUE if value else FF_Frame_Encoder.KIND_FALSE)
+        elif kind is int and -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_INT)
+            body += FF_Frame_Encoder.INT.pack(value)
+        elif kind is float:
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_FLOAT)
+            body += FF_Frame_Encoder.FLOAT.pack(value)
+        elif kind is str:
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_STRING)
+            body += FF_Frame_Encoder.STRING_ID.pack(self.string_id(value, defined, out))
+        elif value is None:
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_NULL)
+        else:
+            text = json.dumps(value, default=str).encode('utf-8')
+            body += FF_Frame_Encoder.KEY_KIND.pack(key_id, FF_Frame_Encoder.KIND_JSON)
+            body += FF_Frame_Encoder.STRING_ID.pack(len(text))
+            body += text
+
+    # id of text, appending its STRING frame to out the first time it is used in this batch
+    def string_id(self, text, defined, out):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.ids)
+        if string_id not in defined:
+            defined.add(string_id)
+            data = text.encode('utf-8')
+            out += FF_Frame_Encoder.HEADER.pack(len(data) + 5, FF_Frame_Encoder.STRING)
+            out += FF_Frame_Encoder.STRING_ID.pack(string_id)
+            out += data
+        return string_id
+
+
+##############################################################################
+# Reference decoder of FF_Frame_Encoder batches. Metrics are returned as the dicts ff_metric
+# would have logged as JSON ({"mime_type", "measurement", "timestamp_epoch_ms", "fields", "tags"}).
+# decode() takes complete batches (datagrams), feed() any chunks of a stream.
+class FF_Frame_Decoder():
+    def __init__(self):
+        self.strings = {} # id -> string
+        self.pending = b''
+
+    def decode(self, data):
+        metrics = []
+        position = 0
+        header_size = FF_Frame_Encoder.HEADER.size
+        while position + header_size <= len(data):
+            length, frame_type = FF_Frame_Encoder.HEADER.unpack_from(data, position)
+            end = position + 4 + length
+            if end > len(data):
+                raise ValueError('Truncated frame')
+            metric = self.decode_frame(frame_type, memoryview(data)[position + header_size:end])
+            if metric is not None:
+                metrics.append(metric)
+            position = end
+        if position != len(data):
+            raise ValueError('Truncated frame')
+        return metrics
+
+    # metrics of the complete frames in the stream so far
+    def feed(self, data):
+        data = self.pending + data
+        position = 0
+        while position + 4 <= len(data):
+            length = FF_Frame_Encoder.STRING_ID.unpack_from(data, position)[0]
+            if position + 4 + length > len(data):
+                break
+            position += 4 + length
+        self.pending = data[position:]
+        return self.decode(data[:position])
+
+    def decode_frame(self, frame_type, body):
+        if frame_type == FF_Frame_Encoder.STRING:
+            self.strings[FF_Frame_Encoder.STRING_ID.unpack_from(body)[0]] = bytes(body[4:]).decode('utf-8')
+            return None
+        if frame_type == FF_Frame_Encoder.URL:
+            timestamp_epoch_ms, operation, method, is_success, total_time_ms, content_length_bytes = FF_Frame_Encoder.URL_BODY.unpack_from(body)
+            tags = {"operation": self.strings[operation], "method": self.strings[method]}
+            tags["is_success" if is_success else "is_error"] = True
+            return {"mime_type": "timeseries/metric", "measurement": "url", "timestamp_epoch_ms": timestamp_epoch_ms,
+                "fields": {"total_time_ms": total_time_ms, "content_length_bytes": content_length_bytes}, "tags": tags}
+        if frame_type == FF_Frame_Encoder.METRIC:
+            timestamp_epoch_ms, measurement, field_count, tag_count = FF_Frame_Encoder.METRIC_HEAD.unpack_from(body)
+            position = FF_Frame_Encoder.METRIC_HEAD.size
+            fields, position = self.decode_values(body, position, field_count)
+            metric = {"mime_type": "timeseries/metric", "measurement": self.strings[measurement], "timestamp_epoch_ms": timestamp_epoch_ms, "fields": fields}
+            if tag_count != FF_Frame_Encoder.NO_TAGS:
+                metric["tags"], position = self.decode_values(body, position, tag_count)
+            return metric
+        return None # unknown frame types are skipped
+
+    def decode_values(self, body, position, count):
+        values = {}
+        for _ in range(count):
+            key, kind = FF_Frame_Encoder.KEY_KIND.unpack_from(body, position)
+            position += FF_Frame_Encoder.KEY_KIND.size
+            if kind == FF_Frame_Encoder.KIND_INT:
+                value = FF_Frame_Encoder.INT.unpack_from(body, position)[0]
+                position += 8
+            elif kind == FF_Frame_Encoder.KIND_FLOAT:
+                value = FF_Frame_Encoder.FLOAT.unpack_from(body, position)[0]
+                position += 8
+            elif kind == FF_Frame_Encoder.KIND_STRING:
+                value = self.strings[FF_Frame_Encoder.STRING_ID.unpack_from(body, position)[0]]
+                position += 4
+            elif kind == FF_Frame_Encoder.KIND_JSON:
+                length = FF_Frame_Encoder.STRING_ID.unpack_from(body, position)[0]
+                value = json.loads(bytes(body[position + 4:position + 4 + length]).decode('utf-8'))
+                position += 4 + length
+            else:
+                value = {FF_Frame_Encoder.KIND_TRUE: True, FF_Frame_Encoder.KIND_FALSE: False}.get(kind)
+            values[self.strings[key]] = value
+        return values, position
+
+
+##############################################################################
+# Metrics to a local collector as FF_Frame_Encoder batches (FF_METRIC_TRANSPORT=udp:<host>:<port> or unix:<path>).
+# Metrics are queued as tuples (up to max_records, then dropped and counted) and encoded and sent by a
+# background greenlet every flush_interval_s, one datagram (udp) or write (unix) per batch.
+# A metric that can't be encoded is written as an FF_LOG text line through write_line and counted (encode_error_count).
+# While the collector can't be reached the queued metrics are written as FF_LOG text lines through
+# write_line instead, and the collector is tried again every retry_s. on_state(is_connected, error)
+# is called when that changes. Over udp a missing collector is only noticed from the ICMP error of an
+# earlier datagram, so the batch sent before that error is lost, first and at every retry while it is missing.
+class FF_Metric_Transport():
+    def __init__(self, sink, text_encoder, write_line, on_state, max_records = 100000, flush_interval_s = 0.2, retry_s = 5.0, max_bytes = 60000):
+        self.sink = sink
+        self.text_encoder = text_encoder
+        self.write_line = write_line
+        self.on_state = on_state
+        self.max_records = max_records
+        self.flush_interval_s = flush_interval_s
+        self.retry_s = retry_s
+        self.max_bytes = max_bytes
+        self.encoder = FF_Frame_Encoder()
+        self.records = []
+        self.is_connected = True
+        self.retry_at = 0.0
+        self.counters = {"batch_count": 0, "bytes_sent": 0, "metric_count": 0, "fallback_count": 0, "dropped_count": 0, "encode_error_count": 0}
+        self.flusher = gevent.spawn(self.flush_loop)
+
+    def add_url(self, total_time_ms, content_length_bytes, operation, method, is_success):
+        if len(self.records) >= self.max_records:
+            self.counters['dropped_count'] += 1
+            return
+        self.records.append((round(time.time() * 1000), total_time_ms, content_length_bytes, operation, method, is_success))
+
+    # (timestamp_epoch_ms, measurement, fields, tags) of any other metric, see FF_Metric_Line
+    def add_record(self, record):
+        if len(self.records) >= self.max_records:
+            self.counters['dropped_count'] += 1
+            return
+        self.records.append(record)
+
+    def flush_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval_s)
+            self.flush()
+
+    def flush(self):
+        records = self.records
+        if not records:
+            return
+        self.records = []
+        if not self.is_connected and time.monotonic() < self.retry_at:
+            self.fallback(records)
+            return
+        # a record that can't be encoded is written as an FF_LOG line, the others are still sent
+        failed = []
+        batches = self.encoder.encode_batches(records, self.max_bytes, failed)
+        if failed:
+            self.counters['encode_error_count'] += len(failed)
+            self.fallback(failed)
+            failed_ids = set(map(id, failed))
+            records = [record for record in records if id(record) not in failed_ids]
+        try:
+            self.sink.write_payloads(batches)
+        except OSError as error:
+            self.retry_at = time.monotonic() + self.retry_s
+            if self.is_connected:
+                self.is_connected = False
+                self.on_state(False, error)
+            self.fallback(records)
+            return
+        self.counters['batch_count'] += len(batches)
+        self.counters['bytes_sent'] += sum(len(batch) for batch in batches)
+        self.counters['metric_count'] += len(records)
+        if not self.is_connected:
+            self.is_connected = True
+            self.on_state(True, None)
+
+    # records as FF_LOG text lines, with their original timestamps
+    def fallback(self, records):
+        self.counters['fallback_count'] += len(records)
+        for record in records:
+            if len(record) == 6:
+                timestamp_epoch_ms, total_time_ms, content_length_bytes, operation, method, is_success = record
+                self.write_line("FF_LOG " + self.text_encoder.encode_url(total_time_ms, content_length_bytes, operation, method, is_success, timestamp_epoch_ms))
+            else:
+                timestamp_epoch_ms, measurement, fields, tags = record
+                self.write_line("FF_LOG " + self.text_encoder.encode(measurement, fields, tags, timestamp_epoch_ms))
+
+    def close(self):
+        self.flusher.kill(block=False)
+        self.flush()
+        self.sink.close()
+
+
+##############################################################################
+# What ff_metric returns while FF_METRIC_TRANSPORT is set: the same FF_LOG JSON text as without it,
+# that also keeps the metric as a record, so ff_log() queues it on FF_Metric_Transport instead of
+# writing the text. Its fields and tags are encoded when the batch is sent.
+class FF_Metric_Line(str):
+    pass
+
+
+##############################################################################
+# Worker side pre-aggregation shipped to the master with each report (data['ff_summary']).
+# Requests are summed per (name, method) between two reports, with a response time
+# FF_Quantile_Sketch, so a report is O(operations) whatever the request volume.
+# take() returns the summary as plain lists/dicts (msgpack friendly) and starts a new one.
+class FF_Report_Summary():
+    def __init__(self):
+        self.entries = {} # (name, method) -> [request count, failure count, bytes total, time sum, FF_Quantile_Sketch]
+
+    def add(self, name, method, is_success, response_time, response_length):
+        key = (name, method)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0, 0, 0.0, FF_Quantile_Sketch()]
+        entry[0] += 1
+        if not is_success:
+            entry[1] += 1
+        entry[2] += response_length or 0
+        entry[3] += response_time
+        entry[4].add(response_time)
+
+    def take(self):
+        entries = self.entries
+        self.entries = {}
+        return [{
+            "name": name,
+            "method": method,
+            "request_count": request_count,
+            "failure_count": failure_count,
+            "content_length_bytes_total": bytes_total,
+            "total_time_ms_sum": time_sum,
+            "sketch": sketch.to_dict(),
+        } for (name, method), (request_count, failure_count, bytes_total, time_sum, sketch) in entries.items()]
+
+
+##############################################################################
+# Periodic export of locust stats entries as "operation" metrics, from one greenlet.
+# Only entries that had traffic are exported instead of walking every entry each tick:
+# - aggregate stats of an entry are exported every stats_interval_s until idle_s after its
+#   last request, so requests_per_s can decay back to 0
+# - percentiles of an entry are exported every percentiles_interval_s if it had requests since the last export
+# Entries are marked by mark(), from the request hooks or, on the master, from worker reports.
+# Each tick reports its own cost as a "method" metric tagged with method "stats" or "percentiles".
+#
+# record() also keeps response time sketches per entry, a cumulative FF_Quantile_Sketch and,
+# when window_s > 0, an FF_Windowed_Sketch of the last window_s seconds. print_percentiles
+# answers from them and falls back to locust's response_times for entries without a sketch.
+class FF_Stats_Exporter():
+    def __init__(self, ff, stats, stats_interval_s = 1.0, percentiles_interval_s = 1.0, idle_s = 10.0, window_s = 10):
+        self.ff = ff
+        self.stats = stats
+        self.stats_interval_s = stats_interval_s
+        self.percentiles_interval_s = percentiles_interval_s
+        self.idle_s = idle_s
+        self.window_s = window_s
+        self.active = {} # (name, method) -> monotonic time of last request
+        self.percentiles_dirty = set() # (name, method) with requests since the last percentiles export
+        self.sketches = {} # (name, method) -> FF_Quantile_Sketch
+        self.window_sketches = {} # (name, method) -> FF_Windowed_Sketch
+        self.greenlet = None
+
+    def mark(self, name, method):
+        key = (name, method)
+        self.active[key] = time.monotonic()
+        self.percentiles_dirty.add(key)
+
+    # mark the entry and add response_time to its sketches
+    def record(self, name, method, response_time):
+        key = (name, method)
+        self.active[key] = time.monotonic()
+        self.percentiles_dirty.add(key)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = FF_Quantile_Sketch()
+            if self.window_s > 0:
+                self.window_sketches[key] = FF_Windowed_Sketch(self.window_s)
+        sketch.add(response_time)
+        if self.window_s > 0:
+            self.window_sketches[key].add(response_time)
+
+    # mark the entry and merge a response time sketch into its sketches (master, from worker summaries)
+    def merge(self, name, method, other):
+        key = (name, method)
+        self.mark(name, method)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = FF_Quantile_Sketch(other.relative_accuracy)
+            if self.window_s > 0:
+                self.window_sketches[key] = FF_Windowed_Sketch(self.window_s, other.relative_accuracy)
+        sketch.merge(other)
+        if self.window_s > 0:
+            self.window_sketches[key].merge(other)
+
+    def start(self):
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        next_stats = next_percentiles = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= next_stats:
+                self.export_stats(now)
+                next_stats = max(next_stats + self.stats_interval_s, now)
+            if now >= next_percentiles:
+                self.export_percentiles()
+                next_percentiles = max(next_percentiles + self.percentiles_interval_s, now)
+            gevent.sleep(max(0, min(next_stats, next_percentiles) - time.monotonic()))
+
+    def export_stats(self, now):
+        t0 = time.perf_counter()
+        idle_before = now - self.idle_s
+        keys = []
+        for key, last_request in list(self.active.items()):
+            if last_request < idle_before:
+                del self.active[key]
+            else:
+                keys.append(key)
+        self.ff.print_stats(self.stats, keys)
+        self.report_cost("stats", t0, {"entry_count": len(keys)})
+
+    def export_percentiles(self):
+        t0 = time.perf_counter()
+        keys = self.percentiles_dirty
+        self.percentiles_dirty = set()
+        bin_count = self.ff.print_percentiles(self.stats, keys)
+        self.report_cost("percentiles", t0, {"entry_count": len(keys), "bin_count": bin_count})
+
+    def report_cost(self, method, t0, fields):
+        fields["time_total_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        self.ff.ff_log(self.ff.ff_metric("method", fields, {"method": method}))
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill(block=False)
+            self.greenlet = None
+
+
+##############################################################################
+# Precomputed arrival times for open-loop load (FF_Open_Loop), seconds from the start of the run.
+# Offsets are kept in an array('d'), 8 bytes per arrival and no object per arrival, so millions of
+# arrivals are cheap to build and hold. Phases are chained with then() or concat().
+# Arrivals at a rate that changes linearly from start_rate to end_rate are placed by inverting the
+# expected arrival count N(t) = start_rate * t + (end_rate - start_rate) * t^2 / (2 * duration_s),
+# at counts 0, 1, 2, ... (evenly spaced) or at the points of a unit rate Poisson process (poisson).
+class FF_Arrival_Schedule():
+    def __init__(self, offsets = None, duration_s = 0.0):
+        self.offsets = offsets if offsets is not None else array('d')
+        self.duration_s = duration_s
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def constant(rate, duration_s, poisson = False, rng = random):
+        return FF_Arrival_Schedule.ramp(rate, rate, duration_s, poisson, rng)
+
+    # Poisson arrivals (exponential gaps) at an average rate per second
+    @staticmethod
+    def poisson(rate, duration_s, rng = random):
+        return FF_Arrival_Schedule.ramp(rate, rate, duration_s, True, rng)
+
+    @staticmethod
+    def ramp(start_rate, end_rate, duration_s, poisson = False, rng = random):
+        if start_rate < 0 or end_rate < 0:
+            raise ValueError('Arrival rates can not be negative')
+        if duration_s <= 0:
+            return FF_Arrival_Schedule(array('d'), max(0.0, duration_s))
+        expected_count = (start_rate + end_rate) * duration_s / 2
+        acceleration = (end_rate - start_rate) / duration_s
+        if poisson:
+            counts = FF_Arrival_Schedule.poisson_counts(expected_count, rng)
+        else:
+            counts = range(math.ceil(round(expected_count, 9)))
+        if acceleration == 0:
+            if start_rate == 0:
+                return FF_Arrival_Schedule(array('d'), duration_s)
+            return FF_Arrival_Schedule(array('d', map((1.0 / start_rate).__mul__, counts)), duration_s)
+        start_squared = start_rate * start_rate
+        # root of N(t) = count, in the form that is stable when start_rate is 0 or acceleration is negative
+        def time_of(count):
+            denominator = start_rate + math.sqrt(max(0.0, start_squared + 2 * acceleration * count))
+            return 2 * count / denominator if denominator > 0 else 0.0
+        return FF_Arrival_Schedule(array('d', map(time_of, counts)), duration_s)
+
+    # points of a unit rate Poisson process below limit
+    @staticmethod
+    def poisson_counts(limit, rng):
+        count = rng.expovariate(1.0)
+        while count < limit:
+            yield count
+            count += rng.expovariate(1.0)
+
+    # Schedule from a tsv file, either
+    # - a rate profile: one phase per row, columns duration_s and rate, optional end_rate for a ramp, or
+    # - recorded arrivals: column timestamp_epoch_ms, replayed at the same times relative to the first one
+    @staticmethod
+    def from_tsv(file_path, poisson = False, rng = random):
+        with open(file_path, 'rb') as file:
+            names = file.readline().rstrip(b'\r\n').decode('utf-8').split('\t')
+            lines = (line for line in file if line.rstrip(b'\r\n'))
+            if 'timestamp_epoch_ms' in names:
+                column = names.index('timestamp_epoch_ms')
+                stamps = sorted(float(line.split(b'\t')[column]) for line in lines)
+                first = stamps[0] if stamps else 0.0
+                offsets = array('d', ((stamp - first) / 1000 for stamp in stamps))
+                return FF_Arrival_Schedule(offsets, offsets[-1] if offsets else 0.0)
+            if 'duration_s' not in names or 'rate' not in names:
+                raise ValueError('Arrival schedule {} needs duration_s and rate columns, or a timestamp_epoch_ms column'.format(file_path))
+            phases = []
+            for line in lines:
+                row = FF_Stream_Table.parse_row(names, line)
+                end_rate = row.get('end_rate', math.nan)
+                phases.append(FF_Arrival_Schedule.ramp(row['rate'], row['rate'] if end_rate != end_rate else end_rate, row['duration_s'], poisson, rng))
+            return FF_Arrival_Schedule.concat(phases)
+
+    # this schedule followed by others, in order
+    def then(self, *others):
+        return FF_Arrival_Schedule.concat((self,) + others)
+
+    # schedules one after the other, their offsets are copied once into one array
+    @staticmethod
+    def concat(schedules):
+        offsets = array('d')
+        duration_s = 0.0
+        for schedule in schedules:
+            offsets.extend(map(duration_s.__add__, schedule.offsets))
+            duration_s += schedule.duration_s
+        return FF_Arrival_Schedule(offsets, duration_s)
+
+    # every count-th arrival starting at index, one worker's share of a cluster wide schedule
+    def shard(self, index, count):
+        return FF_Arrival_Schedule(self.offsets[index::count], self.duration_s)
+
+
+##############################################################################
+# Open-loop load: task() is called at every arrival of an FF_Arrival_Schedule whether or not
+# earlier calls finished, on a gevent pool of up to pool_size concurrent calls.
+# Latency is measured from the intended (scheduled) start, not the actual one, so a slow server
+# shows up as higher latency instead of as fewer requests (no coordinated omission).
+# Every call is fired as a locust request (request_type, name), so it shows up in locust stats and
+# as url metrics; task() may return the response length in bytes, an exception is a failure.
+# Every interval_s emit(fields, tags) gets the arrivals since the last report, their queueing
+# delay (actual - intended start) and missed deadlines (calls that started more than miss_ms late).
+class FF_Open_Loop():
+    def __init__(self, schedule, task, emit, request_type = 'OPEN_LOOP', name = 'open_loop', pool_size = 1000, miss_ms = 10.0, interval_s = 1.0):
+        self.schedule = schedule
+        self.task = task
+        self.emit = emit
+        self.request_type = request_type
+        self.name = name
+        self.pool = gevent.pool.Pool(pool_size)
+        self.miss_ms = miss_ms
+        self.interval_s = interval_s
+        self.start_time = None
+        self.position = 0 # arrivals dispatched
+        self.greenlet = None
+        self.reporter = None
+        self.done = gevent.event.Event()
+        self.totals = {"arrival_count": 0, "missed_count": 0, "failure_count": 0}
+        self.reset_window()
+
+    def reset_window(self):
+        self.window = [0, 0, 0.0, 0.0, 0] # started count, missed count, queue delay sum, queue delay max, failure count
+
+    def start(self):
+        self.greenlet = gevent.spawn(self.run)
+        self.reporter = gevent.spawn(self.report_loop)
+        return self
+
+    # dispatch every arrival at its time; a full pool holds dispatching up, which shows up as queueing delay
+    def run(self):
+        offsets = self.schedule.offsets
+        pool = self.pool
+        call = self.call
+        perf_counter = time.perf_counter
+        start = self.start_time = perf_counter()
+        try:
+            for offset in offsets:
+                due = start + offset
+                delay = due - perf_counter()
+                if delay > 0:
+                    gevent.sleep(delay)
+                pool.spawn(call, due)
+                self.position += 1
+            pool.join()
+        finally:
+            self.done.set()
+
+    def call(self, due):
+        started = time.perf_counter()
+        queue_delay_ms = (started - due) * 1000
+        window = self.window
+        window[0] += 1
+        window[2] += queue_delay_ms
+        if queue_delay_ms > window[3]:
+            window[3] = queue_delay_ms
+        if queue_delay_ms > self.miss_ms:
+            window[1] += 1
+        response_length = 0
+        exception = None
+        try:
+            result = self.task()
+            if isinstance(result, int):
+                response_length = result
+        except Exception as error:
+            exception = error
+        response_time = (time.perf_counter() - due) * 1000 # from the intended start
+        if exception is None:
+            events.request_success.fire(request_type=self.request_type, name=self.name, response_time=response_time, response_length=response_length)
+        else:
+            self.window[4] += 1
+            events.request_failure.fire(request_type=self.request_type, name=self.name, response_time=response_time, response_length=response_length, exception=exception)
+
+    def report_loop(self):
+        while not self.done.wait(self.interval_s):
+            self.report()
+        self.report()
+
+    def report(self):
+        started_count, missed_count, delay_sum, delay_max, failure_count = self.window
+        self.reset_window()
+        self.totals['arrival_count'] += started_count
+        self.totals['missed_count'] += missed_count
+        self.totals['failure_count'] += failure_count
+        behind_ms = 0.0
+        if self.start_time is not None and self.position < len(self.schedule.offsets):
+            behind_ms = max(0.0, (time.perf_counter() - self.start_time - self.schedule.offsets[self.position]) * 1000)
+        self.emit({
+            "arrival_count": started_count,
+            "missed_count": missed_count,
+            "failure_count": failure_count,
+            "queue_delay_ms": math.ceil(delay_sum / started_count) if started_count else 0,
+            "queue_delay_ms_max": math.ceil(delay_max),
+            "behind_ms": math.ceil(behind_ms),
+            "in_flight_count": len(self.pool),
+            "scheduled_count": len(self.schedule.offsets),
+            "dispatched_count": self.position,
+        }, {"name": self.name})
+
+    # wait until every arrival was dispatched and every call finished
+    def join(self, timeout = None):
+        return self.done.wait(timeout)
+
+    # stop dispatching, calls in flight are killed
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill(block=False)
+        self.pool.kill(block=False)
+        self.done.set()
+
+
+##############################################################################
+# Instrumentation of FF_Locust itself, only created when FF_SELF_PROFILE is set (nothing is wrapped otherwise).
+# - wrap() times a function: call count and cumulative time per name. Times are inclusive, a hook's time
+#   contains the ff_log calls it makes, and table server time contains the network wait.
+# - a heartbeat greenlet sleeps lag_interval_s at a time and records how late it wakes up (gevent loop lag);
+#   a wake up later than block_ms counts as the event loop being blocked.
+# - a native watchdog thread records the main thread's stack when the heartbeat is block_ms overdue, so the
+#   blocking code can be found, and with sample_interval_s samples the main thread's stack for a profile
+#   in collapsed stack format ("outer;inner count" lines, as read by flamegraph tools).
+# Every interval_s emit(fields, tags) gets one record per wrapped name (tag name) and one for the process
+# (tag name "process": loop lag, blocking and process CPU time).
+class FF_Self_Profiler():
+    def __init__(self, emit, on_blocked, interval_s = 10.0, lag_interval_s = 0.05, block_ms = 100.0, sample_interval_s = None):
+        self.emit = emit
+        self.on_blocked = on_blocked # called with (blocked ms, stack lines)
+        self.interval_s = interval_s
+        self.lag_interval_s = lag_interval_s
+        self.block_s = block_ms / 1000
+        self.sample_interval_s = sample_interval_s
+        self.entries = {} # name -> [call count, time sum s]
+        self.reported = {} # name -> [call count, time sum s] at the last report
+        self.lag = [0, 0.0, 0.0, 0, 0.0] # lag count, lag sum s, lag max s, blocked count, blocked max s
+        self.heartbeat = time.perf_counter()
+        self.blocked_stack = None # main thread stack captured by the watchdog during the current block
+        self.samples = {} # collapsed stack -> sample count
+        self.cpu_time = time.process_time()
+        self.main_thread_id = None
+        self.is_stopped = False
+        self.greenlets = []
+
+    # function timed under name, for instance attributes and event listeners
+    def wrap(self, name, function):
+        entry = self.entries.setdefault(name, [0, 0.0])
+        perf_counter = time.perf_counter
+        def timed(*args, **kw):
+            t0 = perf_counter()
+            try:
+                return function(*args, **kw)
+            finally:
+                entry[0] += 1
+                entry[1] += perf_counter() - t0
+        return timed
+
+    def start(self):
+        self.main_thread_id = gevent.monkey.get_original('_thread', 'get_ident')()
+        self.greenlets = [gevent.spawn(self.heartbeat_loop), gevent.spawn(self.report_loop)]
+        gevent.monkey.get_original('_thread', 'start_new_thread')(self.watchdog_loop, ())
+        return self
+
+    def heartbeat_loop(self):
+        perf_counter = time.perf_counter
+        while True:
+            t0 = perf_counter()
+            gevent.sleep(self.lag_interval_s)
+            now = perf_counter()
+            self.heartbeat = now
+            late = max(0.0, now - t0 - self.lag_interval_s)
+            lag = self.lag
+            lag[0] += 1
+            lag[1] += late
+            if late > lag[2]:
+                lag[2] = late
+            stack = self.blocked_stack
+            self.blocked_stack = None
+            if late > self.block_s:
+                lag[3] += 1
+                if late > lag[4]:
+                    lag[4] = late
+                self.on_blocked(late * 1000, stack or [])
+
+    # native thread, keeps running while the gevent loop is blocked
+    def watchdog_loop(self):
+        sleep = gevent.monkey.get_original('time', 'sleep')
+        interval_s = self.sample_interval_s or self.block_s / 4
+        while not self.is_stopped:
+            sleep(interval_s)
+            frame = sys._current_frames().get(self.main_thread_id)
+            if frame is None:
+                continue
+            if self.sample_interval_s:
+                stack = ';'.join(FF_Self_Profiler.frame_name(f) for f in reversed(FF_Self_Profiler.frames(frame)))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+            if self.blocked_stack is None and time.perf_counter() - self.heartbeat > self.lag_interval_s + self.block_s:
+                self.blocked_stack = [FF_Self_Profiler.frame_name(f) + ':{}'.format(f.f_lineno) for f in FF_Self_Profiler.frames(frame)]
+
+    # innermost first
+    @staticmethod
+    def frames(frame):
+        result = []
+        while frame is not None:
+            result.append(frame)
+            frame = frame.f_back
+        return result
+
+    @staticmethod
+    def frame_name(frame):
+        return '{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+    def report_loop(self):
+        while True:
+            gevent.sleep(self.interval_s)
+            self.report()
+
+    # one record per wrapped name with calls since the last report, then the process record
+    def report(self):
+        for name, (call_count, time_sum) in list(self.entries.items()):
+            last_count, last_time = self.reported.get(name, (0, 0.0))
+            self.reported[name] = (call_count, time_sum)
+            count = call_count - last_count
+            if count == 0:
+                continue
+            self.emit({
+                "call_count": count,
+                "time_total_ms": round((time_sum - last_time) * 1000, 3),
+                "time_mean_us": round((time_sum - last_time) * 1e6 / count, 3),
+            }, {"name": name})
+        lag_count, lag_sum, lag_max, blocked_count, blocked_max = self.lag
+        self.lag = [0, 0.0, 0.0, 0, 0.0]
+        cpu_time = time.process_time()
+        self.emit({
+            "cpu_time_ms": round((cpu_time - self.cpu_time) * 1000, 3),
+            "loop_lag_ms": round(lag_sum * 1000 / lag_count, 3) if lag_count else 0,
+            "loop_lag_ms_max": round(lag_max * 1000, 3),
+            "blocked_count": blocked_count,
+            "blocked_ms_max": round(blocked_max * 1000, 3),
+        }, {"name": "process"})
+        self.cpu_time = cpu_time
+
+    # write the sampled profile in collapsed stack format, returns the sample count
+    def dump(self, file_path):
+        samples = dict(self.samples)
+        with open(file_path, 'w') as file:
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                file.write('{} {}\n'.format(stack, count))
+        return sum(samples.values())
+
+    def stop(self):
+        self.is_stopped = True
+        for greenlet in self.greenlets:
+            greenlet.kill(block=False)
+        self.report()
 
 
 class FF_Locust():    
+    OPEN_LOOP_WATCH_S = 1.0 # how often watch_open_loops looks at the runner's state
+
     def __init__(self):
         print('FF_INITIALIZED')
+        # FF_SELF_PROFILE=1 instruments FF_Locust itself (see FF_Self_Profiler) and emits ff_locust_self metrics.
+        # Nothing is wrapped when it is not set.
+        self.profiler = None
+        self.profile_dump = os.getenv('FF_SELF_PROFILE_DUMP') # sampled profile written on test_stop or quitting, {pid} is replaced
+        self.profile_dumped = False # written since the last test_start, see dump_profile
+        if os.getenv('FF_SELF_PROFILE'):
+            self.profiler = FF_Self_Profiler(
+                lambda fields, tags: self.ff_log(self.ff_metric("ff_locust_self", fields, tags)), self.report_blocked,
+                interval_s=float(os.getenv('FF_SELF_PROFILE_INTERVAL_S', '10')),
+                block_ms=float(os.getenv('FF_SELF_PROFILE_BLOCK_MS', '100')),
+                sample_interval_s=float(os.getenv('FF_SELF_PROFILE_SAMPLE_MS', '10')) / 1000 if self.profile_dump else None)
+            for name in ('hook_request_success', 'hook_request_fail', 'ff_metric', 'ff_log'):
+                setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        # FF_METRIC_JSON=orjson encodes metric fields with orjson when installed (compact JSON)
+        self.metric_encoder = FF_Metric_Encoder(os.getenv('FF_METRIC_JSON', 'json'))
+        # FF_LOG lines go through a buffer to FF_LOG_SINK (default stdout), see FF_Log_Buffer
+        self.log_buffer = FF_Log_Buffer(FF_Log_Sink.from_spec(os.getenv('FF_LOG_SINK')), self.ff_metric,
+            max_lines=int(os.getenv('FF_LOG_BUFFER_LINES', '100000')),
+            flush_interval_s=float(os.getenv('FF_LOG_FLUSH_INTERVAL_S', '0.2')))
+        atexit.register(self.log_buffer.close)
+        # FF_METRIC_TRANSPORT=udp:<host>:<port> or unix:<path> sends metrics to a local collector as binary
+        # frames (FF_Metric_Transport) instead of FF_LOG lines. Events and errors stay FF_LOG lines.
+        self.metric_transport = None
+        transport_spec = os.getenv('FF_METRIC_TRANSPORT')
+        if transport_spec:
+            sink = FF_Log_Sink.from_spec(transport_spec)
+            if not isinstance(sink, FF_Socket_Sink):
+                raise ValueError('Unknown FF_METRIC_TRANSPORT {}, expected udp:<host>:<port> or unix:<path>'.format(transport_spec))
+            self.metric_transport = FF_Metric_Transport(sink, self.metric_encoder, self.log_buffer.write,
+                lambda is_connected, error: self.report_transport_state(transport_spec, is_connected, error),
+                max_records=int(os.getenv('FF_METRIC_TRANSPORT_RECORDS', '100000')),
+                flush_interval_s=float(os.getenv('FF_LOG_FLUSH_INTERVAL_S', '0.2')),
+                retry_s=float(os.getenv('FF_METRIC_TRANSPORT_RETRY_S', '5')))
+            atexit.register(self.metric_transport.close)
+        # FF_URL_METRIC_MODE: raw (one url metric per request, default), aggregate (one url_agg metric per key
+        # every FF_URL_METRIC_INTERVAL_S, see FF_Url_Aggregator) or both
+        url_metric_mode = os.getenv('FF_URL_METRIC_MODE', 'raw')
+        if url_metric_mode not in ('raw', 'aggregate', 'both'):
+            self.error({"description": "Unknown FF_URL_METRIC_MODE {}, expected raw, aggregate or both. Using raw.".format(url_metric_mode)})
+            url_metric_mode = 'raw'
+        self.is_url_metric_raw = url_metric_mode != 'aggregate'
+        self.url_aggregator = None
+        if url_metric_mode != 'raw':
+            self.url_aggregator = FF_Url_Aggregator(
+                lambda fields, tags: self.ff_log(self.ff_metric("url_agg", fields, tags)),
+                interval_s=float(os.getenv('FF_URL_METRIC_INTERVAL_S', '1')))
         events.request_success.add_listener(self.hook_request_success)
         events.request_failure.add_listener(self.hook_request_fail)
         events.spawning_complete.add_listener(self.hook_spawning_complete)
@@ -40,6 +2399,38 @@ class FF_Locust():
         events.report_to_master.add_listener(self.hook_report_to_master)
         self.url = os.getenv('FF_TABLE_SERVER_URL')
         self.tables = {} # store table state
+        self.table_cursors = {} # local table -> FF_Table_Cursor
+        self.table_samplers = {} # (local table, mode, weight_column, seed) -> FF_Table_Sampler
+        # FF_RANDOM_SEED makes shuffled/weighted get_data_next and get_data_random reproducible.
+        # The worker index (FF_WORKER_INDEX) is part of the seed so workers don't draw the same rows.
+        self.random_seed = os.getenv('FF_RANDOM_SEED')
+        self.rng = random.Random('{}/{}'.format(self.random_seed, os.getenv('FF_WORKER_INDEX', ''))) if self.random_seed else random.Random()
+        self.seeded_rngs = {} # seed argument of get_data_random -> random.Random
+        self.open_loops = [] # FF_Open_Loop runs started by start_open_loop
+        self.open_loop_runs = [] # (schedule, task, kw) registered by add_open_loop, started at spawning_complete
+        self.open_loop_watcher = None # greenlet stopping the registered runs when the runner stops
+        self.stats_exporter = None # FF_Stats_Exporter, created in hook_init
+        self.report_summary = None # FF_Report_Summary, created in hook_init on workers
+        # FF_TABLE_PARTITION=strided|contiguous gives each worker a disjoint share of local tables,
+        # worker FF_WORKER_INDEX (0 based) of FF_WORKER_COUNT
+        self.table_partition = os.getenv('FF_TABLE_PARTITION')
+        self.table_loops = {} # local table -> passes completed by this process
+        self.local_tables_done = set() # local tables whose end was reached with looping = False
+        self.cluster_table_loops = {} # master: table -> {client_id: passes completed}
+        self.cluster_table_loops_announced = {} # master: table -> passes completed by every worker, last announced
+        # FF_PERCENTILES: comma separated percentiles exported per operation, e.g. 50,90,95,99,99.9
+        try:
+            self.percentiles = FF_Locust.parse_percentiles(os.getenv('FF_PERCENTILES') or '50,90,95,99,99.9')
+        except ValueError as error:
+            self.error({"description": "FF_PERCENTILES must be comma separated numbers between 0 and 100. Using 50,90,95,99,99.9.", "message": error})
+            self.percentiles = FF_Locust.parse_percentiles('50,90,95,99,99.9')
+        # tsv files of at least FF_TABLE_STREAM_MIN_BYTES are memory mapped instead of loaded
+        # FF_TABLE_CHECK_INTERVAL_S: how often a cached table's file is checked for changes
+        self.table_cache = FF_Table_Cache(self.env_int('FF_TABLE_STREAM_MIN_BYTES', None), # parsed local tsv files
+            check_interval_s=float(os.getenv('FF_TABLE_CHECK_INTERVAL_S', '1')))
+        self.table_paths = {} # table name -> path, see get_table_path
+        if self.profiler is not None:
+            self.table_cache.load = self.profiler.wrap('table_load', self.table_cache.load)
         self.runner = None
         # self.table = os.getenv('TABLE')
         if self.url is None:
@@ -47,19 +2438,44 @@ class FF_Locust():
         else:
             self.is_local = False
 
+        self.table_client = None
+        self.table_prefetch = {} # remote table -> FF_Table_Prefetch
+        self.prefetch_batch_size = int(os.getenv('FF_TABLE_PREFETCH_BATCH', '0'))
         if self.is_local is False:
-            try:
-                request = requests.get( url )
-                if request.status_code == 200:
-                    self.is_remote_reachable = True
-                else:
-                    self.is_remote_reachable = False
-            except:
-                self.is_remote_reachable = False
+            # FF_TABLE_SERVER_* tune the pooled table server client, the pool is resized to the user count when spawning completes
+            self.table_client = FF_Table_Client(self.url,
+                pool_size=int(os.getenv('FF_TABLE_SERVER_POOL_SIZE', '10')),
+                timeout_s=float(os.getenv('FF_TABLE_SERVER_TIMEOUT_S', '10')),
+                connect_timeout_s=float(os.getenv('FF_TABLE_SERVER_CONNECT_TIMEOUT_S', '3')),
+                retries=int(os.getenv('FF_TABLE_SERVER_RETRIES', '2')),
+                backoff_s=float(os.getenv('FF_TABLE_SERVER_BACKOFF_S', '0.1')),
+                max_concurrency=int(os.getenv('FF_TABLE_SERVER_CONCURRENCY', '64')),
+                deadline_s=float(os.getenv('FF_TABLE_SERVER_DEADLINE_S', '15')))
+            if self.profiler is not None:
+                self.table_client.get = self.profiler.wrap('table_server', self.table_client.get)
+            if not FF_Table_Client.is_cooperative():
+                self.event({"description": "Sockets are not gevent monkey patched, table server calls will block the whole worker while they wait. Import locust before ff_locust."})
+            # Probe in the background so a slow table server doesn't hold up locust startup.
+            # is_remote_reachable is None until the probe has an answer.
+            self.is_remote_reachable = None
+            self.table_probe = gevent.spawn(self.probe_table_server)
         if self.is_local:
             self.ff_log({"description": "FF_TABLE_SERVER_URL environment variable not found. FF Locust Running in local mode and will look for local tsv files"})
         else:
             self.ff_log({"description": "FF_TABLE_SERVER_URL environment variable found. FF Locust Running in remote mode and will look for data at {}".format(self.url)})
+        if self.profiler is not None:
+            self.profiler.start()
+
+    # check the table server answers on its base url, sets is_remote_reachable
+    def probe_table_server(self):
+        try:
+            request = self.table_client.get('')
+            if request.status_code == 200:
+                self.is_remote_reachable = True
+            else:
+                self.is_remote_reachable = False
+        except Exception:
+            self.is_remote_reachable = False
 
     ##############################################################################
     # Fired when a request is completed successfully. This event is typically used to report requests when writing custom clients for locust.
@@ -71,9 +2487,17 @@ class FF_Locust():
     # response_length:Content-length of the response
     # **kw is future proofing against addition of new parameters
     def hook_request_success(self, request_type, name, response_time, response_length, **kw):
-        self.ff_log(self.ff_metric("url", 
-            {"total_time_ms": math.ceil(response_time), "content_length_bytes": response_length},
-            {"operation": name, "method": request_type.upper(), "is_success": True}))
+        if self.stats_exporter is not None:
+            self.stats_exporter.record(name, request_type, response_time)
+        if self.report_summary is not None:
+            self.report_summary.add(name, request_type, True, response_time, response_length)
+        if self.url_aggregator is not None:
+            self.url_aggregator.add(name, request_type.upper(), True, response_time, response_length)
+        if self.is_url_metric_raw:
+            if self.metric_transport is not None:
+                self.metric_transport.add_url(math.ceil(response_time), response_length, name, request_type.upper(), True)
+            else:
+                self.ff_log(self.metric_encoder.encode_url(math.ceil(response_time), response_length, name, request_type.upper(), True))
 
     ##############################################################################
     # Fired when a request fails. This event is typically used to report failed requests when writing custom clients for locust.
@@ -85,10 +2509,18 @@ class FF_Locust():
     # exception:Exception instance that was thrown
     # **kw is future proofing against addition of new parameters
     def hook_request_fail(self, request_type, name, response_time, response_length, exception, **kw):
-        self.ff_log(self.ff_metric("url",
-            # {"total_time_ms": math.ceil(response_time), "content_length_bytes": response_length, "exception": str(exception)},
-            {"total_time_ms": math.ceil(response_time), "content_length_bytes": response_length},
-            {"operation": name, "method": request_type.upper(), "is_error": True}))
+        if self.stats_exporter is not None:
+            self.stats_exporter.record(name, request_type, response_time)
+        if self.report_summary is not None:
+            self.report_summary.add(name, request_type, False, response_time, response_length)
+        if self.url_aggregator is not None:
+            self.url_aggregator.add(name, request_type.upper(), False, response_time, response_length)
+        if self.is_url_metric_raw:
+            # "exception": str(exception) is not added to fields
+            if self.metric_transport is not None:
+                self.metric_transport.add_url(math.ceil(response_time), response_length, name, request_type.upper(), False)
+            else:
+                self.ff_log(self.metric_encoder.encode_url(math.ceil(response_time), response_length, name, request_type.upper(), False))
 
     ##############################################################################
     # Fired when all simulated users has been spawned.
@@ -97,6 +2529,13 @@ class FF_Locust():
     # **kw is future proofing against addition of new parameters
     # @events.spawning_complete.add_listener
     def hook_spawning_complete(self, user_count, **kw):
+        if self.table_client is not None:
+            self.table_client.resize(user_count)
+        # fires on workers too, and again when the user count changes: registered runs start once per test
+        if self.open_loop_runs and self.open_loop_watcher is None and not isinstance(self.runner, runners.MasterRunner):
+            for schedule, task, kw in self.open_loop_runs:
+                self.start_open_loop(schedule, task, **kw)
+            self.open_loop_watcher = gevent.spawn(self.watch_open_loops) if self.runner is not None else False
         self.ff_log(self.ff_metric("spawning_complete",
             {"user_count": user_count}))
 
@@ -105,6 +2544,8 @@ class FF_Locust():
     # 
     # **kw is future proofing against addition of new parameters
     def hook_test_stop(self, **kw):
+        self.stop_open_loops()
+        self.dump_profile()
         self.ff_log(self.ff_metric("test_stop", {"count": 1}))
 
     ##############################################################################
@@ -113,6 +2554,7 @@ class FF_Locust():
     # 
     # **kw is future proofing against addition of new parameters
     def hook_test_start(self, **kw):
+        self.profile_dumped = False
         self.ff_log(self.ff_metric("test_start", {"count": 1}))
 
     ##############################################################################
@@ -136,12 +2578,24 @@ class FF_Locust():
     # environment:Locust environment instance 
     # **kw is future proofing against addition of new parameters
     def hook_quitting(self, environment, **kw):
-        if self.stats_printer is not None:
-            self.stats_printer.kill(block=False)
-        if self.percentiles_printer is not None:
-            self.percentiles_printer.kill(block=False)
+        self.stop_open_loops()
+        if self.table_client is not None:
+            self.ff_log(self.ff_metric("table_server_client", self.table_client.get_counters()))
+        if self.stats_exporter is not None:
+            self.stats_exporter.stop()
+        if self.url_aggregator is not None:
+            self.url_aggregator.close()
+        if self.profiler is not None:
+            # workers get no test_stop, their profile is written here
+            if not self.profile_dumped:
+                self.dump_profile()
+            self.profiler.stop()
         self.ff_log(self.ff_metric("quitting",
             {"count": 1}, {"url": environment.host}))
+        if self.metric_transport is not None:
+            self.ff_log(self.ff_metric("metric_transport", dict(self.metric_transport.counters)))
+            self.metric_transport.flush()
+        self.log_buffer.flush()
 
     ##############################################################################
     # Used when Locust is running in master mode and is fired when the master server receives a report from a Locust worker server.
@@ -151,8 +2605,32 @@ class FF_Locust():
     # data:Data dict with the data from the worker node
     # **kw is future proofing against addition of new parameters
     def hook_worker_report(self, client_id, data, **kw):
-        self.ff_log(self.ff_metric("worker_report",
-            data, {"client_id": client_id}))
+        # request hooks only fire on workers, the master learns which entries changed from their reports
+        if self.stats_exporter is not None:
+            for entry in data.get('stats', ()):
+                self.stats_exporter.mark(entry['name'], entry['method'])
+        for table, loops in data.get('ff_table_loops', {}).items():
+            self.update_cluster_table_loops(client_id, table, loops)
+        # FF summary from FF_Report_Summary: merged into the cluster wide percentile sketches and
+        # emitted per worker as "worker_operation" metrics (tags operation, method, client_id)
+        summary = data.get('ff_summary', ())
+        request_count = 0
+        for entry in summary:
+            request_count += entry['request_count']
+            if self.stats_exporter is not None:
+                self.stats_exporter.merge(entry['name'], entry['method'], FF_Quantile_Sketch.from_dict(entry['sketch']))
+            self.ff_log(self.ff_metric("worker_operation", {
+                "request_count": entry['request_count'],
+                "request_fail_count": entry['failure_count'],
+                "request_success_count": entry['request_count'] - entry['failure_count'],
+                "content_length_bytes_total": entry['content_length_bytes_total'],
+                "average_time_ms": math.ceil(entry['total_time_ms_sum'] / entry['request_count']) if entry['request_count'] else 0,
+            }, {"operation": entry['name'], "method": entry['method'].upper(), "client_id": client_id}))
+        # the raw report (locust stats, errors) is not emitted, only its size
+        fields = {"operation_count": len(summary), "request_count": request_count}
+        if 'user_count' in data:
+            fields['user_count'] = data['user_count']
+        self.ff_log(self.ff_metric("worker_report", fields, {"client_id": client_id}))
 
     ##############################################################################
     # Used when Locust is running in worker mode. It can be used to attach data to the dicts that are regularly sent to the master.
@@ -163,8 +2641,16 @@ class FF_Locust():
     # data:Data dict that can be modified in order to attach data that should be sent to the master.
     # **kw is future proofing against addition of new parameters
     def hook_report_to_master(self, client_id, data, **kw):
+        # passes completed over local tables, the master signals when every worker is done
+        if self.table_loops:
+            data['ff_table_loops'] = dict(self.table_loops)
+        if self.report_summary is None:
+            return
+        summary = self.report_summary.take()
+        data['ff_summary'] = summary
         self.ff_log(self.ff_metric("report_to_master",
-            data, {"client_id": client_id}))
+            {"operation_count": len(summary), "request_count": sum(entry['request_count'] for entry in summary)},
+            {"client_id": client_id}))
 
 
     ##############################################################################
@@ -176,31 +2662,57 @@ class FF_Locust():
     # **kw is future proofing against addition of new parameters
     def hook_init(self, environment, **kw):
         self.runner = environment.runner
-        self.stats_printer = gevent.spawn(self.stats_printer(self.runner.stats))
-        self.percentiles_printer = gevent.spawn(self.percentiles_printer(self.runner.stats))
+        # FF_STATS_INTERVAL_S / FF_PERCENTILES_INTERVAL_S set the export intervals, FF_STATS_IDLE_S how long
+        # an operation keeps being exported after its last request
+        self.stats_exporter = FF_Stats_Exporter(self, self.runner.stats,
+            stats_interval_s=float(os.getenv('FF_STATS_INTERVAL_S', '1')),
+            percentiles_interval_s=float(os.getenv('FF_PERCENTILES_INTERVAL_S', '1')),
+            idle_s=float(os.getenv('FF_STATS_IDLE_S', '10')),
+            window_s=self.env_int('FF_PERCENTILES_WINDOW_S', 10))
+        self.stats_exporter.start()
+        if isinstance(self.runner, runners.WorkerRunner):
+            self.report_summary = FF_Report_Summary()
+            self.set_table_partition()
         self.ff_log(self.ff_metric("init", {"count": 1}, {"url": environment.host}))
 
+    # integer environment variable, default when it is unset. A malformed value is logged and default used
+    # instead, so a typo doesn't stop the plugin from starting.
+    def env_int(self, name, default):
+        value = os.getenv(name)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            self.error({"description": "{} must be an integer, got '{}'. Using the default.".format(name, value)})
+            return default
+
+    # FF_Metric_Transport: the collector became unreachable (metrics are logged meanwhile) or reachable again
+    def report_transport_state(self, spec, is_connected, error):
+        if is_connected:
+            self.event({"description": "Metric collector {} is reachable, metrics are sent to it again.".format(spec)})
+        else:
+            self.event({"description": "Metric collector {} is not reachable, metrics are written as FF_LOG lines until it is.".format(spec), "message": error})
+
+    # FF_Self_Profiler: the gevent loop was blocked for blocked_ms, stack is the main thread's stack during the block, innermost first
+    def report_blocked(self, blocked_ms, stack):
+        self.event({"description": "Event loop blocked for {} ms.".format(round(blocked_ms)), "stack": stack[:30]})
+
     # Create self.ff_metric
     # Outputs JSON in self.ff_metric format
     def ff_metric(self, measurement, fields = None, tags = None):
-        # Create python object
-        metric_object = {
-            "mime_type": "timeseries/metric",
-            "measurement": measurement,
-            "timestamp_epoch_ms": round(time.time() * 1000),
-        }
         # Check parameters of function
         if (fields is None):
             print('FF_ERROR {"description": "No fields for measurement, InfluxDB requires fields."}')
             return
-        else:
-            metric_object["fields"] = fields
-        if (tags is not None):
-            metric_object["tags"] = tags
-
-        # Convert python object into JSON
-        metric_json = json.dumps(metric_object)
-        return metric_json
+        # Same JSON as json.dumps of {"mime_type", "measurement", "timestamp_epoch_ms", "fields", "tags"}
+        if self.metric_transport is None:
+            return self.metric_encoder.encode(measurement, fields, tags)
+        # The same JSON, which ff_log sends to the metric collector instead of writing it
+        timestamp_epoch_ms = round(time.time() * 1000)
+        line = FF_Metric_Line(self.metric_encoder.encode(measurement, fields, tags, timestamp_epoch_ms))
+        line.record = (timestamp_epoch_ms, measurement, fields, tags)
+        return line
     
     def get_table_metadata(self, table):
         if table is None:
@@ -262,7 +2774,115 @@ class FF_Locust():
         # print('update REMAINING', self.tables[table])
         self.tables[table]['__remaining_count'] = len(tsv) - self.tables[table]['__index'] - 1
 
-    def get_data_next(self, table = None, looping = True):
+    # Partition local tables across workers (FF_TABLE_PARTITION), called on workers from hook_init
+    def set_table_partition(self):
+        if not self.table_partition:
+            return
+        try:
+            FF_Table_Shard.bounds(0, 0, 1, self.table_partition) # validates mode
+        except ValueError as error:
+            self.error({"description": "Unknown FF_TABLE_PARTITION, every worker will use whole tables.", "message": error})
+            return
+        share = self.get_worker_share()
+        if share is None:
+            self.error({"description": "FF_TABLE_PARTITION is set but the worker's share can't be determined, every worker will use whole tables. Set FF_WORKER_INDEX and FF_WORKER_COUNT."})
+            return
+        index, count = share
+        self.table_cache.shard = (index, count, self.table_partition)
+        self.event({"description": "Local tables are partitioned {}, this worker uses share {} of {}.".format(self.table_partition, index, count)})
+
+    # (FF_WORKER_INDEX, FF_WORKER_COUNT) of this worker, None when they are not both set.
+    # Values that aren't integers, or an index outside 0 to count - 1, are logged and treated as not set.
+    def get_worker_share(self):
+        index = os.getenv('FF_WORKER_INDEX')
+        count = os.getenv('FF_WORKER_COUNT')
+        if not index or not count:
+            return None
+        try:
+            share = (int(index), int(count))
+            if share[1] < 1 or not 0 <= share[0] < share[1]:
+                raise ValueError('FF_WORKER_INDEX must be between 0 and FF_WORKER_COUNT - 1')
+        except ValueError as error:
+            self.error({"description": "FF_WORKER_INDEX '{}' and FF_WORKER_COUNT '{}' are not a valid worker share, they are ignored.".format(index, count), "message": error})
+            return None
+        return share
+
+    # count a completed pass over a local table (end reached, or wrapped around when looping)
+    def table_loop_completed(self, table):
+        if table[-4:] == '.tsv':
+            table = table[:-4]
+        self.table_loops[table] = self.table_loops.get(table, 0) + 1
+
+    # master: record a worker's completed passes and announce when every worker finished another pass over its share
+    def update_cluster_table_loops(self, client_id, table, loops):
+        workers = self.cluster_table_loops.setdefault(table, {})
+        workers[client_id] = loops
+        if self.runner is not None and len(workers) < self.runner.worker_count:
+            return
+        completed = min(workers.values())
+        if completed > self.cluster_table_loops_announced.get(table, 0):
+            self.cluster_table_loops_announced[table] = completed
+            self.event({"description": "List '{}' completed {} loop(s) on all {} workers.".format(table, completed, len(workers))})
+            self.ff_log(self.ff_metric("table_loop", {"loop_count": completed, "worker_count": len(workers)}, {"table": table}))
+
+    # local tsv files are looked up next to this file
+    def get_table_path(self, table):
+        path = self.table_paths.get(table)
+        if path is None:
+            path = self.table_paths[table] = Path(__file__).parents[0] / table
+        return path
+
+    # Force a local table to be parsed again (e.g. after it was regenerated in place)
+    # Returns row count, or False on error
+    def reload_table(self, table = None):
+        if table is None:
+            self.error({"description": "No table provided to reload.", "is_error": True})
+            return False
+        if not self.is_local:
+            self.error({"description": "reload_table is only available for local tsv files.", "is_error": True})
+            return False
+        file_path = self.get_table_path(table)
+        try:
+            entry = self.table_cache.load(file_path)
+        except Exception as error:
+            self.error({"description": "Failed to read tsv file {}. Check it's existence and ensure it is a well formatted tsv file with column headers.".format(file_path), "is_error": True, "error": error})
+            return False
+        self.ff_log(self.ff_metric("table_load",
+            {"row_count": len(entry['table']), "size_bytes": entry['size'], "load_time_ms": entry['load_time_ms']},
+            {"table": table}))
+        return len(entry['table'])
+
+    # Parse local tables up front, e.g. from a test_start listener, so the first
+    # get_data_next/get_data_random of each table doesn't pay the parse cost inside a task
+    # Returns True if every table loaded
+    def preload_tables(self, tables = None):
+        if tables is None:
+            self.error({"description": "No tables provided to preload.", "is_error": True})
+            return False
+        loaded = True
+        for table in tables:
+            if self.reload_table(table) is False:
+                loaded = False
+        return loaded
+
+    # cursor over a local table, kept across calls and rebuilt when the table is reloaded or the policy changes
+    def get_table_cursor(self, table, tsv, policy, weight_column):
+        name = table[:-4] if table[-4:] == '.tsv' else table
+        cursor = self.table_cursors.get(name)
+        if cursor is not None and cursor.table is tsv and cursor.policy == policy and cursor.weight_column == weight_column:
+            return cursor
+        position = 0
+        if cursor is not None and cursor.policy == policy:
+            position = min(cursor.position, len(tsv)) # same place in a reloaded table
+        cursor = FF_Table_Cursor(name, tsv, policy, weight_column, position=position, rng=self.rng)
+        self.table_cursors[name] = cursor
+        return cursor
+
+    # policy (local tables only):
+    #   'sequential' - rows in file order, wrapping around when looping
+    #   'shuffle'    - every row once per pass in a random order, a new order each pass
+    #   'weighted'   - random rows with probability proportional to the weight_column value, never ends
+    def get_data_next(self, table = None, looping = True, policy = 'sequential', weight_column = None):
         if table == None:
             self.error({"description": "No table provided to metadata for.", "is_error": True})
             return False
@@ -273,17 +2893,29 @@ class FF_Locust():
             # self.error({"description": "Local version of get_next_data is not yet complete.", "is_error": True})
             # return False
             # Look for file
-            file_path = Path(__file__).parents[0] / table
-            # lines = open(file_path).read().splitlines()
-            # Use pandas to read tsv
+            file_path = self.get_table_path(table)
+            # Parsed once by pandas and cached until the file changes
             try:
-                df = pd.read_csv(file_path, sep='\t', header=0)
-                tsv = list(df.T.to_dict().values())
+                tsv = self.table_cache.get(file_path)
             except Exception as error:
                 self.error({"description": "Failed to read tsv file {}. Check it's existence and ensure it is a well formatted tsv file with column headers.".format(file_path), "is_error": True, "error": error})
                 return False
-            # We set table metadata (if metadata is already set its updated and index remains the same)
-            self.set_table_metadata(table, tsv)
+            try:
+                cursor = self.get_table_cursor(table, tsv, policy, weight_column)
+            except (KeyError, ValueError) as error:
+                self.error({"description": "Failed to create {} cursor for table {}.".format(policy, table), "is_error": True, "error": error})
+                return False
+            # One O(1) step of the cursor, no yield in between so concurrent greenlets never get the same row
+            handout = cursor.next(looping)
+            if handout is None:
+                # end of the table with looping = False
+                if cursor.name not in self.local_tables_done:
+                    self.local_tables_done.add(cursor.name)
+                    self.table_loop_completed(table)
+                return None
+            index, remaining_count, is_wrapped = handout
+            if is_wrapped:
+                self.table_loop_completed(table)
             # We must return an object like:
             # {
             #    '__list': 'users',
@@ -294,20 +2926,16 @@ class FF_Locust():
             #    'first_name': 'John',
             #    'last_name': 'Doe'
             # }
-            self.update_remaining_count(table, tsv)
-            metadata = self.get_table_metadata(table) # get table metadata (__ attributes above)
-            index = metadata["__index"]
-            if (looping and index < metadata['__list_count']):
-                # reset index
-                index = 0
-                self.tables[table[:-4]]['__index'] = 0
-                # reset metadata with new index
-                self.update_remaining_count(table, tsv)
-            if (not looping and index == metadata['__list_count']):
-                return None
-            result = tsv[index] # get tsv row at index
+            metadata = {
+                '__index': tsv.table_index(index), # row of the whole table, also when it is partitioned
+                '__remaining_count': remaining_count,
+                '__list': cursor.name,
+                '__timestamp_epoch_ms': round(time.time() * 1000),
+                '__list_count': cursor.count,
+            }
+            self.tables[cursor.name] = metadata
+            result = tsv.row(index) # fresh dict for tsv row at index, the cached table is never modified
             result.update(metadata) # add metadata
-            self.set_next_index(table) # Update table index
             self.ff_log(result)
             return result
         else:
@@ -317,7 +2945,7 @@ class FF_Locust():
             if (table not in self.tables):
                 # We don't know current state of list, we must retrieve this so we can know if we need to stop loop
                 try:
-                    request = requests.get(self.url + 'list/get/' + table + '/metadata')
+                    request = self.table_client.get('list/get/' + table + '/metadata')
                     if request.status_code == 200:
                         data = request.json()
                         if ('is_error' in data):
@@ -329,99 +2957,279 @@ class FF_Locust():
                 except Exception as error:
                     self.error({"description": "Failed to access ff table service /metadata endpoint.", "message": error})
                     return False
-            try:
-                request = requests.get(self.url + 'list/get/' + table + '/next')
-                if request.status_code == 200:
-                    data = request.json()
-                    if ('is_error' in data):
-                        self.error({"description": "Table service reported an error on /next endpoint.", "message": data['short_description']})
-                        return False
-                    if (not looping):
-                        if (data['loop_count'] == self.tables[table]['loop_count']):
-                            self.ff_log(data)
-                            return data
-                        elif data['loop_count'] != self.tables[table]['loop_count'] and 'is_done' not in self.tables[table]:
-                            self.tables[table]['is_done'] = True
-                            self.event({"description": "Loop was detected in list '" + table + "'. get_data_next is running with looping = False so will return None from now on."})
-                            return None
-                        else:
-                            return None
-                        # self.ff_log(data)
-                        # return data
+            # Rows are taken from the prefetch buffer when prefetching is enabled, with a direct /next call as fallback
+            data = None
+            prefetch = self.get_table_prefetch(table)
+            if prefetch is not None:
+                data = prefetch.next()
+            if data is None:
+                try:
+                    request = self.table_client.get('list/get/' + table + '/next')
+                    if request.status_code == 200:
+                        data = request.json()
+                        if ('is_error' in data):
+                            self.error({"description": "Table service reported an error on /next endpoint.", "message": data['short_description']})
+                            return False
                     else:
+                        self.error({"description": "Failed to access ff table service /next endpoint.", "status_code": request.status_code})
+                        return None
+                except Exception as error:
+                    self.error({"description": "Failed to access ff table service /next endpoint.", "message": error})
+                    return False
+            try:
+                if (not looping):
+                    if (data['loop_count'] == self.tables[table]['loop_count']):
                         self.ff_log(data)
                         return data
+                    elif data['loop_count'] != self.tables[table]['loop_count'] and 'is_done' not in self.tables[table]:
+                        self.tables[table]['is_done'] = True
+                        if prefetch is not None:
+                            prefetch.stop() # rows past the end of the list are never handed out
+                        self.event({"description": "Loop was detected in list '" + table + "'. get_data_next is running with looping = False so will return None from now on."})
+                        return None
+                    else:
+                        return None
                 else:
-                    self.error({"description": "Failed to access ff table service /next endpoint.", "status_code": request.status_code})    
+                    self.ff_log(data)
+                    return data
             except Exception as error:
                 self.error({"description": "Failed to access ff table service /next endpoint.", "message": error})
                 return False
 
-    def get_data_random(self, table = None):
-        if table == None:
-            self.error({"description": "No table provided to get data from.", "is_error": true})
+    # prefetch buffer for a remote table, None when FF_TABLE_PREFETCH_BATCH is not set
+    def get_table_prefetch(self, table):
+        if self.prefetch_batch_size <= 0:
+            return None
+        prefetch = self.table_prefetch.get(table)
+        if prefetch is None:
+            prefetch = FF_Table_Prefetch(self.table_client, table, self.error,
+                batch_size=self.prefetch_batch_size,
+                low_water=int(os.getenv('FF_TABLE_PREFETCH_LOW_WATER', self.prefetch_batch_size // 2)),
+                high_water=int(os.getenv('FF_TABLE_PREFETCH_HIGH_WATER', self.prefetch_batch_size * 2)),
+                concurrency=int(os.getenv('FF_TABLE_PREFETCH_CONCURRENCY', '8')),
+                batch_path=os.getenv('FF_TABLE_SERVER_BATCH_PATH'))
+            self.table_prefetch[table] = prefetch
+        return prefetch
+
+    # random.Random for a seed argument, self.rng (FF_RANDOM_SEED) when seed is None
+    def get_random_rng(self, seed):
+        if seed is None:
+            return self.rng
+        rng = self.seeded_rngs.get(seed)
+        if rng is None:
+            rng = random.Random(seed)
+            self.seeded_rngs[seed] = rng
+        return rng
+
+    # sampler over a local table, kept across calls and rebuilt when the table is reloaded
+    def get_table_sampler(self, table, tsv, mode, weight_column, seed):
+        name = table[:-4] if table[-4:] == '.tsv' else table
+        key = (name, mode, weight_column, seed)
+        sampler = self.table_samplers.get(key)
+        if sampler is None or sampler.table is not tsv:
+            sampler = FF_Table_Sampler(tsv, mode, weight_column, self.get_random_rng(seed))
+            self.table_samplers[key] = sampler
+        return sampler
+
+    # list of up to count random rows of a local table, False on error
+    def sample_local_table(self, table, count, mode, weight_column, seed):
+        if (table[-4:].lower() != '.tsv'):
+            self.error({"decription": "Input table file does not end in .tsv", "is_error": True})
             return False
-        if self.is_local:
-            if (table[-4:].lower() != '.tsv'):
-                self.error({"decription": "Input table file does not end in .tsv", "is_error": true})
+        name = table[:-4]
+        # Look for file
+        file_path = self.get_table_path(table)
+        if mode == 'reservoir':
+            # one pass over the file, nothing is loaded or cached
+            try:
+                rows, indexes, list_count = FF_Reservoir_Sample.sample(file_path, count, self.get_random_rng(seed))
+            except Exception as error:
+                self.error({"description": "Failed to read tsv file {}. Check it's existence and ensure it is a well formatted tsv file with column headers.".format(file_path), "is_error": True, "error": error})
                 return False
-            # Look for file
-            file_path = Path(__file__).parents[0] / table
-            # lines = open(file_path).read().splitlines()
-            # Use pandas to read tsv
+            remaining_counts = [list_count] * len(rows)
+        else:
+            # Parsed once by pandas and cached until the file changes
             try:
-                df = pd.read_csv(file_path, sep='\t', header=0)
-                tsv = list(df.T.to_dict().values())
-                self.set_table_metadata(table, tsv)
-                 # We must return an object like:
-                # {
-                #    '__list': 'users',
-                #    '__timestamp_epoch_ms': 1613070277418,
-                #    '__index': 0,
-                #    '__remaining_count': 1,
-                #    '__list_count': 1,
-                #    'first_name': 'John',
-                #    'last_name': 'Doe'
-                # }
-                index = random.choice(range(len(tsv)))
-                result = tsv[index]
-                metadata = self.get_table_metadata(table)
-                metadata['__index'] = index
-                result.update(metadata)
-                self.ff_log(result)
-                return result
+                tsv = self.table_cache.get(file_path)
             except Exception as error:
-                self.error({"description": "Failed to read tsv file {}. Check it's existence and ensure it is a well formatted tsv file with column headers.".format(file_path), "is_error": True,  "error": error})
+                self.error({"description": "Failed to read tsv file {}. Check it's existence and ensure it is a well formatted tsv file with column headers.".format(file_path), "is_error": True, "error": error})
                 return False
+            try:
+                sampler = self.get_table_sampler(table, tsv, mode, weight_column, seed)
+            except (KeyError, ValueError) as error:
+                self.error({"description": "Failed to create {} sampler for table {}.".format(mode, table), "is_error": True, "error": error})
+                return False
+            was_exhausted = sampler.remaining() == 0
+            indexes = []
+            remaining_counts = [] # rows left after each draw, like get_data_next after each row
+            for _ in range(count):
+                index = sampler.draw()
+                if index is None:
+                    if not was_exhausted:
+                        self.event({"description": "Every row of list '{}' was drawn without replacement, get_data_random returns None until the table is reloaded.".format(name)})
+                    break
+                indexes.append(index)
+                remaining_counts.append(sampler.remaining())
+            rows = [tsv.row(index) for index in indexes] # fresh dicts, the cached table is never modified
+            indexes = [tsv.table_index(index) for index in indexes] # rows of the whole table, also when it is partitioned
+            list_count = sampler.count
+        # We must return objects like:
+        # {
+        #    '__list': 'users',
+        #    '__timestamp_epoch_ms': 1613070277418,
+        #    '__index': 0,
+        #    '__remaining_count': 1,
+        #    '__list_count': 1,
+        #    'first_name': 'John',
+        #    'last_name': 'Doe'
+        # }
+        timestamp_epoch_ms = round(time.time() * 1000)
+        for row, index, remaining_count in zip(rows, indexes, remaining_counts):
+            row.update({
+                '__index': index,
+                '__remaining_count': remaining_count,
+                '__list': name,
+                '__timestamp_epoch_ms': timestamp_epoch_ms,
+                '__list_count': list_count,
+            })
+            self.ff_log(row)
+        return rows
+
+    # mode (local tables only, remote tables are sampled uniformly by the table server):
+    #   'uniform'             - any row, with replacement (default)
+    #   'without_replacement' - every row at most once, None once every row was drawn
+    #   'weighted'            - rows with probability proportional to the weight_column value
+    #   'reservoir'           - one pass over the file without loading it, for tables too large to load
+    # seed - draws of calls with the same seed are reproducible (FF_RANDOM_SEED seeds the default)
+    def get_data_random(self, table = None, mode = 'uniform', weight_column = None, seed = None):
+        if table == None:
+            self.error({"description": "No table provided to get data from.", "is_error": True})
+            return False
+        if self.is_local:
+            rows = self.sample_local_table(table, 1, mode, weight_column, seed)
+            if rows is False:
+                return False
+            return rows[0] if rows else None
         else:
+            if mode != 'uniform':
+                self.error({"description": "Sampling mode {} is only available for local tsv files, the table server samples uniformly.".format(mode), "is_error": True})
+                return False
             # Check if table has .extension and strip
             if (table[-4:].lower() == '.tsv'):
                 table = table.split('.')[0]
+            return self.fetch_random_row(table)
+
+    # one /random row of a remote table, False or None on error
+    def fetch_random_row(self, table):
+        try:
+            request = self.table_client.get('list/get/' + table + '/random')
+            if request.status_code == 200:
+                data = request.json()
+                if ('is_error' in data):
+                    self.error({"description": "Table service reported an error.", "message": data['short_description']})
+                    return False
+                return data
+            else:
+                self.error({"description": "Failed to access ff table service.", "status_code": request.status_code})
+        except Exception as error:
+            self.error({"description": "Failed to access ff table service.", "message": error})
+
+    # list of count random rows in one call, see get_data_random for mode and seed.
+    # Without replacement (and reservoir) the list is shorter when the table has fewer rows left.
+    # Remote tables are sampled with one FF_TABLE_SERVER_RANDOM_BATCH_PATH call when set
+    # (e.g. random?count={count}), else with concurrent /random calls.
+    def get_data_random_many(self, table = None, count = 1, mode = 'uniform', weight_column = None, seed = None):
+        if table == None:
+            self.error({"description": "No table provided to get data from.", "is_error": True})
+            return False
+        if self.is_local:
+            return self.sample_local_table(table, count, mode, weight_column, seed)
+        if mode != 'uniform':
+            self.error({"description": "Sampling mode {} is only available for local tsv files, the table server samples uniformly.".format(mode), "is_error": True})
+            return False
+        if (table[-4:].lower() == '.tsv'):
+            table = table.split('.')[0]
+        batch_path = os.getenv('FF_TABLE_SERVER_RANDOM_BATCH_PATH')
+        if batch_path is not None:
             try:
-                request = requests.get(self.url + 'list/get/' + table + '/random')
-                if request.status_code == 200:
-                    data = request.json()
-                    if ('is_error' in data):
-                        self.error({"description": "Table service reported an error.", "message": data['short_description']})
-                        return False
-                    return data
-                else:
-                    self.error({"description": "Failed to access ff table service.", "status_code": request.status_code})    
+                request = self.table_client.get('list/get/' + table + '/' + batch_path.format(count=count))
+                if request.status_code != 200:
+                    self.error({"description": "Failed to access ff table service random batch endpoint.", "status_code": request.status_code})
+                    return False
+                rows = request.json()
+                if isinstance(rows, dict):
+                    self.error({"description": "Table service reported an error on random batch endpoint.", "message": rows.get('short_description')})
+                    return False
+                return rows
             except Exception as error:
-                self.error({"description": "Failed to access ff table service.", "message": error})
-        
-
-    # manage interval for stat printing
-    def stats_printer(self, stats):
-        def stats_printer_func():
-            while True:
-                self.print_stats(stats)
-                gevent.sleep(1) # output every second 
-        return stats_printer_func
-
-    # print aggregate stats
-    def print_stats(self, stats):
-        for key in stats.entries.keys():
+                self.error({"description": "Failed to access ff table service random batch endpoint.", "message": error})
+                return False
+        if count <= 0:
+            return []
+        # concurrency is bounded by the table client (FF_TABLE_SERVER_CONCURRENCY)
+        pool = gevent.pool.Pool(min(count, int(os.getenv('FF_TABLE_PREFETCH_CONCURRENCY', '8'))))
+        rows = pool.map(lambda _: self.fetch_random_row(table), range(count))
+        return [row for row in rows if row]
+
+    # Register an open-loop run of task() at the arrivals of schedule (see start_open_loop), e.g. at the top of the locustfile.
+    # Registered runs start at spawning_complete, which unlike test_start fires on workers, once per test. They never
+    # run on a master. They stop at test_stop, when the runner stops (workers get no test_stop) and at quitting.
+    def add_open_loop(self, schedule, task, **kw):
+        self.open_loop_runs.append((schedule, task, kw))
+
+    # Run task() at the arrivals of an FF_Arrival_Schedule (open-loop, see FF_Open_Loop) now, see add_open_loop.
+    # The schedule is the cluster wide load: with FF_WORKER_INDEX and FF_WORKER_COUNT set each worker runs its share.
+    # A master sends no load and returns None. Emits an "open_loop" metric every FF_OPEN_LOOP_INTERVAL_S.
+    # Returns the FF_Open_Loop, join() waits for the end.
+    def start_open_loop(self, schedule, task, name = 'open_loop', request_type = 'OPEN_LOOP', pool_size = None, miss_ms = None):
+        if isinstance(self.runner, runners.MasterRunner):
+            self.event({"description": "Open-loop run '{}' not started on the master, workers run it.".format(name)})
+            return None
+        share = self.get_worker_share()
+        if share is not None:
+            schedule = schedule.shard(*share)
+        open_loop = FF_Open_Loop(schedule, task,
+            lambda fields, tags: self.ff_log(self.ff_metric("open_loop", fields, tags)),
+            request_type=request_type, name=name,
+            pool_size=pool_size if pool_size is not None else int(os.getenv('FF_OPEN_LOOP_POOL_SIZE', '1000')),
+            miss_ms=miss_ms if miss_ms is not None else float(os.getenv('FF_OPEN_LOOP_MISS_MS', '10')),
+            interval_s=float(os.getenv('FF_OPEN_LOOP_INTERVAL_S', '1')))
+        self.open_loops.append(open_loop)
+        self.event({"description": "Open-loop run '{}' started: {} arrivals over {} s.".format(name, len(schedule), schedule.duration_s)})
+        return open_loop.start()
+
+    # Write the FF_SELF_PROFILE_DUMP profile, an error is logged and doesn't stop the caller
+    def dump_profile(self):
+        if self.profiler is None or not self.profile_dump:
+            return
+        self.profile_dumped = True
+        try:
+            file_path = self.profile_dump.format(pid=os.getpid())
+            sample_count = self.profiler.dump(file_path)
+            self.event({"description": "Wrote a profile of {} samples to {}.".format(sample_count, file_path)})
+        except Exception as error:
+            self.error({"description": "Failed to write profile to {}.".format(self.profile_dump), "message": error})
+
+    # Stop every open-loop run. Registered runs start again at the next spawning_complete.
+    def stop_open_loops(self):
+        for open_loop in self.open_loops:
+            open_loop.stop()
+        self.open_loops = []
+        watcher, self.open_loop_watcher = self.open_loop_watcher, None
+        if watcher and watcher is not gevent.getcurrent():
+            watcher.kill(block=False)
+
+    # Workers stop a test without test_stop: poll the runner's state and stop the open-loop runs with it.
+    def watch_open_loops(self):
+        while self.runner.state not in (runners.STATE_STOPPING, runners.STATE_STOPPED, runners.STATE_CLEANUP):
+            gevent.sleep(self.OPEN_LOOP_WATCH_S)
+        self.stop_open_loops()
+
+    # print aggregate stats of keys (default all entries)
+    def print_stats(self, stats, keys = None):
+        if keys is None:
+            keys = list(stats.entries.keys())
+        for key in keys:
             # key is name of run == operation
             # num_requests 41
             # num_none_requests 0
@@ -434,13 +3242,15 @@ class FF_Locust():
             # num_reqs_per_sec {1613680823: 2, 1613680824: 3, 1613680825: 2, 1613680826: 2, 1613680827: 3, 1613680828: 4, 1613680829: 2, 1613680830: 1, 1613680831: 2, 1613680832: 1, 1613680836: 1, 1613680837: 3, 1613680838: 2, 1613680839: 2, 1613680840: 2, 1613680841: 3, 1613680842: 2, 1613680843: 3, 1613680844: 1}
             # num_fail_per_sec {}
             # total_content_length 1476
-            entry = stats.entries[key]
+            entry = stats.entries.get(key)
+            if entry is None:
+                continue
             fields = {
                 "request_fail_count": entry.num_failures,
                 "request_success_count": entry.num_requests - entry.num_failures, # ??
                 "request_count": entry.num_requests,
                 "average_time_ms": math.ceil(entry.avg_response_time),
-                "minimum_time_ms": math.ceil(entry.min_response_time),
+                "minimum_time_ms": math.ceil(entry.min_response_time or 0),
                 "maximum_time_ms": math.ceil(entry.max_response_time),
                 "median_time_ms": math.ceil(entry.median_response_time),
                 "requests_per_s": entry.current_rps,
@@ -452,32 +3262,62 @@ class FF_Locust():
                 "method": key[1].upper()
             }
             self.ff_log(self.ff_metric("operation", fields, tags))
+        return len(keys)
 
-    # manage interval for percentile stat printing
-    def percentiles_printer(self, stats):
-        def percentiles_printer_func():
-            while True:
-                self.print_percentiles(stats)
-                gevent.sleep(1) # output every second 
-        return percentiles_printer_func
-
-    def print_percentiles(self, stats):
-        for key in sorted(stats.entries.keys()):
-            stat_object = stats.entries[key]
-            if stat_object.response_times:
-                t0 = round(time.time() * 1000)
-                fields = {
-                    "95th": math.ceil(stat_object.get_response_time_percentile(0.95)),
-                    "90th": math.ceil(stat_object.get_response_time_percentile(0.90))
-                }
-                tags = {
-                    "operation": key[0],
-                    "method": key[1].upper()
-                }
-                self.ff_log(self.ff_metric("operation", fields, tags))
-                t1 = round(time.time() * 1000)
-                total_time_ms = t1 - t0
-                self.ff_log(self.ff_metric("method", {"time_total_ms": total_time_ms, "bin_count": len(stat_object.response_times)}, {"method": "percentiles"}))
+    # [(fraction, field name)] for "50,99.9" -> [(0.5, "50th"), (0.999, "99.9th")]
+    # raises ValueError for a value that isn't a number between 0 and 100, or when there is none
+    @staticmethod
+    def parse_percentiles(spec):
+        percentiles = []
+        for value in spec.split(','):
+            value = value.strip()
+            if value:
+                percent = float(value)
+                if not 0 <= percent <= 100:
+                    raise ValueError('percentile {} is not between 0 and 100'.format(value))
+                percentiles.append((percent / 100, value + 'th'))
+        if not percentiles:
+            raise ValueError('no percentiles in {}'.format(spec))
+        return percentiles
+
+    # print response time percentiles of keys (default all entries)
+    # Fields are the FF_PERCENTILES list ("50th", "95th", "99.9th", ...) over the whole test and,
+    # when windowed sketches are kept, the same over the last FF_PERCENTILES_WINDOW_S ("95th_window", ...).
+    # returns the number of response time bins that were scanned
+    def print_percentiles(self, stats, keys = None):
+        if keys is None:
+            keys = sorted(stats.entries.keys())
+        sketches = self.stats_exporter.sketches if self.stats_exporter is not None else {}
+        window_sketches = self.stats_exporter.window_sketches if self.stats_exporter is not None else {}
+        fractions = [fraction for fraction, _ in self.percentiles]
+        names = [field for _, field in self.percentiles]
+        window_names = [field + '_window' for field in names]
+        bin_count = 0
+        for key in keys:
+            sketch = sketches.get(key)
+            if sketch is not None and sketch.count:
+                fields = dict(zip(names, map(math.ceil, sketch.quantiles(fractions))))
+                bin_count += len(sketch.buckets)
+                window_sketch = window_sketches.get(key)
+                if window_sketch is not None:
+                    window = window_sketch.merged()
+                    if window.count:
+                        fields.update(zip(window_names, map(math.ceil, window.quantiles(fractions))))
+                        bin_count += len(window.buckets)
+            else:
+                stat_object = stats.entries.get(key)
+                if stat_object is None or not stat_object.response_times:
+                    continue
+                fields = {}
+                for fraction, field in self.percentiles:
+                    fields[field] = math.ceil(stat_object.get_response_time_percentile(fraction))
+                bin_count += len(stat_object.response_times)
+            tags = {
+                "operation": key[0],
+                "method": key[1].upper()
+            }
+            self.ff_log(self.ff_metric("operation", fields, tags))
+        return bin_count
 
     def error(self, error_json):
         if ('is_error' not in error_json):
@@ -497,5 +3337,98 @@ class FF_Locust():
     # input metric JSON
     # output FF_LOG {JSON}
     def ff_log(self, ff_json):
-        # Print JSON
-        print("FF_LOG {}".format(ff_json))
+        # metrics of ff_metric go to the collector when FF_METRIC_TRANSPORT is set
+        if type(ff_json) is FF_Metric_Line and self.metric_transport is not None:
+            self.metric_transport.add_record(ff_json.record)
+            return
+        # Buffered, written by the log buffer's flusher
+        self.log_buffer.write("FF_LOG {}".format(ff_json))
+
+
+##############################################################################
+# Command line tools
+#
+# python -m ff_locust compile users.tsv [products.tsv ...] [-o users.fft]
+#   Writes each tsv as a compiled table next to it (users.tsv -> users.fft).
+#   get_data_next/get_data_random pick the compiled table up automatically.
+#
+# python -m ff_locust collect udp:127.0.0.1:9125 [-o metrics.log]
+#   Local collector for FF_METRIC_TRANSPORT: decodes the binary frames and writes each
+#   metric as the FF_LOG line the text output would have had.
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog='python -m ff_locust', description='FF Locust table tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    compile_parser = commands.add_parser('compile', help='compile tsv tables to the binary .fft format')
+    compile_parser.add_argument('tables', nargs='+', help='tsv files to compile')
+    compile_parser.add_argument('-o', '--output', help='output file, only valid with a single input table')
+    collect_parser = commands.add_parser('collect', help='receive FF_METRIC_TRANSPORT metrics and write them as FF_LOG lines')
+    collect_parser.add_argument('address', help='udp:<host>:<port> or unix:<path>, the FF_METRIC_TRANSPORT value')
+    collect_parser.add_argument('-o', '--output', help='append to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compile':
+        if args.output is not None and len(args.tables) > 1:
+            parser.error('--output can only be used with a single table')
+        for table in args.tables:
+            output = args.output if args.output is not None else FF_Table_Cache.compiled_path(table)
+            t0 = time.time()
+            compiled = FF_Table_Cache.parse_tsv(table)
+            compiled.save(output)
+            print('{} -> {} ({} rows, {} columns, {} ms)'.format(table, output, len(compiled), len(compiled.columns), math.ceil((time.time() - t0) * 1000)))
+    elif args.command == 'collect':
+        output = open(args.output, 'a') if args.output is not None else sys.stdout
+        try:
+            collect(args.address, output)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+# serve the collector for `python -m ff_locust collect` until interrupted
+def collect(address, output):
+    def write(metrics):
+        if metrics:
+            output.write(''.join('FF_LOG {}\n'.format(json.dumps(metric)) for metric in metrics))
+            output.flush()
+
+    kind, _, target = address.partition(':')
+    if kind == 'udp':
+        host, _, port = target.rpartition(':')
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind((host, int(port)))
+        decoder = FF_Frame_Decoder()
+        while True:
+            datagram = server.recv(65536)
+            try:
+                write(decoder.decode(datagram))
+            except (ValueError, KeyError, struct.error) as error:
+                sys.stderr.write('Dropped undecodable datagram: {}\n'.format(error))
+    elif kind == 'unix':
+        if os.path.exists(target):
+            os.remove(target)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(target)
+        server.listen(16)
+
+        def serve(connection):
+            decoder = FF_Frame_Decoder()
+            with connection:
+                while True:
+                    data = connection.recv(65536)
+                    if not data:
+                        return
+                    try:
+                        write(decoder.feed(data))
+                    except (ValueError, KeyError, struct.error) as error:
+                        sys.stderr.write('Closing connection with undecodable data: {}\n'.format(error))
+                        return
+
+        while True:
+            connection, _ = server.accept()
+            gevent.spawn(serve, connection)
+    else:
+        raise ValueError('Unknown collector address {}, expected udp:<host>:<port> or unix:<path>'.format(address))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# Shared fixtures for the ff_locust tests: python -m pytest -q tests
+#
+# Tests reuse the benchmark suite's helpers: its fake table server (run as a subprocess)
+# and ff_instance(), which builds an FF_Locust and detaches it from locust's events afterwards.
+import contextlib
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+BENCH = REPO / 'benchmarks' / 'bench_ff_locust.py'
+sys.path.insert(0, str(REPO))
+sys.path.insert(0, str(BENCH.parent))
+
+import locust # monkey patches like a locustfile would, before ff_locust is imported
+import bench_ff_locust as bench # also sends FF_LOG lines to os.devnull unless FF_LOG_SINK is set
+
+
+# make_ff(**env) -> FF_Locust built with env set, closed at the end of the test
+@pytest.fixture
+def make_ff():
+    with contextlib.ExitStack() as stack:
+        yield lambda **env: stack.enter_context(bench.ff_instance(**env))
+
+
+# table_server(rows, delay_ms = 0) -> base url of a fake table server serving rows {"name": "user<i>"},
+# every response delayed by delay_ms. Stopped at the end of the test.
+@pytest.fixture
+def table_server():
+    servers = []
+
+    def start(rows, delay_ms = 0):
+        server = subprocess.Popen([sys.executable, str(BENCH), '--serve-table', str(rows), '--serve-delay-ms', str(delay_ms)],
+            stdout=subprocess.PIPE, text=True)
+        servers.append(server)
+        port = int(server.stdout.readline())
+        return 'http://127.0.0.1:{}/'.format(port)
+
+    yield start
+    for server in servers:
+        server.kill()
+        server.wait()
+        server.stdout.close()
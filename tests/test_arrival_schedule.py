@@ -0,0 +1,42 @@
+# FF_Arrival_Schedule phases chained with then() / concat() and read from_tsv
+import random
+
+import pytest
+
+import ff_locust
+
+Schedule = ff_locust.FF_Arrival_Schedule
+
+
+def test_then_shifts_every_phase_by_the_ones_before():
+    schedule = Schedule.constant(2, 3).then(Schedule.constant(1, 2), Schedule.ramp(0, 4, 1), Schedule.constant(5, 0))
+    assert schedule.duration_s == 6
+    assert list(schedule.offsets) == pytest.approx([0, 0.5, 1, 1.5, 2, 2.5, 3, 4, 5, 5 + 0.5 ** 0.5])
+    assert list(schedule.then().offsets) == list(schedule.offsets)
+    chained = Schedule.constant(2, 3).then(Schedule.constant(1, 2)).then(Schedule.ramp(0, 4, 1))
+    assert list(chained.offsets) == list(schedule.offsets)
+    assert Schedule.concat([]).duration_s == 0 and len(Schedule.concat([])) == 0
+
+
+def test_rate_profile_from_tsv(tmp_path):
+    path = tmp_path / 'profile.tsv'
+    lines = ['duration_s\trate\tend_rate'] + ['2\t{}\t'.format(rate) for rate in range(1, 301)] + ['4\t10\t30']
+    path.write_text('\n'.join(lines) + '\n')
+    schedule = Schedule.from_tsv(path)
+    expected = Schedule.concat([Schedule.constant(rate, 2) for rate in range(1, 301)] + [Schedule.ramp(10, 30, 4)])
+    assert schedule.duration_s == 604
+    assert len(schedule) == sum(2 * rate for rate in range(1, 301)) + 80
+    assert list(schedule.offsets) == list(expected.offsets)
+    assert all(a <= b for a, b in zip(schedule.offsets, schedule.offsets[1:]))
+    poisson = Schedule.from_tsv(path, poisson=True, rng=random.Random(2))
+    assert poisson.duration_s == 604
+    assert all(a <= b for a, b in zip(poisson.offsets, poisson.offsets[1:]))
+    assert poisson.offsets[-1] < 604
+
+
+def test_recorded_arrivals_from_tsv(tmp_path):
+    path = tmp_path / 'arrivals.tsv'
+    path.write_text('timestamp_epoch_ms\tpath\n1000500\t/b\n1000000\t/a\n1002000\t/c\n')
+    schedule = Schedule.from_tsv(path)
+    assert list(schedule.offsets) == [0, 0.5, 2]
+    assert schedule.duration_s == 2
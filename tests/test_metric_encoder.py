@@ -0,0 +1,40 @@
+# FF_Metric_Encoder output against json.dumps of the metric envelope
+import json
+
+import ff_locust
+
+
+def envelope(measurement, fields, tags, timestamp_epoch_ms):
+    metric = {"mime_type": "timeseries/metric", "measurement": measurement, "timestamp_epoch_ms": timestamp_epoch_ms, "fields": fields}
+    if tags is not None:
+        metric['tags'] = tags
+    return json.dumps(metric)
+
+
+def test_equal_tag_values_of_different_types_are_not_shared():
+    encoder = ff_locust.FF_Metric_Encoder()
+    for tags in ({"flag": True}, {"flag": 1}, {"flag": 1.0}, {"flag": False}, {"flag": 0}, {"flag": 0.0}, {"flag": True}):
+        assert encoder.encode("x", {"v": 1}, tags, 1000) == envelope("x", {"v": 1}, tags, 1000)
+
+
+def test_output_is_json_dumps_of_the_envelope():
+    encoder = ff_locust.FF_Metric_Encoder()
+    cases = [
+        ("url", {"total_time_ms": 12, "content_length_bytes": 512}, {"operation": "/a", "method": "GET", "is_success": True}),
+        ("operation", {"50th": 3, "99.9th": 12.5}, {"operation": "café \"x\"", "method": "POST"}),
+        ("init", {"count": 1}, None),
+        ("user_error", {"exception": "boom"}, {"is_error": True, "list": [1, 2]}), # unhashable tag value
+        ("x", {"v": None}, {"n": None}),
+    ]
+    for _ in range(2): # second round comes from the caches
+        for measurement, fields, tags in cases:
+            assert encoder.encode(measurement, fields, tags, 1234) == envelope(measurement, fields, tags, 1234)
+
+
+def test_encode_url_is_the_url_metric():
+    encoder = ff_locust.FF_Metric_Encoder()
+    for is_success in (True, False, True):
+        tags = {"operation": "/api/item", "method": "GET", "is_success" if is_success else "is_error": True}
+        expected = envelope("url", {"total_time_ms": 13, "content_length_bytes": 512}, tags, 99)
+        assert encoder.encode_url(13, 512, "/api/item", "GET", is_success, 99) == expected
+        assert encoder.encode("url", {"total_time_ms": 13, "content_length_bytes": 512}, tags, 99) == expected
@@ -0,0 +1,195 @@
+# FF_METRIC_TRANSPORT: FF_Frame_Encoder -> FF_Frame_Decoder round trips and FF_Metric_Transport's FF_LOG fallback
+import json
+import random
+import socket
+
+import pytest
+
+import ff_locust
+
+
+# the records of every kind the encoder takes, with the JSON text ff_metric / encode_url would have logged for each
+def sample_records(rng, count):
+    text = ff_locust.FF_Metric_Encoder()
+    records = []
+    expected = []
+    for i in range(count):
+        timestamp_epoch_ms = 1613070277418 + i
+        if rng.random() < 0.7:
+            operation = rng.choice(['/api/item/{}'.format(i % 40), 'café "x"', ''])
+            # values the fixed url layout can't hold are sent as a generic metric
+            total_time_ms = rng.choice([13, 0, 2 ** 32, 12.5, -1])
+            content_length_bytes = rng.choice([512, 0, -5, 2 ** 40])
+            record = (timestamp_epoch_ms, total_time_ms, content_length_bytes, operation, rng.choice(['GET', 'POST']), rng.random() < 0.9)
+            expected.append(text.encode_url(*record[1:], timestamp_epoch_ms))
+        else:
+            fields = {"count": i, "ratio": i / 7, "name": "x{}".format(i % 5), "ok": i % 2 == 0, "none": None,
+                "list": [1, "a"], "huge": 2 ** 70, "negative": -i}
+            tags = rng.choice([None, {}, {"operation": "/api/{}".format(i % 9), "is_error": True}])
+            record = (timestamp_epoch_ms, rng.choice(['operation', 'user_error']), fields, tags)
+            expected.append(text.encode(*record[1:], timestamp_epoch_ms))
+        records.append(record)
+    return records, [json.loads(line) for line in expected]
+
+
+@pytest.mark.parametrize('max_bytes', [1, 300, 60000])
+def test_every_batch_decodes_on_its_own(max_bytes):
+    records, expected = sample_records(random.Random(max_bytes), 3000)
+    encoder = ff_locust.FF_Frame_Encoder()
+    for _ in range(2): # ids assigned by the first round are reused by the second
+        batches = encoder.encode_batches(records, max_bytes)
+        assert all(len(batch) <= max(max_bytes, 400) for batch in batches)
+        decoded = [metric for batch in batches for metric in ff_locust.FF_Frame_Decoder().decode(batch)]
+        assert decoded == expected
+
+
+def test_stream_decodes_in_any_chunks_across_string_table_resets():
+    rng = random.Random(3)
+    encoder = ff_locust.FF_Frame_Encoder(max_strings=50)
+    decoder = ff_locust.FF_Frame_Decoder()
+    for _ in range(4):
+        records, expected = sample_records(rng, 500)
+        stream = b''.join(encoder.encode_batches(records, 2000))
+        decoded = []
+        position = 0
+        while position < len(stream):
+            size = rng.choice([1, 3, 7, 100, 5000])
+            decoded.extend(decoder.feed(stream[position:position + size]))
+            position += size
+        assert decoder.pending == b''
+        assert decoded == expected
+
+
+def test_truncated_batch_is_an_error():
+    batch = ff_locust.FF_Frame_Encoder().encode_batches([(1, 2, 3, '/a', 'GET', True)])[0]
+    with pytest.raises(ValueError):
+        ff_locust.FF_Frame_Decoder().decode(batch[:-1])
+
+
+def start_transport(sink, retry_s = 3600.0):
+    lines = []
+    states = []
+    transport = ff_locust.FF_Metric_Transport(sink, ff_locust.FF_Metric_Encoder(), lines.append,
+        lambda is_connected, error: states.append((is_connected, error)), flush_interval_s=3600, retry_s=retry_s)
+    return transport, lines, states
+
+
+def test_unix_collector_down_falls_back_to_ff_log_lines_and_recovers(tmp_path):
+    path = str(tmp_path / 'collector.sock')
+    transport, lines, states = start_transport(ff_locust.FF_Socket_Sink(socket.AF_UNIX, socket.SOCK_STREAM, path), retry_s=0)
+    try:
+        # no collector: FF_LOG lines with the metrics' own timestamps
+        transport.add_url(12, 512, '/api/item', 'GET', True)
+        transport.add_record((1000, 'operation', {"request_count": 3}, {"operation": "/api/item"}))
+        timestamp_epoch_ms = transport.records[0][0]
+        transport.flush()
+        assert [json.loads(line[len('FF_LOG '):]) for line in lines] == [
+            {"mime_type": "timeseries/metric", "measurement": "url", "timestamp_epoch_ms": timestamp_epoch_ms,
+                "fields": {"total_time_ms": 12, "content_length_bytes": 512}, "tags": {"operation": "/api/item", "method": "GET", "is_success": True}},
+            {"mime_type": "timeseries/metric", "measurement": "operation", "timestamp_epoch_ms": 1000,
+                "fields": {"request_count": 3}, "tags": {"operation": "/api/item"}},
+        ]
+        assert all(line.startswith('FF_LOG ') for line in lines)
+        assert [is_connected for is_connected, _ in states] == [False]
+        assert isinstance(states[0][1], OSError)
+        assert transport.counters['fallback_count'] == 2
+        assert transport.counters['metric_count'] == 0
+
+        # the collector starts: the next flush goes to it
+        collector = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        collector.bind(path)
+        collector.listen(1)
+        transport.add_url(30, 0, '/api/order', 'POST', False)
+        transport.flush()
+        connection, _ = collector.accept()
+        connection.settimeout(5)
+        metrics = ff_locust.FF_Frame_Decoder().feed(connection.recv(65536))
+        assert [(metric['measurement'], metric['fields'], metric['tags']) for metric in metrics] == [
+            ('url', {"total_time_ms": 30, "content_length_bytes": 0}, {"operation": "/api/order", "method": "POST", "is_error": True})]
+        assert len(lines) == 2
+        assert [is_connected for is_connected, _ in states] == [False, True]
+        assert transport.counters['metric_count'] == 1
+        connection.close()
+        collector.close()
+    finally:
+        transport.close()
+
+
+def test_udp_collector_down_is_noticed_from_the_refused_datagram():
+    closed = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    closed.bind(('127.0.0.1', 0))
+    address = closed.getsockname()
+    closed.close()
+    transport, lines, states = start_transport(ff_locust.FF_Socket_Sink(socket.AF_INET, socket.SOCK_DGRAM, address))
+    try:
+        # the first batch is sent to nobody and lost (see FF_Metric_Transport)
+        transport.add_record((1000, 'first', {"v": 1}, None))
+        transport.flush()
+        assert lines == [] and states == []
+        transport.add_record((2000, 'second', {"v": 2}, None))
+        transport.flush()
+        assert [json.loads(line[len('FF_LOG '):])['measurement'] for line in lines] == ['second']
+        assert [is_connected for is_connected, _ in states] == [False]
+        # until retry_s passed, metrics go straight to FF_LOG lines
+        transport.add_record((3000, 'third', {"v": 3}, None))
+        transport.flush()
+        assert [json.loads(line[len('FF_LOG '):])['timestamp_epoch_ms'] for line in lines] == [2000, 3000]
+        assert transport.counters['fallback_count'] == 2
+    finally:
+        transport.close()
+
+
+def test_ff_metric_returns_the_json_and_ff_log_sends_it(make_ff, tmp_path):
+    ff = make_ff(FF_METRIC_TRANSPORT='unix:' + str(tmp_path / 'collector.sock'))
+    try:
+        written = []
+        ff.log_buffer.write = written.append
+        line = ff.ff_metric("operation", {"request_count": 3}, {"operation": "/api/item"})
+        metric = json.loads(line)
+        assert (metric['measurement'], metric['fields'], metric['tags']) == ("operation", {"request_count": 3}, {"operation": "/api/item"})
+        ff.ff_log(line)
+        assert written == []
+        assert ff.metric_transport.records == [(metric['timestamp_epoch_ms'], "operation", {"request_count": 3}, {"operation": "/api/item"})]
+        # anything else ff_log gets is still written, e.g. the text of a metric
+        ff.ff_log(str(line))
+        ff.ff_log({"description": "event"})
+        assert written == ["FF_LOG " + line, "FF_LOG {'description': 'event'}"]
+    finally:
+        ff.metric_transport.close()
+
+
+def test_content_length_beyond_u64_is_sent_as_a_generic_metric():
+    text = ff_locust.FF_Metric_Encoder()
+    records = [(1000, 13, 512, '/a', 'GET', True), (1001, 13, 2 ** 64, '/a', 'GET', True), (1002, 13, 2 ** 64 - 1, '/a', 'GET', True)]
+    for max_bytes in (1, 60000): # the fast path packs url metrics once '/a' and 'GET' are defined in the batch
+        batches = ff_locust.FF_Frame_Encoder().encode_batches(records, max_bytes)
+        decoded = [metric for batch in batches for metric in ff_locust.FF_Frame_Decoder().decode(batch)]
+        assert decoded == [json.loads(text.encode_url(*record[1:], record[0])) for record in records]
+
+
+def test_metric_that_cant_be_encoded_is_an_ff_log_line_and_the_rest_is_sent(tmp_path):
+    path = str(tmp_path / 'collector.sock')
+    collector = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    collector.bind(path)
+    collector.listen(1)
+    transport, lines, states = start_transport(ff_locust.FF_Socket_Sink(socket.AF_UNIX, socket.SOCK_STREAM, path))
+    try:
+        transport.add_url(12, 512, '/api/item', 'GET', True)
+        transport.add_url(13, 0, '/api/\udc80', 'GET', True)
+        transport.add_record((1000, 'operation', {"name": "x\udc80"}, None))
+        transport.add_record((2 ** 63, 'operation', {"request_count": 1}, None))
+        transport.add_url(14, 0, '/api/item', 'GET', True)
+        transport.flush()
+        connection, _ = collector.accept()
+        connection.settimeout(5)
+        metrics = ff_locust.FF_Frame_Decoder().feed(connection.recv(65536))
+        assert [metric['fields']['total_time_ms'] for metric in metrics] == [12, 14]
+        assert [json.loads(line[len('FF_LOG '):])['measurement'] for line in lines] == ['url', 'operation', 'operation']
+        assert states == []
+        assert transport.counters['encode_error_count'] == 3
+        assert transport.counters['metric_count'] == 2
+        assert transport.flusher.dead is False
+        connection.close()
+    finally:
+        transport.close()
+        collector.close()
@@ -0,0 +1,60 @@
+# Open-loop runs registered with add_open_loop: started at spawning_complete on workers, never on a master,
+# stopped when the runner stops and at quitting
+import types
+
+import gevent
+import locust.runners as runners
+
+import ff_locust
+
+Schedule = ff_locust.FF_Arrival_Schedule
+
+
+def test_registered_run_starts_once_per_test_with_the_worker_share(make_ff, monkeypatch):
+    monkeypatch.setattr(ff_locust.FF_Locust, 'OPEN_LOOP_WATCH_S', 0.01)
+    ff = make_ff(FF_WORKER_INDEX=1, FF_WORKER_COUNT=2)
+    ff.ff_log = lambda line: None
+    ff.runner = types.SimpleNamespace(state=runners.STATE_RUNNING)
+    calls = []
+    ff.add_open_loop(Schedule.constant(100, 0.1), lambda: calls.append(1), name='checkout')
+    assert ff.open_loops == []
+    ff.hook_spawning_complete(user_count=5)
+    ff.hook_spawning_complete(user_count=8) # the user count changed, the run is not started again
+    assert len(ff.open_loops) == 1
+    assert ff.open_loops[0].join(5)
+    assert len(calls) == 5
+    # a worker's runner stops without test_stop
+    ff.runner.state = runners.STATE_STOPPED
+    gevent.sleep(0.1)
+    assert ff.open_loops == [] and ff.open_loop_watcher is None
+    ff.runner.state = runners.STATE_RUNNING
+    ff.hook_spawning_complete(user_count=5)
+    assert ff.open_loops[0].join(5)
+    assert len(calls) == 10
+    ff.stop_open_loops()
+
+
+def test_master_runs_no_open_loop(make_ff):
+    ff = make_ff()
+    ff.ff_log = lambda line: None
+    ff.runner = runners.MasterRunner.__new__(runners.MasterRunner)
+    calls = []
+    ff.add_open_loop(Schedule.constant(100, 0.1), lambda: calls.append(1))
+    ff.hook_spawning_complete(user_count=10)
+    assert ff.start_open_loop(Schedule.constant(100, 0.1), lambda: calls.append(1)) is None
+    gevent.sleep(0.2)
+    assert ff.open_loops == [] and calls == []
+
+
+def test_quitting_stops_open_loops(make_ff):
+    ff = make_ff()
+    ff.ff_log = lambda line: None
+    calls = []
+    open_loop = ff.start_open_loop(Schedule.constant(100, 60), lambda: calls.append(1))
+    gevent.sleep(0.05)
+    ff.hook_quitting(environment=types.SimpleNamespace(host='http://localhost'))
+    assert open_loop.join(0)
+    gevent.sleep(0.01) # the kills land
+    count = len(calls)
+    gevent.sleep(0.1)
+    assert len(calls) == count and ff.open_loops == []
@@ -0,0 +1,62 @@
+# FF_Quantile_Sketch and FF_Windowed_Sketch against exact percentiles
+import math
+import random
+
+import pytest
+
+import ff_locust
+
+
+# value at rank q * (n - 1) of the sorted values, the rank the sketch answers for
+def exact(values, q):
+    ordered = sorted(values)
+    return ordered[math.floor(q * (len(ordered) - 1))]
+
+
+def test_quantiles_are_within_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(4, 1.5) for _ in range(20000)]
+    sketch = ff_locust.FF_Quantile_Sketch()
+    for value in values:
+        sketch.add(value)
+    qs = [0, 0.5, 0.9, 0.95, 0.99, 0.999, 1]
+    for q, value in zip(qs, sketch.quantiles(qs)):
+        assert value == pytest.approx(exact(values, q), rel=0.011)
+    assert min(values) <= sketch.quantile(0) <= sketch.quantile(1) <= max(values)
+
+
+def test_quantiles_after_new_buckets_appear():
+    sketch = ff_locust.FF_Quantile_Sketch()
+    for value in (10, 10, 10):
+        sketch.add(value)
+    assert sketch.quantile(0.5) == pytest.approx(10, rel=0.01)
+    for value in (1000, 1000, 1000, 1000): # new bucket after the sorted order was cached
+        sketch.add(value)
+    assert sketch.quantile(0.5) == pytest.approx(1000, rel=0.01)
+    assert sketch.quantiles([]) == []
+    assert ff_locust.FF_Quantile_Sketch().quantiles([0.5, 0.9]) == [None, None]
+
+
+def test_windowed_sketch_forgets_expired_seconds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ff_locust.time, 'monotonic', lambda: now[0])
+    window = ff_locust.FF_Windowed_Sketch(window_s=3)
+    for second, value in enumerate((100, 200, 300, 400, 500)):
+        now[0] = 1000.0 + second
+        for _ in range(10):
+            window.add(value)
+    # seconds 2, 3 and 4 are in the window
+    merged = window.merged()
+    assert merged.count == 30
+    assert (merged.min, merged.max) == (300, 500)
+    assert merged.quantile(0) == pytest.approx(300, rel=0.01)
+    assert merged.quantile(0.5) == pytest.approx(400, rel=0.01)
+    other = ff_locust.FF_Quantile_Sketch()
+    other.add(50)
+    window.merge(other)
+    assert window.merged().quantile(0) == pytest.approx(50, rel=0.01)
+    now[0] = 1010.0
+    merged = window.merged()
+    assert merged.count == 0
+    assert merged.buckets == {}
+    assert merged.quantile(0.5) is None
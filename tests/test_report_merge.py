@@ -0,0 +1,115 @@
+# Worker summaries (FF_Report_Summary) merged by the master (hook_worker_report), with workers in their own processes.
+# Each worker fires request events, builds its report like locust does before sending it to the master,
+# and writes the msgpack encoded report with the raw samples it drew. The master merges every report and
+# its counts and percentiles are compared with the ones computed from all raw samples.
+import json
+import math
+import os
+import subprocess
+import sys
+
+import msgpack
+import pytest
+
+import bench_ff_locust as bench
+import ff_locust
+from conftest import REPO
+
+WORKER = '''
+import random, sys
+sys.path.insert(0, {repo!r})
+import locust
+from locust import events
+import msgpack
+import ff_locust
+seed, output = int(sys.argv[1]), sys.argv[2]
+rng = random.Random(seed)
+ff = ff_locust.FF_Locust()
+ff.report_summary = ff_locust.FF_Report_Summary() # what hook_init does on a WorkerRunner
+samples = []
+for _ in range(rng.randrange(3000, 6000)):
+    name, method = rng.choice([('/api/item', 'GET'), ('/api/order', 'POST')])
+    response_time = rng.lognormvariate(3 + seed % 3, 1)
+    response_length = rng.randrange(0, 4096)
+    is_success = rng.random() > 0.1
+    if is_success:
+        events.request_success.fire(request_type=method, name=name, response_time=response_time, response_length=response_length)
+    else:
+        events.request_failure.fire(request_type=method, name=name, response_time=response_time, response_length=response_length, exception=ValueError('HTTP 500'))
+    samples.append([name, method, is_success, response_time, response_length])
+data = {{}}
+ff.hook_report_to_master('worker-{{}}'.format(seed), data)
+with open(output, 'wb') as out:
+    out.write(msgpack.packb({{"data": data, "samples": samples}}, use_bin_type=True))
+'''.format(repo=str(REPO))
+
+
+# value at rank q * (n - 1) of the sorted values, the rank the sketch answers for
+def exact(values, q):
+    ordered = sorted(values)
+    return ordered[math.floor(q * (len(ordered) - 1))]
+
+
+def run_workers(tmp_path, seeds):
+    outputs = [tmp_path / 'worker_{}.msgpack'.format(seed) for seed in seeds]
+    env = dict(os.environ, FF_LOG_SINK='file:' + os.devnull)
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER, str(seed), str(output)], stdout=subprocess.DEVNULL, env=env)
+        for seed, output in zip(seeds, outputs)]
+    for worker in workers:
+        assert worker.wait(timeout=120) == 0
+    reports = []
+    for output in outputs:
+        with open(output, 'rb') as report:
+            reports.append(msgpack.unpackb(report.read(), raw=False))
+    return reports
+
+
+def test_master_merges_worker_summaries(make_ff, tmp_path):
+    reports = run_workers(tmp_path, [1, 2, 3])
+    ff = make_ff()
+    ff.hook_init(bench.locust_environment())
+    ff.stats_exporter.stop()
+    logged = []
+    ff.ff_log = logged.append
+    for seed, report in zip([1, 2, 3], reports):
+        ff.hook_worker_report('worker-{}'.format(seed), report['data'])
+    metrics = [json.loads(line) for line in logged if isinstance(line, str)]
+
+    # per worker and operation counts, as reported by each worker
+    worker_operations = {(metric['tags']['client_id'], metric['tags']['operation']): metric['fields']
+        for metric in metrics if metric['measurement'] == 'worker_operation'}
+    for seed, report in zip([1, 2, 3], reports):
+        for name in ('/api/item', '/api/order'):
+            samples = [sample for sample in report['samples'] if sample[0] == name]
+            fields = worker_operations[('worker-{}'.format(seed), name)]
+            assert fields['request_count'] == len(samples)
+            assert fields['request_fail_count'] == sum(1 for sample in samples if not sample[2])
+            assert fields['request_success_count'] == sum(1 for sample in samples if sample[2])
+            assert fields['content_length_bytes_total'] == sum(sample[4] for sample in samples)
+            assert fields['average_time_ms'] == math.ceil(sum(sample[3] for sample in samples) / len(samples))
+
+    # cluster wide percentiles against the percentiles of every raw sample
+    all_samples = [sample for report in reports for sample in report['samples']]
+    qs = [0.5, 0.9, 0.95, 0.99, 0.999]
+    for name, method in (('/api/item', 'GET'), ('/api/order', 'POST')):
+        times = [sample[3] for sample in all_samples if sample[0] == name]
+        sketch = ff.stats_exporter.sketches[(name, method)]
+        assert sketch.count == len(times)
+        for q, value in zip(qs, sketch.quantiles(qs)):
+            assert value == pytest.approx(exact(times, q), rel=0.011)
+        # merging loses nothing: the same as one sketch of every sample
+        reference = ff_locust.FF_Quantile_Sketch()
+        for response_time in times:
+            reference.add(response_time)
+        assert sketch.quantiles(qs) == reference.quantiles(qs)
+        assert ff.stats_exporter.window_sketches[(name, method)].merged().count == len(times)
+
+    # and the operation metrics the master exports from them
+    logged.clear()
+    ff.print_percentiles(ff.runner.stats, [('/api/item', 'GET'), ('/api/order', 'POST')])
+    operations = {metric['tags']['operation']: metric['fields'] for metric in map(json.loads, logged)}
+    for name in ('/api/item', '/api/order'):
+        times = [sample[3] for sample in all_samples if sample[0] == name]
+        for fraction, field in ff.percentiles:
+            assert operations[name][field] == pytest.approx(math.ceil(exact(times, fraction)), rel=0.011, abs=1)
+            assert operations[name][field + '_window'] == operations[name][field]
@@ -0,0 +1,43 @@
+# FF_SELF_PROFILE_DUMP: the sampled profile is written on test_stop, and when quitting on workers (no test_stop there)
+import types
+
+import gevent
+
+QUITTING = dict(environment=types.SimpleNamespace(host='http://localhost'))
+
+
+def profiled(make_ff, dump):
+    ff = make_ff(FF_SELF_PROFILE=1, FF_SELF_PROFILE_DUMP=dump, FF_SELF_PROFILE_SAMPLE_MS=1)
+    logged = []
+    ff.ff_log = logged.append
+    ff.profiler.start()
+    gevent.sleep(0.05)
+    return ff, logged
+
+
+def test_worker_writes_its_profile_when_quitting(make_ff, tmp_path):
+    ff, logged = profiled(make_ff, str(tmp_path / 'ff_locust.{pid}.folded'))
+    ff.hook_quitting(**QUITTING)
+    dumps = list(tmp_path.iterdir())
+    assert len(dumps) == 1
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in dumps[0].read_text().splitlines())
+    assert any(entry.get('description', '').startswith('Wrote a profile') for entry in logged if isinstance(entry, dict))
+
+
+def test_profile_written_on_test_stop_is_not_written_again_when_quitting(make_ff, tmp_path):
+    path = tmp_path / 'ff_locust.folded'
+    ff, logged = profiled(make_ff, str(path))
+    ff.hook_test_start()
+    ff.hook_test_stop()
+    assert path.exists()
+    path.unlink()
+    ff.hook_quitting(**QUITTING)
+    assert not path.exists()
+
+
+def test_failed_dump_is_logged_and_quitting_goes_on(make_ff, tmp_path):
+    ff, logged = profiled(make_ff, str(tmp_path / 'missing' / '{bad}.folded'))
+    ff.hook_quitting(**QUITTING)
+    assert any(entry.get('description', '').startswith('Failed to write profile') for entry in logged if isinstance(entry, dict))
+    assert ff.profiler.is_stopped
+    assert '"measurement": "quitting"' in logged[-1]
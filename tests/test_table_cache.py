@@ -0,0 +1,44 @@
+# FF_Table_Cache: tables are reused between checks and reloaded when their file changed
+import os
+
+import ff_locust
+
+
+def write_tsv(path, names):
+    path.write_text('id\tname\n' + ''.join('{}\t{}\n'.format(i, name) for i, name in enumerate(names)))
+
+
+def test_file_changes_are_picked_up_at_the_next_check(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ff_locust.time, 'monotonic', lambda: now[0])
+    path = tmp_path / 'users.tsv'
+    write_tsv(path, ['a', 'b'])
+    cache = ff_locust.FF_Table_Cache(check_interval_s=1.0)
+    table = cache.get(path)
+    assert len(table) == 2
+    write_tsv(path, ['a', 'b', 'c'])
+    os.utime(path, ns=(1, 1))
+    now[0] += 0.5
+    assert cache.get(path) is table # not checked again yet
+    now[0] += 0.6
+    assert len(cache.get(path)) == 3
+    # a shard change is seen without waiting for the next check
+    cache.shard = (1, 2, 'strided')
+    assert [cache.get(path).row(0)['name']] == ['b']
+
+
+def test_compiled_table_is_used_while_it_is_newer_than_the_tsv(tmp_path):
+    path = tmp_path / 'users.tsv'
+    write_tsv(path, ['a', 'b'])
+    assert ff_locust.FF_Table_Cache.find_source(path)[0] == path
+    ff_locust.FF_Table_Cache.parse_tsv(path).save(path.with_suffix('.fft'))
+    os.utime(path, ns=(1, 1))
+    cache = ff_locust.FF_Table_Cache(check_interval_s=0)
+    assert cache.entries == {}
+    assert cache.get(path).row(1) == {'id': 1, 'name': 'b'}
+    assert cache.entries[path.resolve()]['source'] == path.with_suffix('.fft').resolve()
+    # a newer tsv wins, and a compiled table is enough on its own
+    write_tsv(path, ['a', 'b', 'c'])
+    assert len(cache.get(path)) == 3
+    os.remove(path)
+    assert len(cache.get(path)) == 2
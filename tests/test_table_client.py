@@ -0,0 +1,145 @@
+# FF_Table_Client against the benchmark suite's fake table server
+import time
+
+import gevent
+import gevent.pool
+import pytest
+import requests
+
+import ff_locust
+
+
+# M calls from more greenlets than the pool has connections, returns the latency of each call in ms
+def call_concurrently(client, path, call_count, greenlet_count):
+    def call(_):
+        t0 = time.perf_counter()
+        response = client.get(path)
+        assert response.status_code == 200
+        return (time.perf_counter() - t0) * 1000
+    return list(gevent.pool.Pool(greenlet_count).imap_unordered(call, range(call_count)))
+
+
+# greenlet that ticks every interval_s, stands in for users whose tasks don't touch the table server.
+# Returns the list of tick times, which keeps growing until the greenlet is killed.
+def start_ticker(interval_s = 0.01):
+    ticks = []
+
+    def tick():
+        while True:
+            ticks.append(time.perf_counter())
+            gevent.sleep(interval_s)
+    return ticks, gevent.spawn(tick)
+
+
+def test_sequential_calls_reuse_one_connection(table_server):
+    client = ff_locust.FF_Table_Client(table_server(100), pool_size=1)
+    try:
+        latencies = call_concurrently(client, 'list/get/users/next', 50, 1)
+        counters = client.get_counters()
+        assert counters['request_count'] == 50
+        assert counters['connection_count'] == 1
+        assert counters['connection_reuse_ratio'] == 1 - 1 / 50
+        assert counters['error_count'] == 0
+        assert max(latencies) < 1000
+    finally:
+        client.close()
+
+
+def test_pool_opens_at_most_pool_size_connections(table_server):
+    pool_size = 4
+    client = ff_locust.FF_Table_Client(table_server(100), pool_size=pool_size, max_concurrency=pool_size)
+    try:
+        latencies = call_concurrently(client, 'list/get/users/next', 400, 32)
+        counters = client.get_counters()
+        assert len(latencies) == 400
+        assert counters['request_count'] == 400
+        assert 1 <= counters['connection_count'] <= pool_size
+        assert counters['connection_reuse_ratio'] >= 1 - pool_size / 400
+        assert counters['wait_count'] > 0 # 32 greenlets shared 4 slots
+    finally:
+        client.close()
+
+
+def test_resize_counts_connections_of_the_old_pool(table_server):
+    client = ff_locust.FF_Table_Client(table_server(100), pool_size=2, max_concurrency=2)
+    try:
+        call_concurrently(client, 'list/get/users/next', 20, 2)
+        before = client.get_counters()['connection_count']
+        client.resize(8)
+        call_concurrently(client, 'list/get/users/next', 20, 2)
+        counters = client.get_counters()
+        assert counters['pool_size'] == 8
+        assert counters['request_count'] == 40
+        assert before <= counters['connection_count'] <= before + 2
+    finally:
+        client.close()
+
+
+def test_get_data_next_shares_the_pool(make_ff, table_server):
+    ff = make_ff(FF_TABLE_SERVER_URL=table_server(1000), FF_TABLE_SERVER_POOL_SIZE=4, FF_TABLE_SERVER_CONCURRENCY=4)
+    ff.table_probe.join()
+    assert ff.is_remote_reachable is True
+    rows = []
+    pool = gevent.pool.Pool(16)
+    for _ in range(16):
+        pool.spawn(lambda: rows.extend(ff.get_data_next('users.tsv') for _ in range(25)))
+    pool.join()
+    assert len(rows) == 400
+    assert len({row['__index'] for row in rows}) == 400
+    counters = ff.table_client.get_counters()
+    # probe, 400 rows and the metadata, fetched by every greenlet that started before the first answer
+    assert 402 <= counters['request_count'] <= 417
+    assert counters['connection_count'] <= 4
+
+
+def test_deadline_fires_while_other_greenlets_run(table_server):
+    client = ff_locust.FF_Table_Client(table_server(100, delay_ms=1000), deadline_s=0.2)
+    ticks, ticker = start_ticker()
+    try:
+        t0 = time.perf_counter()
+        with pytest.raises(requests.exceptions.Timeout):
+            client.get('list/get/users/next')
+        elapsed = time.perf_counter() - t0
+        counters = client.get_counters()
+        assert 0.2 <= elapsed < 0.6
+        assert counters['deadline_count'] == 1
+        assert counters['error_count'] == 1
+        assert len([tick for tick in ticks if tick >= t0]) >= 10 # about 20 in 0.2 s
+    finally:
+        ticker.kill()
+        client.close()
+
+
+def test_slow_server_only_delays_its_callers(table_server):
+    client = ff_locust.FF_Table_Client(table_server(100, delay_ms=300), max_concurrency=2, deadline_s=0.8)
+    ticks, ticker = start_ticker()
+    try:
+        t0 = time.perf_counter()
+        calls = [gevent.spawn(client.get, 'list/get/users/next') for _ in range(6)]
+        gevent.joinall(calls)
+        elapsed = time.perf_counter() - t0
+        counters = client.get_counters()
+        # 2 slots: calls run 2 at a time, the last pair waits past its deadline
+        assert sum(1 for call in calls if call.successful()) == 4
+        assert counters['deadline_count'] == 2
+        assert counters['wait_count'] == 4
+        assert counters['connection_count'] <= 2 + counters['deadline_count']
+        # the ticker kept its pace the whole time
+        during = [tick for tick in ticks if tick >= t0]
+        assert len(during) >= elapsed / 0.01 * 0.5
+        assert max(b - a for a, b in zip(during, during[1:])) < 0.1
+    finally:
+        ticker.kill()
+        client.close()
+
+
+def test_get_data_next_returns_false_at_the_deadline(make_ff, table_server):
+    ff = make_ff(FF_TABLE_SERVER_URL=table_server(100, delay_ms=1000), FF_TABLE_SERVER_DEADLINE_S=0.2)
+    ticks, ticker = start_ticker()
+    try:
+        t0 = time.perf_counter()
+        assert ff.get_data_next('users.tsv') is False
+        assert time.perf_counter() - t0 < 0.6
+        assert len([tick for tick in ticks if tick >= t0]) >= 10
+    finally:
+        ticker.kill()
@@ -0,0 +1,54 @@
+# FF_Table rows against the row dicts pandas gives for the same tsv (df.T.to_dict(), what tables returned before)
+import io
+import math
+
+import pandas as pd
+import pytest
+
+import ff_locust
+
+TSV = ('flag\tcount\tratio\tcity\tname\tmixed\n'
+    'True\t1\t0.5\tToronto\tann\tTrue\n'
+    '\t2\t\tToronto\tbob\t3\n'
+    'False\t\t1.5\t\t\tx\n'
+    'True\t4\t2.5\tOttawa\tcat\t\n'
+    'False\t5\t3.5\tToronto\tdan\tFalse\n')
+
+
+def same(a, b):
+    return a.keys() == b.keys() and all(a[key] == b[key] and type(a[key]) is type(b[key])
+        or (isinstance(a[key], float) and math.isnan(a[key]) and isinstance(b[key], float) and math.isnan(b[key])) for key in a)
+
+
+@pytest.fixture
+def frame():
+    return pd.read_csv(io.StringIO(TSV), sep='\t', header=0)
+
+
+def test_rows_keep_the_values_pandas_read(frame, tmp_path):
+    expected = frame.T.to_dict()
+    table = ff_locust.FF_Table.from_dataframe(frame)
+    kinds = {name: kind for name, kind, _ in table.columns}
+    # a bool column with a missing cell is object dtype: its values are kept as they are
+    assert kinds['flag'] == 'o'
+    assert kinds['city'] == 'c' and kinds['name'] == 's' and kinds['mixed'] == 's'
+    assert table.row(0)['flag'] is True and table.row(2)['flag'] is False
+    path = tmp_path / 'users.fft'
+    table.save(path)
+    compiled = ff_locust.FF_Table.open_compiled(path)
+    for i in range(len(frame)):
+        assert same(table.row(i), expected[i])
+        assert same(compiled.row(i), expected[i])
+    compiled.close()
+
+
+def test_mixed_object_column_with_none_keeps_its_values(tmp_path):
+    values = [True, None, 1.5, 'a', 7, float('nan')]
+    table = ff_locust.FF_Table.from_dataframe(pd.DataFrame({'v': pd.Series(values, dtype=object)}))
+    assert [kind for _, kind, _ in table.columns] == ['o']
+    rows = [table.row(i)['v'] for i in range(len(values))]
+    assert rows[:5] == [True, None, 1.5, 'a', 7] and type(rows[4]) is int and math.isnan(rows[5])
+    table.save(tmp_path / 'mixed.fft')
+    compiled = ff_locust.FF_Table.open_compiled(tmp_path / 'mixed.fft')
+    assert [compiled.row(i)['v'] for i in range(5)] == rows[:5] and math.isnan(compiled.row(5)['v'])
+    compiled.close()
@@ -0,0 +1,159 @@
+# Row handouts of local tables: FF_Lazy_Permutation, FF_Alias_Table and get_data_next across greenlets
+import itertools
+import random
+
+import gevent
+import gevent.pool
+import pandas as pd
+import pytest
+
+import ff_locust
+
+# chi-square critical values at p = 0.001, by degrees of freedom
+CHI2_CRITICAL = {3: 16.266, 4: 18.467, 5: 20.515}
+
+
+def chi_square(observed, expected):
+    return sum((observed[key] - expected[key]) ** 2 / expected[key] for key in expected)
+
+
+@pytest.fixture
+def users_tsv(tmp_path):
+    path = tmp_path / 'users.tsv'
+    with open(path, 'w') as tsv:
+        tsv.write('id\tname\tweight\n')
+        for i in range(500):
+            tsv.write('{}\tuser{}\t{}\n'.format(i, i, i % 5))
+    return str(path)
+
+
+# 20000 rows move from swaps in a dict to a full array part way through the first cycle
+@pytest.mark.parametrize('count', [0, 1, 2, 7, 1000, 20000])
+def test_permutation_gives_each_index_once_per_cycle(count):
+    rng = random.Random(count)
+    for _ in range(3):
+        permutation = ff_locust.FF_Lazy_Permutation(count, rng)
+        drawn = []
+        for remaining in range(count, 0, -1):
+            assert permutation.remaining() == remaining
+            drawn.append(permutation.next())
+        assert permutation.next() is None
+        assert permutation.remaining() == 0
+        assert sorted(drawn) == list(range(count))
+    if count == 20000:
+        assert permutation.values is not None
+
+
+def test_permutation_orders_are_uniform():
+    rng = random.Random(3)
+    observed = dict.fromkeys(itertools.permutations(range(3)), 0)
+    for _ in range(6000):
+        permutation = ff_locust.FF_Lazy_Permutation(3, rng)
+        observed[tuple(permutation.next() for _ in range(3))] += 1
+    assert chi_square(observed, dict.fromkeys(observed, 1000)) < CHI2_CRITICAL[5]
+
+
+def test_shuffle_cursor_gives_each_row_once_per_pass():
+    table = ff_locust.FF_Table.from_dataframe(pd.DataFrame({'id': range(300)}))
+    cursor = ff_locust.FF_Table_Cursor('ids', table, 'shuffle', rng=random.Random(1))
+    passes = []
+    for loop in range(3):
+        handouts = [cursor.next() for _ in range(300)]
+        assert [wrapped for _, _, wrapped in handouts] == [loop > 0] + [False] * 299
+        assert [remaining for _, remaining, _ in handouts] == list(range(299, -1, -1))
+        assert sorted(index for index, _, _ in handouts) == list(range(300))
+        passes.append([index for index, _, _ in handouts])
+    assert passes[0] != passes[1] != passes[2]
+    assert cursor.next(looping=False) is None
+
+
+@pytest.mark.parametrize('weights', [[1, 2, 3, 4, 10], [0, 5, float('nan'), 1, -3, 0.5, 0.5, 3]])
+def test_alias_table_draws_follow_the_weights(weights):
+    alias = ff_locust.FF_Alias_Table(weights)
+    rng = random.Random(11)
+    draws = 100000
+    observed = dict.fromkeys(range(len(weights)), 0)
+    for _ in range(draws):
+        observed[alias.draw(rng)] += 1
+    clean = [weight if weight == weight and weight > 0 else 0 for weight in weights]
+    expected = {i: draws * weight / sum(clean) for i, weight in enumerate(clean) if weight > 0}
+    assert all(observed[i] == 0 for i, weight in enumerate(clean) if weight == 0)
+    assert chi_square(observed, expected) < CHI2_CRITICAL[len(expected) - 1]
+
+
+def test_alias_table_needs_a_positive_weight():
+    for weights in ([], [0, 0], [float('nan'), -1]):
+        with pytest.raises(ValueError):
+            ff_locust.FF_Alias_Table(weights)
+
+
+@pytest.mark.parametrize('policy', ['sequential', 'shuffle'])
+def test_concurrent_get_data_next_never_hands_out_a_row_twice(make_ff, users_tsv, policy):
+    ff = make_ff(FF_RANDOM_SEED=5)
+    ff.ff_log = lambda line: None
+    handouts = [] # in the order get_data_next returned them
+    ended = []
+
+    def user():
+        while True:
+            row = ff.get_data_next(users_tsv, looping=False, policy=policy)
+            if row is None:
+                ended.append(True)
+                return
+            handouts.append(row)
+            gevent.sleep(0) # every greenlet gets its turn between two rows
+    pool = gevent.pool.Pool(32)
+    for _ in range(32):
+        pool.spawn(user)
+    pool.join(raise_error=True)
+    assert len(ended) == 32
+    assert sorted(row['__index'] for row in handouts) == list(range(500))
+    assert all(row['id'] == row['__index'] for row in handouts)
+    assert sorted(row['__remaining_count'] for row in handouts) == list(range(500))
+
+
+def test_concurrent_looping_shuffle_gives_each_row_once_per_pass(make_ff, users_tsv):
+    ff = make_ff(FF_RANDOM_SEED=5)
+    ff.ff_log = lambda line: None
+    handouts = []
+
+    def user():
+        for _ in range(50):
+            handouts.append(ff.get_data_next(users_tsv, policy='shuffle')['__index'])
+            gevent.sleep(0)
+    pool = gevent.pool.Pool(30)
+    for _ in range(30):
+        pool.spawn(user)
+    pool.join(raise_error=True)
+    assert len(handouts) == 1500
+    for loop in range(3):
+        assert sorted(handouts[loop * 500:(loop + 1) * 500]) == list(range(500))
+
+
+def test_concurrent_weighted_get_data_next_follows_the_weights(make_ff, users_tsv):
+    ff = make_ff(FF_RANDOM_SEED=5)
+    ff.ff_log = lambda line: None
+    observed = dict.fromkeys(range(5), 0)
+
+    def user():
+        for _ in range(500):
+            observed[ff.get_data_next(users_tsv, policy='weighted', weight_column='weight')['weight']] += 1
+            gevent.sleep(0)
+    gevent.joinall([gevent.spawn(user) for _ in range(20)], raise_error=True)
+    # weight w is the weight of 100 rows, drawn with probability w / 10
+    assert observed[0] == 0
+    assert chi_square(observed, {w: 10000 * w / 10 for w in range(1, 5)}) < CHI2_CRITICAL[3]
+
+
+def test_get_data_random_many_counts_remaining_rows_per_row(make_ff, users_tsv):
+    ff = make_ff(FF_RANDOM_SEED=5)
+    ff.ff_log = lambda line: None
+    drawn = []
+    for expected in (range(499, 299, -1), range(299, 99, -1), range(99, -1, -1), []):
+        rows = ff.get_data_random_many(users_tsv, 200, mode='without_replacement')
+        assert [row['__remaining_count'] for row in rows] == list(expected)
+        drawn.extend(row['__index'] for row in rows)
+    assert sorted(drawn) == list(range(500))
+    for mode in ('uniform', 'reservoir'):
+        rows = ff.get_data_random_many(users_tsv, 10, mode=mode)
+        assert [row['__remaining_count'] for row in rows] == [500] * 10
@@ -0,0 +1,83 @@
+# Local tables partitioned across workers (FF_TABLE_PARTITION)
+import pytest
+
+import bench_ff_locust as bench
+import ff_locust
+
+
+@pytest.fixture
+def users_tsv(tmp_path):
+    path = tmp_path / 'users.tsv'
+    with open(path, 'w') as tsv:
+        tsv.write('id\tname\tscore\n')
+        for i in range(1003):
+            tsv.write('{}\tuser{}\t{}\n'.format(i, i % 7, '' if i % 11 == 0 else i / 4))
+    return path
+
+
+@pytest.mark.parametrize('mode', ['strided', 'contiguous'])
+@pytest.mark.parametrize('chunk_rows', [1, 64, 100000])
+def test_shards_are_read_in_chunks_and_cover_every_row_once(users_tsv, monkeypatch, mode, chunk_rows):
+    monkeypatch.setattr(ff_locust.FF_Table_Cache, 'SHARD_CHUNK_ROWS', chunk_rows)
+    full = ff_locust.FF_Table_Cache.parse_tsv(users_tsv)
+    seen = []
+    for index in range(4):
+        shard = ff_locust.FF_Table_Cache.parse_tsv(users_tsv, (index, 4, mode))
+        start, step, count = ff_locust.FF_Table_Shard.bounds(len(full), index, 4, mode)
+        assert len(shard) == count
+        for i in range(count):
+            row = shard.row(i)
+            expected = full.row(start + i * step)
+            assert (row['id'], row['name']) == (expected['id'], expected['name'])
+            assert row['score'] == expected['score'] or (row['score'] != row['score'] and expected['score'] != expected['score'])
+            seen.append(row['id'])
+    assert sorted(seen) == list(range(1003))
+
+
+def test_shard_of_more_workers_than_rows_is_empty(tmp_path):
+    path = tmp_path / 'small.tsv'
+    path.write_text('id\tname\n1\ta\n2\tb\n')
+    assert len(ff_locust.FF_Table_Cache.parse_tsv(path, (5, 8, 'strided'))) == 0
+    assert len(ff_locust.FF_Table_Cache.parse_tsv(path, (5, 8, 'contiguous'))) == 0
+    assert len(ff_locust.FF_Table_Cache.parse_tsv(path, (1, 8, 'strided'))) == 1
+
+
+@pytest.mark.parametrize('index, count', [('x', '4'), ('4', '4'), ('-1', '4'), ('0', '0')])
+def test_invalid_worker_share_is_logged_and_ignored(make_ff, index, count):
+    ff = make_ff(FF_TABLE_PARTITION='strided', FF_WORKER_INDEX=index, FF_WORKER_COUNT=count)
+    logged = []
+    ff.ff_log = logged.append
+    assert ff.get_worker_share() is None
+    ff.set_table_partition()
+    assert ff.table_cache.shard is None
+    assert any('FF_WORKER_INDEX' in entry['description'] for entry in logged if isinstance(entry, dict))
+
+
+def test_worker_share(make_ff):
+    ff = make_ff(FF_TABLE_PARTITION='contiguous', FF_WORKER_INDEX=2, FF_WORKER_COUNT=4)
+    assert ff.get_worker_share() == (2, 4)
+    ff.set_table_partition()
+    assert ff.table_cache.shard == (2, 4, 'contiguous')
+
+
+@pytest.mark.parametrize('mode', ['strided', 'contiguous'])
+@pytest.mark.parametrize('stream', [False, True])
+def test_index_is_the_row_of_the_whole_table_on_every_worker(users_tsv, mode, stream):
+    handed_out = []
+    for index in range(3):
+        env = dict(FF_TABLE_PARTITION=mode, FF_WORKER_INDEX=index, FF_WORKER_COUNT=3)
+        if stream:
+            env['FF_TABLE_STREAM_MIN_BYTES'] = 1
+        with bench.ff_instance(**env) as ff:
+            ff.ff_log = lambda line: None
+            ff.set_table_partition()
+            rows = []
+            row = ff.get_data_next(str(users_tsv), looping=False)
+            while row:
+                rows.append(row)
+                row = ff.get_data_next(str(users_tsv), looping=False)
+            rows += ff.get_data_random_many(str(users_tsv), 5)
+            assert all(row['__index'] == row['id'] for row in rows)
+            assert rows[0]['__list_count'] == len(rows) - 5
+            handed_out.extend(row['__index'] for row in rows[:-5])
+    assert sorted(handed_out) == list(range(1003))
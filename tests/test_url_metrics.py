@@ -0,0 +1,39 @@
+# url metrics: aggregate mode fields
+import json
+
+import ff_locust
+
+
+def test_aggregated_fields_named_like_per_request_fields_are_sums():
+    emitted = []
+    aggregator = ff_locust.FF_Url_Aggregator(lambda fields, tags: emitted.append((fields, tags)), interval_s=3600)
+    for response_time, response_length in ((10, 100), (20, 200), (31, 300)):
+        aggregator.add('/api/item', 'GET', True, response_time, response_length)
+    aggregator.add('/api/item', 'GET', False, 500, 0)
+    aggregator.close()
+    fields, tags = emitted[0]
+    assert tags == {"operation": "/api/item", "method": "GET", "is_success": True}
+    assert fields['request_count'] == 3
+    assert fields['total_time_ms'] == 61
+    assert fields['mean_time_ms'] == 21
+    assert fields['total_time_ms_min'] == 10
+    assert fields['total_time_ms_max'] == 31
+    assert fields['content_length_bytes'] == 600
+    assert 'content_length_bytes_total' not in fields
+    assert fields['mean_content_length_bytes'] == 200
+    fields, tags = emitted[1]
+    assert tags['is_error'] is True
+    assert (fields['request_count'], fields['total_time_ms'], fields['mean_time_ms']) == (1, 500, 500)
+
+
+def test_aggregates_are_their_own_measurement(make_ff):
+    ff = make_ff(FF_URL_METRIC_MODE='both', FF_URL_METRIC_INTERVAL_S=3600)
+    logged = []
+    ff.ff_log = logged.append
+    ff.hook_request_success('GET', '/api/item', 12.3, 512)
+    ff.hook_request_success('GET', '/api/item', 20.0, 100)
+    ff.url_aggregator.flush()
+    metrics = [json.loads(line) for line in logged]
+    assert [metric['measurement'] for metric in metrics] == ['url', 'url', 'url_agg']
+    assert [metric['fields']['total_time_ms'] for metric in metrics] == [13, 20, 33]
+    assert metrics[2]['tags'] == metrics[0]['tags']